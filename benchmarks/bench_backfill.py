@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import random
+
+import click
+
+from capacity import PlacementStrategy
+from entity import NewJob, NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock
+
+
+async def replay(arrivals, nodes: int, strategy: PlacementStrategy, backfill: bool):
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, strategy=strategy, backfill=backfill, clock=clock)
+    await scheduler.add_nodes([NewNode(jobs_capacity=16, cpu_capacity=16.0, memory_capacity=1 << 20)] * nodes)
+    position = 0
+    while position < len(arrivals) or len(scheduler.pending_jobs) or scheduler._completion_times:
+        batch = []
+        while position < len(arrivals) and arrivals[position][0] <= clock.now:
+            _, requests_cpu, expected_run_time = arrivals[position]
+            batch.append(NewJob(expected_run_time=expected_run_time, requests_cpu=requests_cpu, requests_memory=1))
+            position += 1
+        if batch:
+            await scheduler.new_jobs(batch)
+        await scheduler._tick()
+        clock.now += 1
+    waits = {}
+    for job in await scheduler.get_jobs():
+        waits.setdefault(job.requests_cpu == 16.0, []).append(job.started_at - job.created_at)
+    return clock.now, waits
+
+
+def summary(waits) -> str:
+    waits = sorted(waits)
+    return f"mean={sum(waits) / len(waits):7.1f}s p95={waits[int(0.95 * len(waits))]:7.1f}s max={waits[-1]:7.1f}s"
+
+
+@click.command()
+@click.option('--jobs', default=2500)
+@click.option('--duration', default=3000, help='arrival window in seconds')
+@click.option('--nodes', default=20, help='number of 16 cpu nodes')
+@click.option('--strategy', default='spread', type=click.Choice(PlacementStrategy))
+@click.option('--seed', default=3)
+def run(jobs, duration, nodes, strategy, seed):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    rng = random.Random(seed)
+    arrivals = sorted((rng.randrange(duration), rng.choice([1.0, 1.0, 1.0, 2.0, 4.0, 16.0]), rng.randint(10, 200))
+                      for _ in range(jobs))
+    print(f"jobs={jobs} nodes={nodes} strategy={strategy}")
+    for backfill in (False, True):
+        makespan, waits = asyncio.run(replay(arrivals, nodes, strategy, backfill))
+        print(f"backfill={backfill!s:5}: makespan={makespan:.0f}s")
+        print(f"  whole-node jobs: {summary(waits[True])}")
+        print(f"  other jobs:      {summary(waits[False])}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,54 @@
+import asyncio
+from time import perf_counter
+
+import click
+import httpx
+from fastapi import FastAPI
+
+from scheduler import Scheduler
+from storage import StorageType
+from webserver import register_urls
+
+NEW_JOB = {"expected_run_time": 60, "requests_cpu": 1.0, "requests_memory": 256}
+
+
+def make_client():
+    app = FastAPI()
+    register_urls(app, Scheduler(StorageType.MEMORY))
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench')
+
+
+async def submit_single(jobs: int, concurrency: int) -> float:
+    async with make_client() as client:
+        async def worker(count):
+            for _ in range(count):
+                response = await client.post('/jobs', json=NEW_JOB)
+                assert response.status_code == 201
+
+        started = perf_counter()
+        await asyncio.gather(*(worker(jobs // concurrency) for _ in range(concurrency)))
+        return perf_counter() - started
+
+
+async def submit_batch(jobs: int, batch_size: int) -> float:
+    async with make_client() as client:
+        started = perf_counter()
+        for _ in range(jobs // batch_size):
+            response = await client.post('/jobs:batch', json=[NEW_JOB] * batch_size)
+            assert response.status_code == 201
+        return perf_counter() - started
+
+
+@click.command()
+@click.option('--jobs', default=20000, help='jobs submitted per scenario')
+@click.option('--concurrency', default=16, help='concurrent single-item submitters')
+@click.option('--batch-size', default=1000)
+def run(jobs, concurrency, batch_size):
+    single = asyncio.run(submit_single(jobs, concurrency))
+    batch = asyncio.run(submit_batch(jobs, batch_size))
+    print(f"POST /jobs:       {jobs / single:,.0f} jobs/sec")
+    print(f"POST /jobs:batch: {jobs / batch:,.0f} jobs/sec (batch size {batch_size})")
+
+
+if __name__ == '__main__':
+    run()
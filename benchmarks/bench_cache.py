@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import random
+from time import perf_counter
+
+import click
+
+from entity import NewNode
+from metrics import STORAGE_METHODS
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock, emit, percentiles, synthetic_arrivals
+
+
+def delay(storage, latency: float, calls: list):
+    # Every call on this instance pays a round trip, like a backend across the network.
+    def delayed(method):
+        async def wrapper(*args, **kwargs):
+            calls.append(method.__name__)
+            await asyncio.sleep(latency)
+            return await method(*args, **kwargs)
+        return wrapper
+
+    for name in STORAGE_METHODS + ('get_job_ids',):
+        if name != 'flush':
+            setattr(storage, name, delayed(getattr(storage, name)))
+
+
+async def measure(cache_size: int, latency: float, jobs: int, nodes: int, ticks: int, reads: int,
+                  concurrency: int, seed: int) -> dict:
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False, clock=clock, cache_size=cache_size)
+    storage = scheduler._storage
+    calls = []
+    delay(storage._storage if cache_size else storage, latency, calls)
+    node_ids = await scheduler.add_nodes([NewNode(jobs_capacity=16, cpu_capacity=16.0, memory_capacity=1 << 20)]
+                                         * nodes)
+    arrivals = [job for _, job in synthetic_arrivals(jobs, 1, seed)]
+    rng = random.Random(seed)
+    job_ids = []
+    tick_times, read_times = [], []
+    started = perf_counter()
+    for tick in range(ticks):
+        job_ids += await scheduler.new_jobs(arrivals[tick * jobs // ticks:(tick + 1) * jobs // ticks])
+        tick_started = perf_counter()
+        await scheduler._tick()
+        tick_times.append(perf_counter() - tick_started)
+        clock.now += 60
+        # Clients mostly look at jobs they just submitted, now and then at an old one or a node.
+        recent = job_ids[-max(len(job_ids) // 10, 1):]
+        remaining = iter(range(reads))
+
+        async def reader():
+            for _ in remaining:
+                read_started = perf_counter()
+                if rng.random() < 0.1:
+                    await scheduler.get_node(rng.choice(node_ids))
+                else:
+                    await scheduler.get_job(rng.choice(recent if rng.random() < 0.8 else job_ids))
+                read_times.append(perf_counter() - read_started)
+
+        await asyncio.gather(*(reader() for _ in range(concurrency)))
+    await scheduler.flush()
+    elapsed = perf_counter() - started
+    result = {'seconds': elapsed, 'backend_calls': len(calls),
+              'backend_calls_by_method': {name: calls.count(name) for name in sorted(set(calls))},
+              'tick_ms': percentiles(tick_times, 1000), 'read_ms': percentiles(read_times, 1000)}
+    if cache_size:
+        hits = sum(storage.hits.series.values())
+        result['hit_rate'] = hits / (hits + sum(storage.misses.series.values()))
+        result['flushes'] = storage.flushes.value()
+    scheduler.close()
+    return result
+
+
+@click.command()
+@click.option('--latency', default=0.002, help='seconds per backend call')
+@click.option('--cache-size', 'cache_sizes', multiple=True, type=int, default=[1000, 10000, 100000],
+              help='may be repeated, an uncached run is always included')
+@click.option('--jobs', default=100000)
+@click.option('--nodes', default=200, help='number of 16 slot nodes')
+@click.option('--ticks', default=100)
+@click.option('--reads', default=200, help='job and node reads between ticks')
+@click.option('--concurrency', default=16, help='concurrent readers')
+@click.option('--seed', default=1)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(latency, cache_sizes, jobs, nodes, ticks, reads, concurrency, seed, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    results = {f'cache_{size}' if size else 'uncached': asyncio.run(
+        measure(size, latency, jobs, nodes, ticks, reads, concurrency, seed)) for size in [0, *cache_sizes]}
+    params = dict(latency=latency, jobs=jobs, nodes=nodes, ticks=ticks, reads=reads, concurrency=concurrency,
+                  seed=seed)
+    emit('cache', params, results, output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,97 @@
+import random
+from time import perf_counter
+
+import click
+
+from capacity import CapacityIndex
+from entity import Job, JobStatus, Node
+from scheduler import fit_available
+
+
+def make_nodes(count: int, rng: random.Random):
+    return [Node(
+        id=str(i),
+        jobs_capacity=rng.choice([8, 16, 32]),
+        jobs_allocated=0,
+        cpu_capacity=rng.choice([4.0, 8.0, 16.0, 32.0]),
+        cpu_allocated=0,
+        memory_capacity=rng.choice([4096, 8192, 16384, 65536]),
+        memory_allocated=0
+    ) for i in range(count)]
+
+
+def make_jobs(count: int, rng: random.Random):
+    return [Job(
+        id=str(i),
+        status=JobStatus.NEW,
+        expected_run_time=rng.randint(10, 3600),
+        requests_cpu=rng.choice([0.5, 1.0, 2.0, 4.0, 8.0]),
+        requests_memory=rng.choice([256, 512, 1024, 4096, 8192]),
+        created_at=0,
+        started_at=None
+    ) for i in range(count)]
+
+
+def allocate(node: Node, job: Job):
+    node.jobs_allocated += 1
+    node.cpu_allocated += job.requests_cpu
+    node.memory_allocated += job.requests_memory
+
+
+def tick_linear(jobs, nodes):
+    placements = []
+    for job in jobs:
+        available_nodes = fit_available(job, nodes)
+        if len(available_nodes) > 0:
+            allocate(available_nodes[0], job)
+            placements.append((job.id, available_nodes[0].id))
+    return placements
+
+
+def tick_indexed(jobs, nodes):
+    index = CapacityIndex(len(nodes))
+    by_id = {}
+    for node in nodes:
+        index.add(node)
+        by_id[node.id] = node
+    placements = []
+    for job in jobs:
+        node_id = index.fit(job)
+        if node_id is not None:
+            node = by_id[node_id]
+            allocate(node, job)
+            index.update(node)
+            placements.append((job.id, node_id))
+    return placements
+
+
+@click.command()
+@click.option('--nodes', default=10000, help='number of synthetic nodes')
+@click.option('--jobs', default=100000, help='number of pending jobs in one tick')
+@click.option('--sample', default=2000, help='jobs timed on the linear path, the rest is extrapolated')
+@click.option('--seed', default=1)
+def run(nodes, jobs, sample, seed):
+    rng = random.Random(seed)
+    node_template = make_nodes(nodes, rng)
+    pending = make_jobs(jobs, rng)
+
+    sample = min(sample, jobs)
+    linear_nodes = [node.model_copy() for node in node_template]
+    started = perf_counter()
+    linear = tick_linear(pending[:sample], linear_nodes)
+    linear_time = (perf_counter() - started) * jobs / sample
+
+    indexed_nodes = [node.model_copy() for node in node_template]
+    started = perf_counter()
+    indexed = tick_indexed(pending, indexed_nodes)
+    indexed_time = perf_counter() - started
+
+    assert linear == indexed[:len(linear)], "index placements diverge from fit_available"
+    print(f"nodes={nodes} jobs={jobs} placed={len(indexed)}")
+    print(f"fit_available tick: {linear_time:.3f}s (extrapolated from {sample} jobs)")
+    print(f"CapacityIndex tick: {indexed_time:.3f}s")
+    print(f"speedup: {linear_time / indexed_time:.1f}x")
+
+
+if __name__ == '__main__':
+    run()
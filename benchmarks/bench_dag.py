@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import random
+from time import perf_counter
+from typing import List
+
+import click
+
+from entity import JobStatus, NewJob, NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock, emit, percentiles
+
+
+def layered_dag(jobs: int, width: int, seed: int) -> List[NewJob]:
+    # Each job depends on one to three jobs of the layer before, dependencies are given by index.
+    rng = random.Random(seed)
+    dag = []
+    for index in range(jobs):
+        layer_start = index - index % width
+        previous = range(max(layer_start - width, 0), layer_start)
+        depends_on = [str(dependency) for dependency in rng.sample(previous, min(rng.randint(1, 3), len(previous)))]
+        dag.append(NewJob(expected_run_time=rng.randint(10, 120), requests_cpu=1.0, requests_memory=256,
+                          depends_on=depends_on))
+    return dag
+
+
+def critical_path(dag: List[NewJob]) -> int:
+    finish = []
+    for job in dag:
+        finish.append(max((finish[int(dependency)] for dependency in job.depends_on), default=0)
+                      + job.expected_run_time)
+    return max(finish)
+
+
+def with_ids(job: NewJob, ids: List[str]) -> NewJob:
+    return job.model_copy(update={'depends_on': [ids[int(dependency)] for dependency in job.depends_on]})
+
+
+async def run_dag(dag: List[NewJob], width: int, nodes: int) -> dict:
+    # The whole graph is submitted up front and the scheduler releases jobs as their dependencies complete.
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False, clock=clock)
+    await scheduler.add_nodes([NewNode(jobs_capacity=16, cpu_capacity=16.0, memory_capacity=1 << 20)] * nodes)
+    ids = []
+    started = perf_counter()
+    for layer in range(0, len(dag), width):
+        ids += await scheduler.new_jobs([with_ids(job, ids) for job in dag[layer:layer + width]])
+    submit_seconds = perf_counter() - started
+    tick_times = []
+    makespan = 0.0
+    while scheduler._waiting or scheduler.status()['pending'] or scheduler.status()['running']:
+        makespan = clock.now
+        tick_started = perf_counter()
+        await scheduler._tick()
+        tick_times.append(perf_counter() - tick_started)
+        clock.now = scheduler.next_schedule_time
+    result = {'makespan': makespan, 'seconds': perf_counter() - started, 'submit_seconds': submit_seconds,
+              'client_requests': len(dag) // width + (len(dag) % width > 0), 'ticks': len(tick_times),
+              'tick_ms': percentiles(tick_times, 1000)}
+    scheduler.close()
+    return result
+
+
+async def run_chained(dag: List[NewJob], nodes: int, poll_interval: float) -> dict:
+    # The client polls the jobs it submitted and submits the ones whose dependencies completed.
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False, clock=clock)
+    await scheduler.add_nodes([NewNode(jobs_capacity=16, cpu_capacity=16.0, memory_capacity=1 << 20)] * nodes)
+    unmet = [len(job.depends_on) for job in dag]
+    dependents = [[] for _ in dag]
+    for index, job in enumerate(dag):
+        for dependency in job.depends_on:
+            dependents[int(dependency)].append(index)
+    ready = [index for index, count in enumerate(unmet) if not count]
+    running = {}
+    completed = 0
+    requests = 0
+    tick_times = []
+    next_poll = 0.0
+    started = perf_counter()
+    while completed < len(dag):
+        if clock.now >= next_poll:
+            for index, job_id in list(running.items()):
+                requests += 1
+                if (await scheduler.get_job(job_id)).status == JobStatus.COMPLETED:
+                    del running[index]
+                    completed += 1
+                    for dependent in dependents[index]:
+                        unmet[dependent] -= 1
+                        if not unmet[dependent]:
+                            ready.append(dependent)
+            if ready:
+                requests += 1
+                job_ids = await scheduler.new_jobs([dag[index].model_copy(update={'depends_on': []})
+                                                    for index in ready])
+                running.update(zip(ready, job_ids))
+                ready = []
+            next_poll = clock.now + poll_interval
+        tick_started = perf_counter()
+        await scheduler._tick()
+        tick_times.append(perf_counter() - tick_started)
+        clock.now = min(scheduler.next_schedule_time, next_poll)
+    result = {'makespan': clock.now, 'seconds': perf_counter() - started, 'client_requests': requests,
+              'ticks': len(tick_times), 'tick_ms': percentiles(tick_times, 1000)}
+    scheduler.close()
+    return result
+
+
+@click.command()
+@click.option('--jobs', default=10000, help='jobs in the graph')
+@click.option('--width', default=100, help='jobs per layer, each depends on one to three of the layer before')
+@click.option('--nodes', default=10, help='number of 16 slot nodes')
+@click.option('--poll-interval', 'poll_intervals', multiple=True, type=float, default=[5.0, 30.0],
+              help='seconds between client polls when chaining, may be repeated')
+@click.option('--seed', default=1)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(jobs, width, nodes, poll_intervals, seed, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    dag = layered_dag(jobs, width, seed)
+    results = {'critical_path': critical_path(dag), 'dag': asyncio.run(run_dag(dag, width, nodes))}
+    for interval in poll_intervals:
+        results[f'chained_poll_{interval:g}s'] = asyncio.run(run_chained(dag, nodes, interval))
+    emit('dag', dict(jobs=jobs, width=width, nodes=nodes, poll_intervals=poll_intervals, seed=seed), results, output)
+
+
+if __name__ == '__main__':
+    run()
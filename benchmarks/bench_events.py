@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import random
+from time import time
+
+import click
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from entity import NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from webserver import register_urls
+from workload import emit, percentiles
+
+
+async def poll(client: httpx.AsyncClient, job_id: str, interval: float) -> tuple:
+    requests = 0
+    while True:
+        requests += 1
+        job = (await client.get(f'/jobs/{job_id}')).json()
+        if job['status'] == 'completed':
+            return requests, time(), job
+        await asyncio.sleep(interval)
+
+
+async def stream(client: httpx.AsyncClient, job_id: str, interval: float) -> tuple:
+    async with client.stream('GET', '/events', params={'job_id': job_id, 'status': 'completed'}) as response:
+        async for line in response.aiter_lines():
+            if line.startswith('data: '):
+                detected = time()
+                break
+    # The job is read once to learn when it should have finished, the way a polling client sees it.
+    return 1, detected, (await client.get(f'/jobs/{job_id}')).json()
+
+
+WATCHERS = {'poll': poll, 'sse': stream}
+
+
+async def measure(watch: str, port: int, jobs: int, interval: float, seed: int) -> dict:
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False)
+    await scheduler.add_nodes([NewNode(jobs_capacity=jobs, cpu_capacity=float(jobs), memory_capacity=1 << 30)])
+    app = FastAPI()
+    register_urls(app, scheduler)
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level='error', loop='asyncio'))
+    serving = asyncio.create_task(server.serve())
+    runner = asyncio.create_task(scheduler.run())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=jobs + 10)
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits, timeout=None) as client:
+        job_ids = (await client.post('/jobs:batch', json=[
+            {'expected_run_time': rng.randint(1, 5), 'requests_cpu': 1.0, 'requests_memory': 1}
+            for _ in range(jobs)])).json()['ids']
+        watched = await asyncio.gather(*(WATCHERS[watch](client, job_id, interval) for job_id in job_ids))
+    server.should_exit = True
+    await serving
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    scheduler.close()
+    requests = sum(count for count, _, _ in watched)
+    lags = [detected - job['started_at'] - job['expected_run_time'] for _, detected, job in watched]
+    return {'requests': requests, 'requests_per_job': requests / jobs, 'detection_lag_ms': percentiles(lags, 1000)}
+
+
+@click.command()
+@click.option('--jobs', default=500, help='jobs of 1 to 5 seconds, each watched by one client')
+@click.option('--interval', default=0.5, help='seconds between polls')
+@click.option('--port', default=18081)
+@click.option('--seed', default=1)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(jobs, interval, port, seed, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    results = {watch: asyncio.run(measure(watch, port, jobs, interval, seed)) for watch in WATCHERS}
+    emit('events', dict(jobs=jobs, interval=interval, port=port, seed=seed), results, output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,92 @@
+import heapq
+import random
+from statistics import mean, quantiles
+
+import click
+
+from capacity import CapacityIndex
+from entity import Job, JobStatus, Node
+from queues import QueueType, get_queue
+from scheduler import allocate_resources, release_resources
+
+
+def make_workload(rng: random.Random, jobs: int, duration: int, skew: float, tenants: int):
+    # The heavy tenant dumps its whole share at once, the others trickle in over the run.
+    workload = []
+    for i in range(jobs):
+        if rng.random() < skew:
+            tenant, arrival = 'heavy', 0
+        else:
+            tenant, arrival = f'light-{rng.randrange(tenants)}', rng.randrange(duration)
+        workload.append((arrival, Job(
+            id=str(i),
+            status=JobStatus.NEW,
+            expected_run_time=rng.randint(5, 60),
+            requests_cpu=1.0,
+            requests_memory=256,
+            created_at=arrival,
+            started_at=None,
+            priority=0,
+            tenant=tenant
+        )))
+    workload.sort(key=lambda item: item[0])
+    return workload
+
+
+def simulate(queue_type: QueueType, workload, nodes: int, slots: int):
+    queue = get_queue(queue_type)
+    capacity = CapacityIndex()
+    cluster = {}
+    for i in range(nodes):
+        node = Node(id=str(i), jobs_capacity=slots, jobs_allocated=0, cpu_capacity=float(slots),
+                    cpu_allocated=0, memory_capacity=256 * slots, memory_allocated=0)
+        cluster[node.id] = node
+        capacity.add(node)
+    jobs = {job.id: job for _, job in workload}
+    completions = []
+    waits = {}
+    arrivals = iter(workload)
+    next_arrival = next(arrivals, None)
+    now = 0
+    while next_arrival is not None or queue or completions:
+        while completions and completions[0][0] <= now:
+            _, job_id, node_id = heapq.heappop(completions)
+            capacity.update(release_resources(cluster[node_id], jobs[job_id]))
+        while next_arrival is not None and next_arrival[0] <= now:
+            queue.push(next_arrival[1])
+            next_arrival = next(arrivals, None)
+        for job, node_id in capacity.place([jobs[job_id] for job_id in queue]):
+            allocate_resources(cluster[node_id], job)
+            queue.remove(job.id)
+            queue.charge(job)
+            waits.setdefault(job.tenant, []).append(now - job.created_at)
+            heapq.heappush(completions, (now + job.expected_run_time, job.id, node_id))
+        candidates = [time for time in (completions[0][0] if completions else None,
+                                        next_arrival[0] if next_arrival else None) if time is not None]
+        now = max(now + 1, min(candidates)) if candidates else now + 1
+    return waits
+
+
+@click.command()
+@click.option('--jobs', default=10000)
+@click.option('--nodes', default=50)
+@click.option('--slots', default=4, help='job slots per node')
+@click.option('--duration', default=1000, help='arrival window of the light tenants in seconds')
+@click.option('--skew', default=0.8, help='share of jobs submitted by the heavy tenant')
+@click.option('--tenants', default=4, help='number of light tenants')
+@click.option('--seed', default=1)
+def run(jobs, nodes, slots, duration, skew, tenants, seed):
+    workload = make_workload(random.Random(seed), jobs, duration, skew, tenants)
+    print(f"jobs={jobs} nodes={nodes} slots={slots} skew={skew} light tenants={tenants}")
+    for queue_type in QueueType:
+        waits = simulate(queue_type, workload, nodes, slots)
+        print(f"{queue_type}:")
+        for tenant in sorted(waits):
+            tenant_waits = waits[tenant]
+            p95 = quantiles(tenant_waits, n=20)[-1]
+            print(f"  {tenant:>8}: jobs={len(tenant_waits):6d} mean wait={mean(tenant_waits):9.1f}s "
+                  f"p95={p95:9.1f}s max={max(tenant_waits):9.1f}s")
+
+
+if __name__ == '__main__':
+    run()
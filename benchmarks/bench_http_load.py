@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import random
+from time import perf_counter
+
+import click
+import httpx
+from fastapi import FastAPI
+
+from bench_tick import make_scheduler
+from entity import NewJob, NewNode
+from storage import StorageType
+from webserver import register_urls
+from workload import emit, percentiles
+
+NEW_JOB = {'expected_run_time': 2, 'requests_cpu': 1.0, 'requests_memory': 256}
+BATCH_SIZE = 100
+
+
+async def submit(client: httpx.AsyncClient, rng: random.Random, job_ids: list):
+    response = await client.post('/jobs', json=NEW_JOB)
+    job_ids.append(response.json()['id'])
+    return response
+
+
+async def batch(client: httpx.AsyncClient, rng: random.Random, job_ids: list):
+    response = await client.post('/jobs:batch', json=[NEW_JOB] * BATCH_SIZE)
+    job_ids.extend(response.json()['ids'])
+    return response
+
+
+async def get(client: httpx.AsyncClient, rng: random.Random, job_ids: list):
+    return await client.get(f'/jobs/{rng.choice(job_ids)}')
+
+
+async def listing(client: httpx.AsyncClient, rng: random.Random, job_ids: list):
+    return await client.get('/jobs', params={'status': 'running', 'limit': 100})
+
+
+async def metrics(client: httpx.AsyncClient, rng: random.Random, job_ids: list):
+    return await client.get('/metrics')
+
+
+async def mixed(client: httpx.AsyncClient, rng: random.Random, job_ids: list):
+    request = rng.choices([get, submit, listing], weights=[7, 2, 1])[0]
+    return await request(client, rng, job_ids)
+
+
+SCENARIOS = {'submit': submit, 'batch': batch, 'get': get, 'list': listing, 'metrics': metrics, 'mixed': mixed}
+
+
+async def measure(storage_type: StorageType, url: str | None, scenarios, jobs: int, nodes: int, requests: int,
+                  concurrency: int, seed: int) -> dict:
+    scheduler = make_scheduler(storage_type, url)
+    await scheduler.add_nodes([NewNode(jobs_capacity=max(jobs // nodes, 1), cpu_capacity=1024.0,
+                                       memory_capacity=1 << 30)] * nodes)
+    job_ids = await scheduler.new_jobs([NewJob(**NEW_JOB)] * jobs)
+    app = FastAPI()
+    register_urls(app, scheduler)
+    runner = asyncio.create_task(scheduler.run())
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        for name in scenarios:
+            request = SCENARIOS[name]
+            rng = random.Random(seed)
+            latencies = []
+            remaining = iter(range(requests))
+
+            async def worker():
+                for _ in remaining:
+                    started = perf_counter()
+                    response = await request(client, rng, job_ids)
+                    latencies.append(perf_counter() - started)
+                    response.raise_for_status()
+
+            started = perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = perf_counter() - started
+            results[name] = {'requests': requests, 'requests_per_second': requests / elapsed,
+                             'latency_ms': percentiles(latencies, 1000)}
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    scheduler._storage.close()
+    return results
+
+
+@click.command()
+@click.option('--storage', default='memory', type=click.Choice(StorageType))
+@click.option('--storage-url', default=None, help="connection url, 'fakeredis://' for an in-process redis")
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS)),
+              help='may be repeated, all scenarios by default')
+@click.option('--jobs', default=10000, help='jobs submitted before the scenarios run')
+@click.option('--nodes', default=100)
+@click.option('--requests', default=2000, help='requests per scenario')
+@click.option('--concurrency', default=16, help='concurrent clients')
+@click.option('--seed', default=1)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(storage, storage_url, scenarios, jobs, nodes, requests, concurrency, seed, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    scenarios = scenarios or list(SCENARIOS)
+    results = asyncio.run(measure(storage, storage_url, scenarios, jobs, nodes, requests, concurrency, seed))
+    params = dict(storage=storage, scenarios=scenarios, jobs=jobs, nodes=nodes, requests=requests,
+                  concurrency=concurrency, seed=seed)
+    emit('http_load', params, results, output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import tracemalloc
+from time import perf_counter
+
+import click
+
+from entity import NewJob, NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock, emit, percentiles
+
+
+async def measure(arrays: int, tasks: int, nodes: int, run_time: int) -> dict:
+    # The same tasks either as `tasks` jobs each for every array or as `arrays` job arrays.
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False, clock=clock)
+    await scheduler.add_nodes([NewNode(jobs_capacity=16, cpu_capacity=16.0, memory_capacity=1 << 20)] * nodes)
+    if arrays:
+        new_jobs = [NewJob(expected_run_time=run_time, requests_cpu=1.0, requests_memory=256, tasks=tasks)] * arrays
+    else:
+        new_jobs = [NewJob(expected_run_time=run_time, requests_cpu=1.0, requests_memory=256)] * tasks
+    tracemalloc.start()
+    started = perf_counter()
+    await scheduler.new_jobs(new_jobs)
+    submit_seconds = perf_counter() - started
+    submitted_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tick_times = []
+    stored = []
+    started = perf_counter()
+    while scheduler.status()['pending'] or scheduler.status()['running']:
+        tick_started = perf_counter()
+        await scheduler._tick()
+        tick_times.append(perf_counter() - tick_started)
+        stored.append(len(scheduler._storage.jobs))
+        clock.now = scheduler.next_schedule_time
+    result = {'submit_seconds': submit_seconds, 'submitted_mib': submitted_bytes / (1 << 20),
+              'schedule_seconds': perf_counter() - started, 'ticks': len(tick_times),
+              'tick_ms': percentiles(tick_times, 1000), 'max_stored_jobs': max(stored),
+              'stored_jobs_at_end': stored[-1], 'makespan': clock.now}
+    scheduler.close()
+    return result
+
+
+@click.command()
+@click.option('--tasks', default=200000, help='total tasks')
+@click.option('--arrays', 'array_counts', multiple=True, type=int, default=[1, 100],
+              help='number of arrays the tasks are split into, may be repeated; separate jobs always run')
+@click.option('--nodes', default=100, help='number of 16 slot nodes')
+@click.option('--run-time', default=60)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(tasks, array_counts, nodes, run_time, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    results = {'jobs': asyncio.run(measure(0, tasks, nodes, run_time))}
+    for arrays in array_counts:
+        results[f'arrays_{arrays}'] = asyncio.run(measure(arrays, tasks // arrays, nodes, run_time))
+    emit('job_arrays', dict(tasks=tasks, arrays=array_counts, nodes=nodes, run_time=run_time), results, output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,75 @@
+import asyncio
+import multiprocessing
+from time import perf_counter, sleep
+
+import click
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from entity import NewJob
+from scheduler import Scheduler
+from storage import StorageType
+from webserver import register_urls
+
+
+def serve(port: int, jobs: int, ready):
+    scheduler = Scheduler(StorageType.MEMORY)
+    batch = [NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=256)] * 10000
+    for _ in range(jobs // len(batch)):
+        asyncio.run(scheduler.new_jobs(batch))
+    app = FastAPI()
+    register_urls(app, scheduler)
+    ready.set()
+    uvicorn.run(app, port=port, log_level='error')
+
+
+def memory_kb(pid: int, field: str) -> int:
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1])
+    return 0
+
+
+def reset_peak(pid: int):
+    with open(f'/proc/{pid}/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+
+
+def measure(port: int, params: dict, pid: int):
+    reset_peak(pid)
+    baseline = memory_kb(pid, 'VmRSS')
+    started = perf_counter()
+    first_byte = None
+    size = 0
+    with httpx.stream('GET', f'http://127.0.0.1:{port}/jobs', params=params, timeout=None) as response:
+        for chunk in response.iter_bytes():
+            if first_byte is None:
+                first_byte = perf_counter() - started
+            size += len(chunk)
+    total = perf_counter() - started
+    peak = memory_kb(pid, 'VmHWM') - baseline
+    return first_byte, total, peak, size
+
+
+@click.command()
+@click.option('--jobs', default=1000000)
+@click.option('--port', default=18080)
+def run(jobs, port):
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(port, jobs, ready), daemon=True)
+    server.start()
+    ready.wait()
+    sleep(1)
+    try:
+        for name, params in (('json', {}), ('ndjson', {'format': 'ndjson'})):
+            first_byte, total, peak, size = measure(port, params, server.pid)
+            print(f"{name:<7} ttfb={first_byte:.3f}s total={total:.3f}s "
+                  f"peak_rss_growth={peak / 1024:.0f}MiB body={size / 2 ** 20:.0f}MiB")
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    run()
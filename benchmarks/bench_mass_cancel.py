@@ -0,0 +1,48 @@
+import asyncio
+import random
+from time import perf_counter
+
+import click
+
+from entity import NewJob, NewNode
+from scheduler import Scheduler
+from storage import StorageType
+
+NEW_JOB = NewJob(expected_run_time=3600, requests_cpu=1.0, requests_memory=256)
+
+
+async def delete_queued(jobs: int, seed: int) -> float:
+    scheduler = Scheduler(StorageType.MEMORY)
+    job_ids = await scheduler.new_jobs([NEW_JOB] * jobs)
+    random.Random(seed).shuffle(job_ids)
+    started = perf_counter()
+    for job_id in job_ids:
+        await scheduler.delete_job(job_id)
+    return perf_counter() - started
+
+
+async def terminate_running(jobs: int, nodes: int, seed: int) -> float:
+    scheduler = Scheduler(StorageType.MEMORY)
+    await scheduler.add_nodes([NewNode(jobs_capacity=jobs // nodes, cpu_capacity=float(jobs),
+                                       memory_capacity=jobs * 256)] * nodes)
+    job_ids = await scheduler.new_jobs([NEW_JOB] * jobs)
+    await scheduler._tick()
+    random.Random(seed).shuffle(job_ids)
+    started = perf_counter()
+    for job_id in job_ids:
+        await scheduler.terminate_job(job_id)
+    return perf_counter() - started
+
+
+@click.command()
+@click.option('--jobs', default=100000)
+@click.option('--nodes', default=10)
+@click.option('--seed', default=1)
+def run(jobs, nodes, seed):
+    print(f"delete {jobs} queued jobs: {asyncio.run(delete_queued(jobs, seed)):.3f}s")
+    print(f"terminate {jobs} running jobs on {nodes} nodes: "
+          f"{asyncio.run(terminate_running(jobs, nodes, seed)):.3f}s")
+
+
+if __name__ == '__main__':
+    run()
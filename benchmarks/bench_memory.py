@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import tracemalloc
+
+import click
+
+from entity import Job, JobRecord, JobStatus, NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock, emit, synthetic_arrivals
+
+
+def traced(build):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def bytes_per_object(new_jobs, model) -> float:
+    def build():
+        return [model(id=str(position), status=JobStatus.NEW, expected_run_time=job.expected_run_time,
+                      requests_cpu=job.requests_cpu, requests_memory=job.requests_memory,
+                      created_at=1.7e9 + position, started_at=None, priority=job.priority, tenant=job.tenant)
+                for position, job in enumerate(new_jobs)]
+    return traced(build) / len(new_jobs)
+
+
+async def retained(new_jobs, nodes: int) -> dict:
+    # Bytes held by scheduler and memory storage per job, as jobs go from pending to running to done.
+    clock = Clock()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False, clock=clock)
+    await scheduler.new_jobs(new_jobs)
+    await scheduler._tick()
+    pending = tracemalloc.get_traced_memory()[0] - baseline
+    await scheduler.add_nodes([NewNode(jobs_capacity=len(new_jobs) // nodes + 1, cpu_capacity=float(len(new_jobs)),
+                                       memory_capacity=1 << 40)] * nodes)
+    await scheduler._tick()
+    running = tracemalloc.get_traced_memory()[0] - baseline
+    clock.now += max(job.expected_run_time for job in new_jobs)
+    await scheduler._tick()
+    completed = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return {state: used / len(new_jobs) for state, used in
+            (('pending', pending), ('running', running), ('completed', completed))}
+
+
+@click.command()
+@click.option('--jobs', default=100000)
+@click.option('--nodes', default=100)
+@click.option('--seed', default=1)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(jobs, nodes, seed, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    new_jobs = [job for _, job in synthetic_arrivals(jobs, 1, seed)]
+    results = {
+        'object_bytes_per_job': {'model': bytes_per_object(new_jobs, Job),
+                                 'record': bytes_per_object(new_jobs, JobRecord)},
+        'scheduler_bytes_per_job': asyncio.run(retained(new_jobs, nodes)),
+    }
+    results['scheduler_mib_per_1m_jobs'] = {state: used * 1_000_000 / (1 << 20)
+                                            for state, used in results['scheduler_bytes_per_job'].items()}
+    emit('memory', dict(jobs=jobs, nodes=nodes, seed=seed), results, output)
+
+
+if __name__ == '__main__':
+    run()
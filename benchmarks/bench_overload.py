@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from time import perf_counter
+
+import click
+import httpx
+from fastapi import FastAPI
+
+from entity import NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from webserver import register_urls
+from workload import emit, percentiles
+
+NEW_JOB = {'expected_run_time': 2, 'requests_cpu': 1.0, 'requests_memory': 256}
+
+
+async def measure(limits: dict, nodes: int, clients: int, batch: int, duration: float) -> dict:
+    # Clients submit batches as fast as they are answered and back off for Retry-After when refused,
+    # a probe reads a job every 10 ms. The cluster drains far less than is offered.
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False, **limits)
+    await scheduler.add_nodes([NewNode(jobs_capacity=16, cpu_capacity=16.0, memory_capacity=1 << 20)] * nodes)
+    app = FastAPI()
+    register_urls(app, scheduler)
+    runner = asyncio.create_task(scheduler.run())
+    accepted, refused, max_pending = [], [], [0]
+    probe_latencies = []
+    job_ids = []
+    deadline = perf_counter() + duration
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        async def submitter():
+            while perf_counter() < deadline:
+                started = perf_counter()
+                response = await client.post('/jobs:batch', json=[NEW_JOB] * batch)
+                latency = perf_counter() - started
+                if response.status_code == 429:
+                    refused.append(latency)
+                    await asyncio.sleep(min(float(response.headers['Retry-After']), deadline - perf_counter()))
+                    continue
+                response.raise_for_status()
+                accepted.append(latency)
+                job_ids.extend(response.json()['ids'][:1])
+                max_pending[0] = max(max_pending[0], scheduler.status()['pending'])
+                # The in-process transport never waits on a socket, let the others have their turn.
+                await asyncio.sleep(0)
+
+        async def probe():
+            # Latency counts from when the read was due, so time the loop spent stuck in a tick shows.
+            due = perf_counter()
+            while due < deadline:
+                await asyncio.sleep(max(due - perf_counter(), 0))
+                if job_ids:
+                    (await client.get(f'/jobs/{job_ids[-1]}')).raise_for_status()
+                    probe_latencies.append(perf_counter() - due)
+                due += 0.01
+
+        await asyncio.gather(probe(), *(submitter() for _ in range(clients)))
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    result = {'accepted_batches': len(accepted), 'refused_batches': len(refused),
+              'accepted_ms': percentiles(accepted, 1000), 'refused_ms': percentiles(refused, 1000),
+              'probe_ms': percentiles(probe_latencies, 1000), 'max_pending': max_pending[0],
+              'pending_at_end': scheduler.status()['pending'], 'started_jobs': scheduler.next_job_id - 1
+              - scheduler.status()['pending']}
+    scheduler.close()
+    return result
+
+
+@click.command()
+@click.option('--nodes', default=10, help='number of 16 slot nodes, jobs run 2 seconds')
+@click.option('--clients', default=32, help='concurrent submitting clients')
+@click.option('--batch', default=100, help='jobs per submission')
+@click.option('--duration', default=20.0, help='seconds of overload per run')
+@click.option('--max-pending', default=2000)
+@click.option('--submit-rate', default=200.0)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(nodes, clients, batch, duration, max_pending, submit_rate, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    runs = {'unlimited': {}, 'max_pending': {'max_pending': max_pending},
+            'max_pending_and_rate': {'max_pending': max_pending, 'submit_rate': submit_rate,
+                                     'submit_burst': batch}}
+    results = {name: asyncio.run(measure(limits, nodes, clients, batch, duration)) for name, limits in runs.items()}
+    params = dict(nodes=nodes, clients=clients, batch=batch, duration=duration, max_pending=max_pending,
+                  submit_rate=submit_rate)
+    emit('overload', params, results, output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,36 @@
+import random
+from time import perf_counter
+
+import click
+
+from bench_capacity_index import make_jobs, make_nodes
+from capacity import PlacementEngine, get_capacity_index
+
+
+def tick(engine: PlacementEngine, nodes, jobs):
+    index = get_capacity_index(engine)
+    for node in nodes:
+        index.add(node)
+    started = perf_counter()
+    placements = index.place(jobs)
+    return perf_counter() - started, [(job.id, node_id) for job, node_id in placements]
+
+
+@click.command()
+@click.option('--nodes', default=10000, help='number of synthetic nodes')
+@click.option('--jobs', default=100000, help='number of pending jobs in one tick')
+@click.option('--seed', default=1)
+def run(nodes, jobs, seed):
+    rng = random.Random(seed)
+    node_template = make_nodes(nodes, rng)
+    pending = make_jobs(jobs, rng)
+    results = {}
+    for engine in PlacementEngine:
+        results[engine] = tick(engine, [node.model_copy() for node in node_template], pending)
+        print(f"{engine}: {results[engine][0]:.3f}s placed={len(results[engine][1])}")
+    assert results[PlacementEngine.INDEX][1] == results[PlacementEngine.NUMPY][1], "engines diverge"
+    print("assignments identical")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,119 @@
+import csv
+import heapq
+import random
+from time import perf_counter
+
+import click
+
+from capacity import PlacementEngine, PlacementStrategy, get_capacity_index
+from entity import Job, JobStatus, Node
+from queues import FifoQueue
+from scheduler import allocate_resources, release_resources
+
+JOB_SHAPES = [(0.5, 512), (1.0, 1024), (2.0, 2048), (4.0, 4096), (8.0, 16384), (16.0, 32768)]
+NODE_SHAPES = [(16.0, 32768), (32.0, 65536), (64.0, 262144)]
+
+
+def make_trace(rng: random.Random, jobs: int, duration: int):
+    trace = []
+    for _ in range(jobs):
+        requests_cpu, requests_memory = rng.choices(JOB_SHAPES, weights=[30, 30, 20, 10, 6, 4])[0]
+        trace.append((rng.randrange(duration), rng.randint(10, 300), requests_cpu, requests_memory))
+    trace.sort()
+    return trace
+
+
+def load_trace(path: str):
+    with open(path) as trace_file:
+        return sorted((int(row['arrival']), int(row['expected_run_time']), float(row['requests_cpu']),
+                       int(row['requests_memory'])) for row in csv.DictReader(trace_file))
+
+
+def make_cluster(rng: random.Random, nodes: int):
+    cluster = {}
+    for i in range(nodes):
+        cpu, memory = rng.choice(NODE_SHAPES)
+        cluster[str(i)] = Node(id=str(i), jobs_capacity=64, jobs_allocated=0, cpu_capacity=cpu, cpu_allocated=0,
+                               memory_capacity=memory, memory_allocated=0)
+    return cluster
+
+
+def replay(trace, cluster, engine: PlacementEngine, strategy: PlacementStrategy):
+    capacity = get_capacity_index(engine, strategy)
+    cluster = {node_id: node.model_copy() for node_id, node in cluster.items()}
+    for node in cluster.values():
+        capacity.add(node)
+    total_cpu = sum(node.cpu_capacity for node in cluster.values())
+    total_memory = sum(node.memory_capacity for node in cluster.values())
+    jobs = {}
+    queue = FifoQueue()
+    completions = []
+    cpu_time = memory_time = depth_time = 0.0
+    max_depth = 0
+    waits = []
+    position = 0
+    now = 0
+    last_arrival = trace[-1][0]
+    while position < len(trace) or queue or completions:
+        while completions and completions[0][0] <= now:
+            _, job_id, node_id = heapq.heappop(completions)
+            capacity.update(release_resources(cluster[node_id], jobs.pop(job_id)))
+        while position < len(trace) and trace[position][0] <= now:
+            arrival, expected_run_time, requests_cpu, requests_memory = trace[position]
+            job = Job(id=str(position), status=JobStatus.NEW, expected_run_time=expected_run_time,
+                      requests_cpu=requests_cpu, requests_memory=requests_memory, created_at=arrival,
+                      started_at=None)
+            jobs[job.id] = job
+            queue.push(job)
+            position += 1
+        for job, node_id in capacity.place([jobs[job_id] for job_id in queue]):
+            allocate_resources(cluster[node_id], job)
+            queue.remove(job.id)
+            waits.append(now - job.created_at)
+            heapq.heappush(completions, (now + job.expected_run_time, job.id, node_id))
+        candidates = [completions[0][0]] if completions else []
+        if position < len(trace):
+            candidates.append(trace[position][0])
+        next_time = max(now + 1, min(candidates)) if candidates else now + 1
+        if now < last_arrival:
+            # Utilization is only meaningful while the trace keeps the cluster busy.
+            span = min(next_time, last_arrival) - now
+            cpu_time += span * sum(node.cpu_allocated for node in cluster.values()) / total_cpu
+            memory_time += span * sum(node.memory_allocated for node in cluster.values()) / total_memory
+            depth_time += span * len(queue)
+        max_depth = max(max_depth, len(queue))
+        now = next_time
+    return {
+        'cpu': cpu_time / last_arrival,
+        'memory': memory_time / last_arrival,
+        'depth': depth_time / last_arrival,
+        'max_depth': max_depth,
+        'mean_wait': sum(waits) / len(waits),
+        'makespan': now,
+    }
+
+
+@click.command()
+@click.option('--trace', 'trace_path', default=None,
+              help='csv with arrival,expected_run_time,requests_cpu,requests_memory columns')
+@click.option('--jobs', default=20000, help='size of the generated trace')
+@click.option('--duration', default=3600, help='arrival window of the generated trace in seconds')
+@click.option('--nodes', default=50)
+@click.option('--engine', default='index', type=click.Choice(PlacementEngine))
+@click.option('--seed', default=1)
+def run(trace_path, jobs, duration, nodes, engine, seed):
+    rng = random.Random(seed)
+    trace = load_trace(trace_path) if trace_path else make_trace(rng, jobs, duration)
+    cluster = make_cluster(rng, nodes)
+    print(f"jobs={len(trace)} nodes={nodes} engine={engine}")
+    for strategy in PlacementStrategy:
+        started = perf_counter()
+        result = replay(trace, cluster, engine, strategy)
+        print(f"{strategy:>9}: cpu util={result['cpu']:.1%} memory util={result['memory']:.1%} "
+              f"pending mean={result['depth']:.0f} max={result['max_depth']} "
+              f"mean wait={result['mean_wait']:.0f}s makespan={result['makespan']}s "
+              f"({perf_counter() - started:.1f}s)")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import tempfile
+from time import perf_counter
+
+import click
+
+from bench_http_load import measure
+from entity import NewNode
+from persistence import SNAPSHOT_NAME
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock, emit, synthetic_arrivals
+
+BATCH = 10000
+
+
+def directory_bytes(path: str) -> dict:
+    sizes = {'snapshot': 0, 'log': 0}
+    for name in os.listdir(path):
+        sizes['snapshot' if name == SNAPSHOT_NAME else 'log'] += os.path.getsize(os.path.join(path, name))
+    return sizes
+
+
+async def build(path: str, jobs: int, nodes: int, snapshot_mib: int, seed: int) -> float:
+    # Jobs arrive in batches that each outlast the previous one, most end up completed with a
+    # cluster's worth running and the tail of the last batch still pending.
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, storage_url=path, metrics=False, clock=clock)
+    scheduler._storage._snapshot_bytes = snapshot_mib << 20
+    await scheduler.add_nodes([NewNode(jobs_capacity=64, cpu_capacity=64.0, memory_capacity=1 << 20)] * nodes)
+    new_jobs = [job for _, job in synthetic_arrivals(jobs, 1, seed)]
+    for start in range(0, jobs, BATCH):
+        await scheduler.new_jobs(new_jobs[start:start + BATCH])
+        await scheduler._tick()
+        clock.now += 600
+    if scheduler._storage._snapshot_task is not None:
+        await scheduler._storage._snapshot_task
+    return clock.now - 600
+
+
+async def restart(path: str, now: float) -> dict:
+    started = perf_counter()
+    scheduler = Scheduler(StorageType.MEMORY, storage_url=path, metrics=False, clock=Clock(now))
+    opened = perf_counter()
+    await scheduler.start()
+    recovered = perf_counter()
+    status = scheduler.status()
+    result = {'storage_open_s': opened - started, 'scheduler_start_s': recovered - opened,
+              'total_s': recovered - started, 'stored_jobs': len(scheduler._storage.jobs),
+              'running': status['running'], 'pending': status['pending']}
+    return result, scheduler
+
+
+async def recovery(path: str, jobs: int, nodes: int, snapshot_mib: int, seed: int) -> dict:
+    now = await build(path, jobs, nodes, snapshot_mib, seed)
+    results = {'after_crash': {'bytes': directory_bytes(path)}}
+    # The building scheduler is left as it is, the restart only sees what reached the log.
+    results['after_crash'].update((await restart(path, now))[0])
+    _, scheduler = await restart(path, now)
+    started = perf_counter()
+    scheduler.close()
+    results['close_snapshot_s'] = perf_counter() - started
+    results['after_close'] = {'bytes': directory_bytes(path)}
+    results['after_close'].update((await restart(path, now))[0])
+    return results
+
+
+@click.command()
+@click.option('--jobs', default=1000000)
+@click.option('--nodes', default=1000, help='number of 64 slot nodes')
+@click.option('--snapshot-mib', default=64, help='log size that triggers a background snapshot')
+@click.option('--requests', default=5000, help='requests per write scenario')
+@click.option('--concurrency', default=16, help='concurrent clients')
+@click.option('--seed', default=1)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(jobs, nodes, snapshot_mib, requests, concurrency, seed, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        results['recovery'] = asyncio.run(recovery(os.path.join(directory, 'recovery'), jobs, nodes, snapshot_mib,
+                                                   seed))
+        results['write_overhead'] = {
+            name: asyncio.run(measure(StorageType.MEMORY, url, ['submit', 'batch'], 1000, 10, requests,
+                                      concurrency, seed))
+            for name, url in (('memory', None), ('write_ahead_log', os.path.join(directory, 'write')))
+        }
+    params = dict(jobs=jobs, nodes=nodes, snapshot_mib=snapshot_mib, requests=requests, concurrency=concurrency,
+                  seed=seed)
+    emit('recovery', params, results, output)
+
+
+if __name__ == '__main__':
+    run()
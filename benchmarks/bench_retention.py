@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+
+import click
+
+from entity import NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock, emit, synthetic_stream
+
+DAY = 24 * 3600
+
+
+def rss_mib() -> float:
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+
+
+async def simulate(days: float, rate: float, nodes: int, sample_hours: float, retention: dict, seed: int) -> list:
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False, clock=clock, **retention)
+    await scheduler.add_nodes([NewNode(jobs_capacity=64, cpu_capacity=32.0, memory_capacity=1 << 20)] * nodes)
+    stream = synthetic_stream(rate, seed)
+    arrival_time, new_job = next(stream)
+    submitted = 0
+    next_sample = 0.0
+    samples = []
+    while clock.now < days * DAY:
+        if arrival_time <= clock.now:
+            await scheduler.new_job(new_job)
+            submitted += 1
+            arrival_time, new_job = next(stream)
+        await scheduler._tick()
+        if clock.now >= next_sample:
+            archive_path = retention.get('archive_path')
+            samples.append({'hours': clock.now / 3600, 'submitted': submitted,
+                            'stored_jobs': len(scheduler._storage.jobs), 'rss_mib': rss_mib(),
+                            'archive_bytes': os.path.getsize(archive_path) if archive_path else 0})
+            next_sample += sample_hours * 3600
+        clock.now = max(clock.now, min(arrival_time, scheduler.next_schedule_time))
+    scheduler.close()
+    return samples
+
+
+def run_simulation(results, name: str, *args):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    results.put((name, asyncio.run(simulate(*args))))
+
+
+@click.command()
+@click.option('--days', default=7.0, help='simulated duration')
+@click.option('--rate', default=0.5, help='job arrivals per second')
+@click.option('--nodes', default=20, help='number of 32 cpu nodes')
+@click.option('--retention-age', default=6 * 3600.0, help='seconds finished jobs stay in storage')
+@click.option('--retention-count', default=0)
+@click.option('--sample-hours', default=12.0)
+@click.option('--seed', default=1)
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(days, rate, nodes, retention_age, retention_count, sample_hours, seed, output):
+    # Every configuration runs in a fresh process so resident memory is not shared between them.
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        configurations = {
+            'keep_all': {},
+            'retention': {'retention_age': retention_age, 'retention_count': retention_count},
+            'retention_archive': {'retention_age': retention_age, 'retention_count': retention_count,
+                                  'archive_path': os.path.join(directory, 'jobs.archive')},
+        }
+        for name, retention in configurations.items():
+            process = context.Process(target=run_simulation, args=(results, name, days, rate, nodes, sample_hours,
+                                                                   retention, seed))
+            process.start()
+            name, samples = results.get()
+            process.join()
+            report[name] = samples
+    params = dict(days=days, rate=rate, nodes=nodes, retention_age=retention_age, retention_count=retention_count,
+                  seed=seed)
+    emit('retention', params, report, output)
+
+
+if __name__ == '__main__':
+    run()
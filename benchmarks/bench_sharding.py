@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from time import perf_counter
+
+import click
+
+from entity import NewJob, NewNode
+from scheduler import Scheduler
+from sharding import ShardedScheduler
+from storage import StorageType
+
+
+async def running_jobs(scheduler) -> int:
+    if isinstance(scheduler, ShardedScheduler):
+        return sum(status['running'] for status in await scheduler.status())
+    return scheduler.status()['running']
+
+
+async def measure(workers: int, storage_type: StorageType, url: str | None, jobs: int, nodes: int,
+                  batch: int) -> float:
+    if workers > 1:
+        scheduler = ShardedScheduler(workers, storage_type, url)
+    else:
+        scheduler = Scheduler(storage_type, storage_url=url)
+    runner = asyncio.create_task(scheduler.run())
+    await scheduler.add_nodes([NewNode(jobs_capacity=jobs // nodes + 1, cpu_capacity=1024.0,
+                                       memory_capacity=1 << 30)] * nodes)
+    new_jobs = [NewJob(expected_run_time=3600, requests_cpu=1.0, requests_memory=256)] * batch
+    started = perf_counter()
+    for _ in range(jobs // batch):
+        await scheduler.new_jobs(new_jobs)
+    while await running_jobs(scheduler) < jobs // batch * batch:
+        await asyncio.sleep(0.01)
+    elapsed = perf_counter() - started
+    runner.cancel()
+    if isinstance(scheduler, ShardedScheduler):
+        scheduler.close()
+    return elapsed
+
+
+@click.command()
+@click.option('--workers', default=4, help='shards to compare against the single loop')
+@click.option('--storage', default='memory', type=click.Choice(StorageType))
+@click.option('--storage-url', default=None)
+@click.option('--jobs', default=200000)
+@click.option('--nodes', default=1000)
+@click.option('--batch', default=1000, help='jobs per submission')
+def run(workers, storage, storage_url, jobs, nodes, batch):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    print(f"{storage} jobs={jobs} nodes={nodes} batch={batch}")
+    for count in (1, workers):
+        elapsed = asyncio.run(measure(count, storage, storage_url, jobs, nodes, batch))
+        print(f"workers={count}: {elapsed:.2f}s, {jobs / elapsed:,.0f} placements/s")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import tracemalloc
+from time import perf_counter
+
+import click
+
+from capacity import PlacementEngine, PlacementStrategy
+from entity import JobStatus, NewNode
+from queues import QueueType
+from scheduler import Scheduler
+from storage import StorageType
+from workload import Clock, emit, load_trace, mean_cpu_seconds, percentiles, save_trace, synthetic_arrivals
+
+
+async def simulate(arrivals, nodes: int, node: NewNode, options: dict) -> dict:
+    # Virtual time jumps from one event to the next: an arrival or the scheduler's next wakeup.
+    clock = Clock()
+    scheduler = Scheduler(StorageType.MEMORY, clock=clock, **options)
+    await scheduler.add_nodes([node] * nodes)
+    position = 0
+    tick_durations = []
+    while True:
+        batch = []
+        while position < len(arrivals) and arrivals[position][0] <= clock.now:
+            batch.append(arrivals[position][1])
+            position += 1
+        if batch:
+            await scheduler.new_jobs(batch)
+        started = perf_counter()
+        await scheduler._tick()
+        tick_durations.append(perf_counter() - started)
+        if position == len(arrivals) and not scheduler._completion_times:
+            # Nothing left to arrive or complete, any job still pending can never fit.
+            break
+        next_time = scheduler.next_schedule_time
+        if position < len(arrivals):
+            next_time = min(next_time, arrivals[position][0])
+        clock.now = max(next_time, clock.now)
+    jobs = await scheduler.get_jobs()
+    waits = [job.started_at - job.created_at for job in jobs if job.started_at is not None]
+    busy = sum(tick_durations)
+    return {
+        'jobs': len(jobs),
+        'placements': len(waits),
+        'unplaced': sum(job.status == JobStatus.NEW for job in jobs),
+        'ticks': len(tick_durations),
+        'busy_seconds': busy,
+        'ticks_per_second': len(tick_durations) / busy,
+        'placements_per_second': len(waits) / busy,
+        'makespan_seconds': clock.now,
+        'wait_seconds': percentiles(waits),
+        'tick_ms': percentiles(tick_durations, 1000),
+    }
+
+
+async def measure_memory(arrivals, options: dict) -> float:
+    # Bytes held per pending job: storage record plus queue entries, scaled to a million jobs.
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    scheduler = Scheduler(StorageType.MEMORY, **dict(options, metrics=False))
+    await scheduler.new_jobs([job for _, job in arrivals])
+    await scheduler._tick()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return used / len(arrivals) * 1_000_000 / (1 << 20)
+
+
+@click.command()
+@click.option('--jobs', default=50000, help='synthetic jobs, ignored with --trace')
+@click.option('--trace', default=None, help='csv with submit_time,expected_run_time,requests_cpu,requests_memory'
+                                            '[,priority,tenant] to replay')
+@click.option('--load', default=0.95, help='offered cpu load of the synthetic stream relative to the cluster')
+@click.option('--nodes', default=100)
+@click.option('--node-cpu', default=32.0)
+@click.option('--node-memory', default=131072)
+@click.option('--node-slots', default=64)
+@click.option('--engine', default='index', type=click.Choice(PlacementEngine))
+@click.option('--strategy', default='first-fit', type=click.Choice(PlacementStrategy))
+@click.option('--queue', default='fifo', type=click.Choice(QueueType))
+@click.option('--backfill', is_flag=True)
+@click.option('--seed', default=1)
+@click.option('--memory-jobs', default=100000, help='jobs submitted for the memory measurement, 0 to skip')
+@click.option('--save-trace', 'save_trace_path', default=None, help='write the replayed job stream to this csv')
+@click.option('--output', default=None, help='also write the json report to this file')
+def run(jobs, trace, load, nodes, node_cpu, node_memory, node_slots, engine, strategy, queue, backfill, seed,
+        memory_jobs, save_trace_path, output):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    if trace:
+        arrivals = load_trace(trace)
+    else:
+        sample = synthetic_arrivals(1000, 1, seed)
+        duration = jobs * mean_cpu_seconds(sample) / (nodes * node_cpu * load)
+        arrivals = synthetic_arrivals(jobs, duration, seed)
+    if save_trace_path:
+        save_trace(save_trace_path, arrivals)
+    node = NewNode(jobs_capacity=node_slots, cpu_capacity=node_cpu, memory_capacity=node_memory)
+    options = dict(engine=engine, strategy=strategy, queue=queue, backfill=backfill)
+    results = asyncio.run(simulate(arrivals, nodes, node, options))
+    if memory_jobs:
+        memory_arrivals = synthetic_arrivals(memory_jobs, 1, seed)
+        results['memory_mib_per_1m_jobs'] = asyncio.run(measure_memory(memory_arrivals, options))
+    params = dict(options, jobs=len(arrivals), trace=trace, load=None if trace else load, nodes=nodes,
+                  node_cpu=node_cpu, node_memory=node_memory, node_slots=node_slots, seed=seed)
+    emit('simulation', params, results, output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,62 @@
+import asyncio
+from time import perf_counter
+
+import click
+
+from entity import Job, JobStatus
+from storage import StorageType, get_storage
+
+
+def make_jobs(count: int):
+    return [Job(id=str(i), status=JobStatus.NEW, expected_run_time=60, requests_cpu=1.0,
+                requests_memory=256, created_at=0, started_at=None) for i in range(count)]
+
+
+async def measure(storage_type: StorageType, url: str | None, jobs: int):
+    storage = get_storage(storage_type, url)
+    batch = make_jobs(jobs)
+    results = {}
+
+    started = perf_counter()
+    await storage.add_jobs(batch)
+    results['add_jobs'] = perf_counter() - started
+
+    started = perf_counter()
+    for job in batch:
+        await storage.get_job(job.id)
+    results['get_job'] = perf_counter() - started
+
+    for job in batch:
+        job.status = JobStatus.RUNNING
+    started = perf_counter()
+    for job in batch:
+        await storage.update_job(job)
+    results['update_job'] = perf_counter() - started
+
+    for job in batch:
+        job.status = JobStatus.COMPLETED
+    started = perf_counter()
+    await storage.update_jobs(batch)
+    results['update_jobs'] = perf_counter() - started
+
+    for job in batch:
+        await storage.delete_job(job.id)
+    storage.close()
+    return results
+
+
+@click.command()
+@click.option('--storage', 'storage_types', multiple=True, type=click.Choice(StorageType),
+              default=[StorageType.MEMORY])
+@click.option('--storage-url', default=None, help='connection url for external storage')
+@click.option('--jobs', default=10000)
+def run(storage_types, storage_url, jobs):
+    for storage_type in storage_types:
+        url = None if storage_type == StorageType.MEMORY else storage_url
+        results = asyncio.run(measure(storage_type, url, jobs))
+        for operation, elapsed in results.items():
+            print(f"{storage_type:<10} {operation:<12} {jobs / elapsed:>12,.0f} jobs/sec")
+
+
+if __name__ == '__main__':
+    run()
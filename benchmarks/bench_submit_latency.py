@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import random
+from time import perf_counter
+
+import click
+import httpx
+from fastapi import FastAPI
+
+from bench_tick import make_scheduler
+from entity import NewJob, NewNode
+from storage import StorageType
+from webserver import register_urls
+
+
+async def measure(storage_type: StorageType, url: str | None, jobs: int, nodes: int, requests: int,
+                  interval: float):
+    scheduler = make_scheduler(storage_type, url)
+    rng = random.Random(1)
+    await scheduler.add_nodes([NewNode(jobs_capacity=jobs // nodes // 4, cpu_capacity=1024.0,
+                                       memory_capacity=1 << 30)] * nodes)
+    await scheduler.new_jobs([NewJob(expected_run_time=rng.randint(1, 3), requests_cpu=1.0, requests_memory=256)
+                              for _ in range(jobs)])
+    app = FastAPI()
+    register_urls(app, scheduler)
+    runner = asyncio.create_task(scheduler.run())
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        for _ in range(requests):
+            started = perf_counter()
+            response = await client.post('/jobs', json={'expected_run_time': 1, 'requests_cpu': 1.0,
+                                                        'requests_memory': 256})
+            latencies.append(perf_counter() - started)
+            response.raise_for_status()
+            await asyncio.sleep(interval)
+    runner.cancel()
+    scheduler._storage.close()
+    return sorted(latencies)
+
+
+@click.command()
+@click.option('--storage', default='memory', type=click.Choice(StorageType))
+@click.option('--storage-url', default=None, help="connection url, 'fakeredis://' for an in-process redis")
+@click.option('--jobs', default=50000, help='jobs kept cycling through the scheduler in the background')
+@click.option('--nodes', default=1000)
+@click.option('--requests', default=500)
+@click.option('--interval', default=0.01, help='pause between requests in seconds')
+def run(storage, storage_url, jobs, nodes, requests, interval):
+    logging.getLogger('scheduler').setLevel(logging.WARNING)
+    latencies = asyncio.run(measure(storage, storage_url, jobs, nodes, requests, interval))
+    print(f"{storage} jobs={jobs} nodes={nodes} requests={requests}")
+    for name, quantile in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        print(f"POST /jobs {name}: {latencies[int(quantile * (len(latencies) - 1))] * 1000:.1f}ms")
+    print(f"POST /jobs max: {latencies[-1] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,51 @@
+import asyncio
+from time import perf_counter
+
+import click
+
+from entity import NewJob, NewNode
+from scheduler import Scheduler
+from storage import StorageType
+
+
+def make_scheduler(storage_type: StorageType, url: str | None, metrics: bool = True) -> Scheduler:
+    if url == 'fakeredis://':
+        import fakeredis
+        from redis_storage import RedisStorage
+        scheduler = Scheduler(StorageType.MEMORY, metrics=metrics)
+        scheduler._storage = RedisStorage(client=fakeredis.FakeAsyncRedis(decode_responses=True))
+        return scheduler
+    return Scheduler(storage_type, storage_url=url, metrics=metrics)
+
+
+async def measure(storage_type: StorageType, url: str | None, jobs: int, nodes: int, metrics: bool):
+    scheduler = make_scheduler(storage_type, url, metrics)
+    await scheduler.add_nodes([NewNode(jobs_capacity=jobs // nodes // 2, cpu_capacity=1024.0,
+                                       memory_capacity=1 << 30)] * nodes)
+    await scheduler.new_jobs([NewJob(expected_run_time=0, requests_cpu=1.0, requests_memory=256)] * jobs)
+    durations = []
+    for _ in range(3):
+        scheduler.next_schedule_time = 0
+        started = perf_counter()
+        await scheduler._tick()
+        durations.append(perf_counter() - started)
+    scheduler._storage.close()
+    return durations
+
+
+@click.command()
+@click.option('--storage', default='memory', type=click.Choice(StorageType))
+@click.option('--storage-url', default=None, help="connection url, 'fakeredis://' for an in-process redis")
+@click.option('--jobs', default=100000)
+@click.option('--nodes', default=1000)
+@click.option('--metrics/--no-metrics', default=True)
+def run(storage, storage_url, jobs, nodes, metrics):
+    durations = asyncio.run(measure(storage, storage_url, jobs, nodes, metrics))
+    print(f"{storage} jobs={jobs} nodes={nodes} metrics={metrics}")
+    print(f"tick 1 (place {jobs // 2}): {durations[0]:.3f}s")
+    print(f"tick 2 (complete {jobs // 2}, place {jobs // 2}): {durations[1]:.3f}s")
+    print(f"tick 3 (complete {jobs // 2}): {durations[2]:.3f}s")
+
+
+if __name__ == '__main__':
+    run()
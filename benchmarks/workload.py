@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import platform
+import random
+import sys
+from time import time
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from entity import NewJob
+
+Arrival = Tuple[float, NewJob]
+
+TRACE_COLUMNS = ('submit_time', 'expected_run_time', 'requests_cpu', 'requests_memory', 'priority', 'tenant')
+
+
+class Clock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def random_job(rng: random.Random, tenants: int = 4) -> NewJob:
+    return NewJob(
+        expected_run_time=rng.randint(10, 600),
+        requests_cpu=rng.choice([0.5, 1.0, 1.0, 2.0, 2.0, 4.0, 8.0]),
+        requests_memory=rng.choice([256, 512, 1024, 2048, 4096]),
+        priority=rng.randint(0, 3),
+        tenant=f'tenant-{rng.randrange(tenants)}'
+    )
+
+
+def synthetic_arrivals(jobs: int, duration: float, seed: int, tenants: int = 4) -> List[Arrival]:
+    rng = random.Random(seed)
+    arrivals = [(rng.uniform(0, duration), random_job(rng, tenants)) for _ in range(jobs)]
+    arrivals.sort(key=lambda arrival: arrival[0])
+    return arrivals
+
+
+def synthetic_stream(rate: float, seed: int, tenants: int = 4) -> Iterator[Arrival]:
+    # Poisson arrivals generated on the fly, for runs too long to hold the whole stream in memory.
+    rng = random.Random(seed)
+    now = 0.0
+    while True:
+        now += rng.expovariate(rate)
+        yield now, random_job(rng, tenants)
+
+
+def mean_cpu_seconds(arrivals: Iterable[Arrival]) -> float:
+    costs = [job.requests_cpu * job.expected_run_time for _, job in arrivals]
+    return sum(costs) / len(costs)
+
+
+def load_trace(path: str) -> List[Arrival]:
+    # CSV with a header row, TRACE_COLUMNS order, priority and tenant may be left out.
+    arrivals = []
+    with open(path, newline='') as trace:
+        for row in csv.DictReader(trace):
+            arrivals.append((float(row['submit_time']), NewJob(
+                expected_run_time=int(row['expected_run_time']),
+                requests_cpu=float(row['requests_cpu']),
+                requests_memory=int(row['requests_memory']),
+                priority=int(row.get('priority') or 0),
+                tenant=row.get('tenant') or None
+            )))
+    arrivals.sort(key=lambda arrival: arrival[0])
+    start = arrivals[0][0] if arrivals else 0.0
+    return [(submit_time - start, job) for submit_time, job in arrivals]
+
+
+def save_trace(path: str, arrivals: Iterable[Arrival]):
+    with open(path, 'w', newline='') as trace:
+        writer = csv.writer(trace)
+        writer.writerow(TRACE_COLUMNS)
+        for submit_time, job in arrivals:
+            writer.writerow((submit_time, job.expected_run_time, job.requests_cpu, job.requests_memory,
+                             job.priority, job.tenant or ''))
+
+
+def percentiles(values: List[float], scale: float = 1.0) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    summary = {name: values[int(quantile * (len(values) - 1))] * scale
+               for name, quantile in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))}
+    summary['max'] = values[-1] * scale
+    summary['mean'] = sum(values) / len(values) * scale
+    return summary
+
+
+def emit(benchmark: str, params: dict, results: dict, output: str | None):
+    report = {
+        'benchmark': benchmark,
+        'timestamp': time(),
+        'environment': {'python': sys.version.split()[0], 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'params': params,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text + '\n')
+    print(text)
@@ -0,0 +1,158 @@
+from collections import Counter as TenantCounts, deque
+from typing import Dict, Iterable, List
+
+from entity import JobRecord, NewJob
+from metrics import Counter
+from queues import DEFAULT_TENANT
+
+DRAIN_WINDOW = 60
+MAX_RETRY_AFTER = 60
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason, retry_after)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f"Submission refused, {self.reason}, retry after {self.retry_after:.0f}s"
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, count: int, now: float) -> float:
+        # Seconds until count tokens are there. A batch larger than the burst needs a full bucket and
+        # leaves it in debt, so what follows waits until the whole batch is paid for.
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        missing = min(count, self.burst) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, count: int):
+        self.tokens -= count
+
+
+def pending_tasks(job: JobRecord) -> int:
+    return job.tasks - job.tasks_started if job.tasks > 1 else 1
+
+
+class Admission:
+    # Caps on pending jobs, overall and per tenant, and token bucket submit rates. A submission is
+    # taken whole or refused whole with the time after which it could go through: from the rate at
+    # which ticks have been starting jobs over the last minute for the caps, from the bucket refill
+    # for the rates. Jobs are counted by their tasks and waiting jobs count as pending. A submission
+    # larger than a cap is only taken while nothing is pending. The scheduler reports every job that
+    # becomes pending other than by admission and every one that stops being pending.
+    def __init__(self, max_pending: int = 0, max_tenant_pending: int = 0, rate: float = 0,
+                 tenant_rate: float = 0, burst: int = 0):
+        self.max_pending = max_pending
+        self.max_tenant_pending = max_tenant_pending
+        self._rate = rate
+        self._tenant_rate = tenant_rate
+        self._burst = burst
+        self._bucket: TokenBucket | None = None
+        self._tenant_buckets: Dict[str, TokenBucket] = {}
+        self._pending = 0
+        self._tenant_pending: Dict[str, int] = {}
+        self._started = deque()
+        self._started_total = 0
+        self._since: float | None = None
+        self._next_sweep = 0.0
+        self.rejected = Counter('scheduler_rejected_jobs_total', 'Jobs refused by admission control.',
+                                label='reason')
+
+    def _new_bucket(self, rate: float, now: float) -> TokenBucket:
+        return TokenBucket(rate, self._burst or max(rate, 1), now)
+
+    def admit(self, jobs: List[NewJob], now: float):
+        tenants = TenantCounts()
+        for job in jobs:
+            tenants[job.tenant or DEFAULT_TENANT] += job.tasks
+        count = sum(tenants.values())
+        waits = []
+        if self.max_pending and self._pending and self._pending + count > self.max_pending:
+            waits.append(('pending', self._drain_time(self._pending + count - self.max_pending, now)))
+        if self.max_tenant_pending:
+            for tenant, tenant_count in tenants.items():
+                tenant_pending = self._tenant_pending.get(tenant, 0)
+                if tenant_pending and tenant_pending + tenant_count > self.max_tenant_pending:
+                    waits.append(('tenant_pending', self._drain_time(
+                        tenant_pending + tenant_count - self.max_tenant_pending, now)))
+        buckets = []
+        if self._rate:
+            if self._bucket is None:
+                self._bucket = self._new_bucket(self._rate, now)
+            buckets.append((self._bucket, count, 'rate'))
+        if self._tenant_rate:
+            for tenant, tenant_count in tenants.items():
+                if tenant not in self._tenant_buckets:
+                    self._tenant_buckets[tenant] = self._new_bucket(self._tenant_rate, now)
+                buckets.append((self._tenant_buckets[tenant], tenant_count, 'tenant_rate'))
+        waits += [(reason, wait) for bucket, bucket_count, reason in buckets
+                  if (wait := bucket.wait(bucket_count, now)) > 0]
+        if waits:
+            reason, wait = max(waits, key=lambda item: item[1])
+            self.rejected.inc(reason, count)
+            raise Overloaded(reason.replace('_', ' '), min(max(wait, 1.0), MAX_RETRY_AFTER))
+        for bucket, bucket_count, _ in buckets:
+            bucket.take(bucket_count)
+        self._add_counts(tenants)
+
+    def add(self, jobs: Iterable[JobRecord]):
+        tenants = TenantCounts()
+        for job in jobs:
+            tenants[job.tenant or DEFAULT_TENANT] += pending_tasks(job)
+        self._add_counts(tenants)
+
+    def remove(self, jobs: Iterable[JobRecord]):
+        tenants = TenantCounts()
+        for job in jobs:
+            tenants[job.tenant or DEFAULT_TENANT] -= pending_tasks(job)
+        self._add_counts(tenants)
+
+    def _add_counts(self, tenants: TenantCounts):
+        self._pending += sum(tenants.values())
+        for tenant, tenant_count in tenants.items():
+            tenant_pending = self._tenant_pending.get(tenant, 0) + tenant_count
+            if tenant_pending > 0:
+                self._tenant_pending[tenant] = tenant_pending
+            else:
+                self._tenant_pending.pop(tenant, None)
+
+    def _drain_time(self, excess: int, now: float) -> float:
+        rate = self.drain_rate(now)
+        return excess / rate if rate else MAX_RETRY_AFTER
+
+    def drain_rate(self, now: float) -> float:
+        while self._started and self._started[0][0] < now - DRAIN_WINDOW:
+            self._started_total -= self._started.popleft()[1]
+        if self._since is None:
+            return 0.0
+        return self._started_total / min(max(now - self._since, 1.0), DRAIN_WINDOW)
+
+    def update(self, started: List[JobRecord], now: float):
+        # Called every tick with the jobs and tasks it started.
+        if self._since is None:
+            self._since = now
+        if started:
+            self._started.append((now, len(started)))
+            self._started_total += len(started)
+            self.remove(started)
+        if now >= self._next_sweep:
+            self._next_sweep = now + DRAIN_WINDOW
+            self._sweep_buckets(now)
+
+    def _sweep_buckets(self, now: float):
+        # Buckets of tenants with nothing pending are dropped once full, a new one starts full.
+        for tenant, bucket in list(self._tenant_buckets.items()):
+            if tenant not in self._tenant_pending and bucket.wait(bucket.burst, now) == 0.0:
+                del self._tenant_buckets[tenant]
+
+    def collect_metrics(self) -> list:
+        return [self.rejected]
@@ -0,0 +1,124 @@
+import json
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+from entity import Id, Job, JobRecord
+
+ARCHIVE_FIELDS = tuple(Job.model_fields)
+BLOCK_HEADER = struct.Struct('<IQQI')
+BLOCK_SIZE = 1000
+
+
+def job_number(job_id: Id) -> int:
+    # Tasks of a job array are filed under the array's number.
+    return int(job_id.partition('.')[0])
+
+
+def pack_numbers(numbers: array) -> bytes:
+    return struct.pack(f'<{len(numbers)}Q', *numbers)
+
+
+def unpack_numbers(data: bytes) -> array:
+    return array('Q', struct.unpack(f'<{len(data) // 8}Q', data))
+
+
+def contains(numbers: array, number: int) -> bool:
+    position = bisect_left(numbers, number)
+    return position < len(numbers) and numbers[position] == number
+
+
+class JobArchive:
+    # Append-only file of zlib compressed blocks of jobs. Each block header holds its size, the range
+    # of numeric job ids and the sorted ids themselves, which are kept in memory so only the block that
+    # holds an id is read back.
+    def __init__(self, path: str, block_size: int = BLOCK_SIZE):
+        self._path = path
+        self._block_size = block_size
+        self._blocks: List[Tuple[int, int, int, int, array]] = []
+        self._buffer: Dict[Id, list] = {}
+        self._cached_block: Tuple[int, Dict[Id, list]] | None = None
+        if os.path.exists(path):
+            self._load_index()
+        self._file = open(path, 'ab')
+
+    def _load_index(self):
+        # A block cut short by a crash is dropped so appends continue after the last complete one.
+        size = os.path.getsize(self._path)
+        offset = 0
+        with open(self._path, 'rb') as file:
+            while offset + BLOCK_HEADER.size <= size:
+                length, min_id, max_id, count = BLOCK_HEADER.unpack(file.read(BLOCK_HEADER.size))
+                data_offset = offset + BLOCK_HEADER.size + 8 * count
+                if data_offset + length > size:
+                    break
+                numbers = unpack_numbers(file.read(8 * count))
+                self._blocks.append((data_offset, length, min_id, max_id, numbers))
+                offset = data_offset + length
+                file.seek(offset)
+        if offset < size:
+            os.truncate(self._path, offset)
+
+    def append(self, jobs: List[JobRecord]):
+        for job in jobs:
+            self._buffer[job.id] = [getattr(job, field) for field in ARCHIVE_FIELDS]
+            if len(self._buffer) >= self._block_size:
+                self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        numbers = array('Q', sorted({job_number(job_id) for job_id in self._buffer}))
+        data = zlib.compress('\n'.join(json.dumps(values) for values in self._buffer.values()).encode())
+        self._file.write(BLOCK_HEADER.pack(len(data), numbers[0], numbers[-1], len(numbers)))
+        self._file.write(pack_numbers(numbers))
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+        self._blocks.append((offset, len(data), numbers[0], numbers[-1], numbers))
+        self._buffer = {}
+
+    def max_id(self) -> int:
+        return max([max_id for _, _, _, max_id, _ in self._blocks] + [job_number(job_id) for job_id in self._buffer],
+                   default=0)
+
+    def get_job(self, job_id: Id) -> Job | None:
+        values = self._buffer.get(job_id)
+        if values is None:
+            values = self._find(job_id)
+        return Job(**dict(zip(ARCHIVE_FIELDS, values))) if values is not None else None
+
+    def _find(self, job_id: Id) -> list | None:
+        try:
+            number = job_number(job_id)
+        except ValueError:
+            return None
+        # Newest blocks first, a job is looked up soon after it was archived more often than not.
+        for position in range(len(self._blocks) - 1, -1, -1):
+            _, _, min_id, max_id, numbers = self._blocks[position]
+            if min_id <= number <= max_id and contains(numbers, number):
+                values = self._read_block(position).get(job_id)
+                if values is not None:
+                    return values
+        return None
+
+    def _read_block(self, position: int) -> Dict[Id, list]:
+        if self._cached_block is not None and self._cached_block[0] == position:
+            return self._cached_block[1]
+        offset, length, _, _, _ = self._blocks[position]
+        with open(self._path, 'rb') as file:
+            file.seek(offset)
+            lines = zlib.decompress(file.read(length)).decode().split('\n')
+        jobs = {}
+        for line in lines:
+            values = json.loads(line)
+            jobs[values[0]] = values
+        self._cached_block = (position, jobs)
+        return jobs
+
+    def close(self):
+        self.flush()
+        self._file.close()
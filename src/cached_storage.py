@@ -0,0 +1,277 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from enum import StrEnum
+from typing import Dict, List, Tuple
+
+from entity import ActionStatus, Id, Job, JobRecord, JobStatus, Node, NodeRecord, job_record, node_record
+from metrics import Counter
+from storage import CACHE_FLUSH_INTERVAL, Storage
+
+logger = logging.getLogger("scheduler")
+
+
+class Write(StrEnum):
+    ADD = 'add'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+
+def drop_applied(writes: dict, item_ids: List[Id]):
+    # Flushing writes leave as soon as the backend has them, a failure further on must not send them again.
+    for item_id in item_ids:
+        del writes[item_id]
+
+
+class CachedStorage(Storage):
+    # Keeps recently used jobs and nodes in a bounded LRU in front of another storage. Writes are
+    # held back and sent on in batches every flush_interval, repeated writes to one job in between
+    # become one. Listings and counts flush first and go to the backend. Assumes nothing else writes
+    # to the backend meanwhile.
+    def __init__(self, storage: Storage, size: int, flush_interval: float = CACHE_FLUSH_INTERVAL):
+        self._storage = storage
+        self._size = size
+        self._flush_interval = flush_interval
+        self._jobs: OrderedDict[Id, JobRecord] = OrderedDict()
+        self._nodes: OrderedDict[Id, NodeRecord] = OrderedDict()
+        self._job_writes: Dict[Id, Tuple[Write, JobRecord | None]] = {}
+        self._node_writes: Dict[Id, Tuple[Write, NodeRecord | None]] = {}
+        self._flushing_jobs: Dict[Id, Tuple[Write, JobRecord | None]] = {}
+        self._flushing_nodes: Dict[Id, Tuple[Write, NodeRecord | None]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self.hits = Counter('scheduler_cache_hits_total', 'Reads answered by the storage cache.', label='entity')
+        self.misses = Counter('scheduler_cache_misses_total', 'Reads the storage cache passed to the backend.',
+                              label='entity')
+        self.flushed = Counter('scheduler_cache_flushed_writes_total', 'Writes sent to the backend in batches.',
+                               label='entity')
+        self.flushes = Counter('scheduler_cache_flushes_total', 'Batches of writes sent to the backend.')
+
+    def collect_metrics(self) -> list:
+        return [self.hits, self.misses, self.flushed, self.flushes]
+
+    def close(self):
+        pending = len(self._job_writes) + len(self._node_writes)
+        if pending:
+            logger.warning(f"Storage cache closed with {pending} writes not flushed")
+        self._storage.close()
+
+    def _cache(self, cache: OrderedDict, item):
+        cache[item.id] = item
+        cache.move_to_end(item.id)
+        if len(cache) > self._size:
+            cache.popitem(last=False)
+
+    def _write(self, writes: dict, item_id: Id, write: Write, item=None):
+        previous = writes.get(item_id, (None, None))[0]
+        if write == Write.DELETE and previous == Write.ADD:
+            del writes[item_id]
+        else:
+            writes[item_id] = (Write.ADD if previous == Write.ADD else write, item)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Storage cache flush failed")
+            if self._job_writes or self._node_writes:
+                self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        async with self._flush_lock:
+            self._flushing_jobs, self._job_writes = self._job_writes, {}
+            self._flushing_nodes, self._node_writes = self._node_writes, {}
+            try:
+                await self._flush_nodes(self._flushing_nodes)
+                await self._flush_jobs(self._flushing_jobs)
+            except Exception:
+                # What is left was not applied, writes made since take precedence over it.
+                self._job_writes = dict(self._flushing_jobs, **self._job_writes)
+                self._node_writes = dict(self._flushing_nodes, **self._node_writes)
+                raise
+            finally:
+                self._flushing_jobs, self._flushing_nodes = {}, {}
+
+    async def _flush_nodes(self, writes: dict):
+        if not writes:
+            return
+        count = len(writes)
+        added = [node for write, node in writes.values() if write == Write.ADD]
+        updated = [node for write, node in writes.values() if write == Write.UPDATE]
+        deleted = [node_id for node_id, (write, _) in writes.items() if write == Write.DELETE]
+        if added:
+            await self._storage.add_nodes(added)
+            drop_applied(writes, [node.id for node in added])
+        if updated:
+            await self._storage.update_nodes(updated)
+            drop_applied(writes, [node.id for node in updated])
+        for node_id in deleted:
+            await self._storage.delete_node(node_id)
+            drop_applied(writes, [node_id])
+        self.flushed.inc('node', count)
+        self.flushes.inc()
+
+    async def _flush_jobs(self, writes: dict):
+        if not writes:
+            return
+        count = len(writes)
+        added = [job for write, job in writes.values() if write == Write.ADD]
+        updated = [job for write, job in writes.values() if write == Write.UPDATE]
+        deleted = [job_id for job_id, (write, _) in writes.items() if write == Write.DELETE]
+        if added:
+            await self._storage.add_jobs(added)
+            drop_applied(writes, [job.id for job in added])
+        if updated:
+            await self._storage.update_jobs(updated)
+            drop_applied(writes, [job.id for job in updated])
+        if deleted:
+            await self._storage.delete_jobs(deleted)
+            drop_applied(writes, deleted)
+        self.flushed.inc('job', count)
+        self.flushes.inc()
+
+    async def _job_record(self, job_id: Id) -> JobRecord | None:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self._jobs.move_to_end(job_id)
+            self.hits.inc('job')
+            return job
+        pending = self._job_writes.get(job_id) or self._flushing_jobs.get(job_id)
+        if pending is not None:
+            self.hits.inc('job')
+            return pending[1]
+        self.misses.inc('job')
+        job = await self._storage.get_job(job_id)
+        if job is None:
+            return None
+        job = job_record(job)
+        self._cache(self._jobs, job)
+        return job
+
+    async def _node_record(self, node_id: Id) -> NodeRecord | None:
+        node = self._nodes.get(node_id)
+        if node is not None:
+            self._nodes.move_to_end(node_id)
+            self.hits.inc('node')
+            return node
+        pending = self._node_writes.get(node_id) or self._flushing_nodes.get(node_id)
+        if pending is not None:
+            self.hits.inc('node')
+            return pending[1]
+        self.misses.inc('node')
+        node = await self._storage.get_node(node_id)
+        if node is None:
+            return None
+        node = node_record(node)
+        self._cache(self._nodes, node)
+        return node
+
+    def _put_nodes(self, nodes: List[Node], write: Write):
+        for node in nodes:
+            node = node_record(node)
+            self._write(self._node_writes, node.id, write, node)
+            self._cache(self._nodes, node)
+
+    def _put_jobs(self, jobs: List[Job], write: Write):
+        for job in jobs:
+            job = job_record(job)
+            self._write(self._job_writes, job.id, write, job)
+            self._cache(self._jobs, job)
+
+    def _delete_jobs(self, job_ids: List[Id]):
+        for job_id in job_ids:
+            self._write(self._job_writes, job_id, Write.DELETE)
+            self._jobs.pop(job_id, None)
+
+    async def add_node(self, node: Node):
+        self._put_nodes([node], Write.ADD)
+
+    async def add_nodes(self, nodes: List[Node]):
+        self._put_nodes(nodes, Write.ADD)
+
+    async def get_node(self, node_id: Id) -> Node | None:
+        node = await self._node_record(node_id)
+        return node.to_model() if node else None
+
+    async def update_node(self, node: Node) -> ActionStatus:
+        if await self._node_record(node.id) is None:
+            return ActionStatus.NOT_FOUND
+        self._put_nodes([node], Write.UPDATE)
+        return ActionStatus.OK
+
+    async def update_nodes(self, nodes: List[Node]):
+        # Batch updates skip the existence check like the backends do, they only name known entries.
+        self._put_nodes(nodes, Write.UPDATE)
+
+    async def delete_node(self, node_id: Id) -> ActionStatus:
+        if await self._node_record(node_id) is None:
+            return ActionStatus.NOT_FOUND
+        self._write(self._node_writes, node_id, Write.DELETE)
+        self._nodes.pop(node_id, None)
+        return ActionStatus.OK
+
+    async def get_nodes(self) -> List[Node]:
+        await self.flush()
+        return await self._storage.get_nodes()
+
+    async def add_job(self, job: Job):
+        self._put_jobs([job], Write.ADD)
+
+    async def add_jobs(self, jobs: List[Job]):
+        self._put_jobs(jobs, Write.ADD)
+
+    async def get_job(self, job_id: Id) -> Job | None:
+        job = await self._job_record(job_id)
+        return job.to_model() if job else None
+
+    async def update_job(self, job: Job) -> ActionStatus:
+        if await self._job_record(job.id) is None:
+            return ActionStatus.NOT_FOUND
+        self._put_jobs([job], Write.UPDATE)
+        return ActionStatus.OK
+
+    async def update_jobs(self, jobs: List[Job]):
+        self._put_jobs(jobs, Write.UPDATE)
+
+    async def delete_job(self, job_id: Id) -> ActionStatus:
+        if await self._job_record(job_id) is None:
+            return ActionStatus.NOT_FOUND
+        self._delete_jobs([job_id])
+        return ActionStatus.OK
+
+    async def delete_jobs(self, job_ids: List[Id]):
+        self._delete_jobs(job_ids)
+
+    async def get_jobs(self) -> List[Job]:
+        await self.flush()
+        return await self._storage.get_jobs()
+
+    async def get_job_ids(self) -> List[Id]:
+        await self.flush()
+        return await self._storage.get_job_ids()
+
+    async def get_jobs_by_status(self, status: JobStatus) -> List[Job]:
+        await self.flush()
+        return await self._storage.get_jobs_by_status(status)
+
+    async def count_jobs_by_status(self, status: JobStatus) -> int:
+        await self.flush()
+        return await self._storage.count_jobs_by_status(status)
+
+    async def get_node_jobs(self, node_id: Id) -> List[Job]:
+        await self.flush()
+        return await self._storage.get_node_jobs(node_id)
+
+    async def query_jobs(self, status: JobStatus | None = None, created_after: float | None = None,
+                         created_before: float | None = None, cursor: str | None = None,
+                         limit: int | None = None) -> Tuple[List[Job], str | None]:
+        await self.flush()
+        return await self._storage.query_jobs(status, created_after, created_before, cursor, limit)
+
+    async def query_nodes(self, cursor: str | None = None,
+                          limit: int | None = None) -> Tuple[List[Node], str | None]:
+        await self.flush()
+        return await self._storage.query_nodes(cursor, limit)
@@ -0,0 +1,280 @@
+from enum import StrEnum
+from math import inf
+from typing import Dict, Iterable, List, Tuple
+
+from entity import Id, Job, Node, NodeRecord
+
+NO_CAPACITY = (-1, -inf, -inf)
+
+
+class PlacementEngine(StrEnum):
+    INDEX = 'index'
+    NUMPY = 'numpy'
+
+
+class PlacementStrategy(StrEnum):
+    FIRST_FIT = 'first-fit'
+    BEST_FIT = 'best-fit'
+    SPREAD = 'spread'
+    WEIGHTED = 'weighted'
+
+
+class NodeScore:
+    # Lower is better. Works on scalars and numpy columns alike.
+    def __init__(self, cpu: float, memory: float, slots: float = 0.0, balance: float = 0.0):
+        self.cpu = cpu
+        self.memory = memory
+        self.slots = slots
+        self.balance = balance
+
+    def __call__(self, free_slots, free_cpu, free_memory, jobs_capacity, cpu_capacity, memory_capacity, job: Job):
+        slots_left = (free_slots - 1) / nonzero(jobs_capacity)
+        cpu_left = (free_cpu - job.requests_cpu) / nonzero(cpu_capacity)
+        memory_left = (free_memory - job.requests_memory) / nonzero(memory_capacity)
+        return (self.cpu * cpu_left + self.memory * memory_left + self.slots * slots_left
+                + self.balance * abs(cpu_left - memory_left))
+
+
+def nonzero(capacity):
+    return capacity + (capacity == 0)
+
+
+def get_node_score(strategy: PlacementStrategy) -> NodeScore | None:
+    match strategy:
+        case PlacementStrategy.FIRST_FIT:
+            return None
+        case PlacementStrategy.BEST_FIT:
+            return NodeScore(cpu=1.0, memory=1.0)
+        case PlacementStrategy.SPREAD:
+            return NodeScore(cpu=-1.0, memory=-1.0)
+        case PlacementStrategy.WEIGHTED:
+            return NodeScore(cpu=1.0, memory=1.0, slots=0.25, balance=1.0)
+        case _:
+            raise Exception(f"Unexpected placement strategy {strategy}")
+
+
+class CapacityIndex:
+    def __init__(self, size: int = 64, score: NodeScore | None = None):
+        self._score = score
+        self._allocate(size)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, node_id: Id):
+        return node_id in self._positions
+
+    def add(self, node: Node):
+        if node.id in self._positions:
+            self.update(node)
+            return
+        if len(self._ids) == self._size:
+            self._rebuild()
+        position = len(self._ids)
+        self._ids.append(node.id)
+        self._rows.append(node_row(node))
+        self._positions[node.id] = position
+        self._set(position, free_capacity(self._rows[position]))
+
+    def update(self, node: Node):
+        position = self._positions.get(node.id)
+        if position is not None:
+            self._rows[position] = node_row(node)
+            self._set(position, free_capacity(self._rows[position]))
+
+    def remove(self, node_id: Id):
+        position = self._positions.pop(node_id, None)
+        if position is not None:
+            self._ids[position] = None
+            self._rows[position] = None
+            self._set(position, NO_CAPACITY)
+
+    def release(self, node_id: Id, job: Job):
+        position = self._positions.get(node_id)
+        if position is not None:
+            release_row(self._rows[position], job)
+            self._set(position, free_capacity(self._rows[position]))
+
+    def node(self, node_id: Id) -> NodeRecord | None:
+        position = self._positions.get(node_id)
+        return row_node(node_id, self._rows[position]) if position is not None else None
+
+    def max_free(self) -> Tuple[int, float, int]:
+        # Maxima are per resource, a job within them is not guaranteed to fit on a single node.
+        return self._slots[1], self._cpu[1], self._memory[1]
+
+    def free(self, node_id: Id) -> Tuple[int, float, int] | None:
+        position = self._positions.get(node_id)
+        return free_capacity(self._rows[position]) if position is not None else None
+
+    def place(self, jobs: Iterable[Job], stop_at_miss: bool = False,
+              exclude: Id | None = None) -> List[Tuple[Job, Id]]:
+        # Jobs are taken from the iterable only while some node has a free slot.
+        placements = []
+        fit = self.fit if self._score is None else self._best_fit
+        excluded = self._positions.get(exclude)
+        if excluded is not None:
+            self._set(excluded, NO_CAPACITY)
+        for job in jobs:
+            if self._slots[1] < 1:
+                break
+            node_id = fit(job)
+            if node_id is not None:
+                position = self._positions[node_id]
+                row = self._rows[position]
+                row[1] += 1
+                row[3] += job.requests_cpu
+                row[5] += job.requests_memory
+                self._set(position, free_capacity(row))
+                placements.append((job, node_id))
+            elif stop_at_miss:
+                break
+        if excluded is not None:
+            self._set(excluded, free_capacity(self._rows[excluded]))
+        return placements
+
+    def fit(self, job: Job) -> Id | None:
+        requests_cpu = job.requests_cpu
+        requests_memory = job.requests_memory
+        for miss_cpu, miss_memory in self._misses:
+            if miss_cpu <= requests_cpu and miss_memory <= requests_memory:
+                return None
+        shape = (requests_cpu, requests_memory)
+        start = self._cursors.get(shape, 0)
+        slots, cpu, memory = self._slots, self._cpu, self._memory
+        size = self._size
+        stack = [(1, 0, size)]
+        while stack:
+            i, low, high = stack.pop()
+            if high <= start or slots[i] < 1 or cpu[i] < requests_cpu or memory[i] < requests_memory:
+                continue
+            if i >= size:
+                self._cursors[shape] = low
+                return self._ids[low]
+            middle = (low + high) // 2
+            stack.append((2 * i + 1, middle, high))
+            stack.append((2 * i, low, middle))
+        self._cursors.pop(shape, None)
+        self._record_miss(shape)
+        return None
+
+    def fit_all(self, job: Job) -> List[Id]:
+        return [self._ids[position] for position in self._fit_positions(job)]
+
+    def _best_fit(self, job: Job) -> Id | None:
+        for miss_cpu, miss_memory in self._misses:
+            if miss_cpu <= job.requests_cpu and miss_memory <= job.requests_memory:
+                return None
+        best_position, best_score = None, inf
+        for position in self._fit_positions(job):
+            row = self._rows[position]
+            score = self._score(row[0] - row[1], row[2] - row[3], row[4] - row[5], row[0], row[2], row[4], job)
+            if score < best_score:
+                best_position, best_score = position, score
+        if best_position is None:
+            self._record_miss((job.requests_cpu, job.requests_memory))
+            return None
+        return self._ids[best_position]
+
+    def _record_miss(self, shape: Tuple[float, int]):
+        requests_cpu, requests_memory = shape
+        self._misses = [(miss_cpu, miss_memory) for miss_cpu, miss_memory in self._misses
+                        if miss_cpu < requests_cpu or miss_memory < requests_memory]
+        self._misses.append(shape)
+
+    def _fit_positions(self, job: Job) -> List[int]:
+        requests_cpu = job.requests_cpu
+        requests_memory = job.requests_memory
+        slots, cpu, memory = self._slots, self._cpu, self._memory
+        result = []
+        stack = [1]
+        while stack:
+            i = stack.pop()
+            if slots[i] < 1 or cpu[i] < requests_cpu or memory[i] < requests_memory:
+                continue
+            if i >= self._size:
+                result.append(i - self._size)
+                continue
+            stack.append(2 * i + 1)
+            stack.append(2 * i)
+        return result
+
+    def _set(self, position: int, capacity):
+        i = position + self._size
+        if capacity[0] > self._slots[i] or capacity[1] > self._cpu[i] or capacity[2] > self._memory[i]:
+            self._misses = []
+            self._cursors = {}
+        self._slots[i], self._cpu[i], self._memory[i] = capacity
+        i //= 2
+        while i:
+            left, right = 2 * i, 2 * i + 1
+            self._slots[i] = max(self._slots[left], self._slots[right])
+            self._cpu[i] = max(self._cpu[left], self._cpu[right])
+            self._memory[i] = max(self._memory[left], self._memory[right])
+            i //= 2
+
+    def _allocate(self, size: int):
+        self._size = 1
+        while self._size < size:
+            self._size *= 2
+        self._slots = [-1] * (2 * self._size)
+        self._cpu = [-inf] * (2 * self._size)
+        self._memory = [-inf] * (2 * self._size)
+        self._positions: Dict[Id, int] = {}
+        self._ids: List[Id | None] = []
+        self._rows: List[list | None] = []
+        self._misses: List[Tuple[float, int]] = []
+        self._cursors: Dict[Tuple[float, int], int] = {}
+
+    def _rebuild(self):
+        live = [(node_id, self._rows[position]) for node_id, position in self._positions.items()]
+        size = self._size
+        if len(live) * 2 > size:
+            size *= 2
+        self._allocate(size)
+        for position, (node_id, row) in enumerate(live):
+            self._ids.append(node_id)
+            self._rows.append(row)
+            self._positions[node_id] = position
+            i = position + self._size
+            self._slots[i], self._cpu[i], self._memory[i] = free_capacity(row)
+        for i in range(self._size - 1, 0, -1):
+            left, right = 2 * i, 2 * i + 1
+            self._slots[i] = max(self._slots[left], self._slots[right])
+            self._cpu[i] = max(self._cpu[left], self._cpu[right])
+            self._memory[i] = max(self._memory[left], self._memory[right])
+
+
+def node_row(node: Node) -> list:
+    return [node.jobs_capacity, node.jobs_allocated,
+            node.cpu_capacity, node.cpu_allocated,
+            node.memory_capacity, node.memory_allocated]
+
+
+def row_node(node_id: Id, row: list) -> NodeRecord:
+    return NodeRecord(node_id, row[0], row[1], row[2], row[3], row[4], row[5])
+
+
+def release_row(row: list, job: Job):
+    row[1] -= 1
+    row[3] -= job.requests_cpu
+    row[5] -= job.requests_memory
+    if row[1] == 0:
+        row[3] = 0
+        row[5] = 0
+
+
+def free_capacity(row: list):
+    return row[0] - row[1], row[2] - row[3], row[4] - row[5]
+
+
+def get_capacity_index(engine: PlacementEngine, strategy: PlacementStrategy = PlacementStrategy.FIRST_FIT):
+    score = get_node_score(strategy)
+    match engine:
+        case PlacementEngine.INDEX:
+            return CapacityIndex(score=score)
+        case PlacementEngine.NUMPY:
+            from kernel import ArrayCapacityIndex
+            return ArrayCapacityIndex(score=score)
+        case _:
+            raise Exception(f"Unexpected placement engine {engine}")
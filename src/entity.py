@@ -1,7 +1,8 @@
+from dataclasses import dataclass, replace
 from enum import StrEnum, Enum
-from typing import Optional
+from typing import List, Optional, Tuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PositiveInt
 
 
 class ActionStatus(Enum):
@@ -14,6 +15,8 @@ class JobStatus(StrEnum):
     RUNNING = 'running'
     COMPLETED = 'completed'
     TERMINATED = 'terminated'
+    WAITING = 'waiting'
+    FAILED = 'failed'
 
 
 Id = str
@@ -23,6 +26,10 @@ class NewJob(BaseModel):
     expected_run_time: int
     requests_cpu: float
     requests_memory: int
+    priority: int = 0
+    tenant: Optional[str] = None
+    tasks: PositiveInt = 1
+    depends_on: List[Id] = []
 
 
 class Job(BaseModel):
@@ -33,6 +40,22 @@ class Job(BaseModel):
     requests_memory: int
     created_at: float
     started_at: Optional[float]
+    node_id: Optional[Id] = None
+    priority: int = 0
+    tenant: Optional[str] = None
+    tasks: int = 1
+    tasks_started: int = 0
+    tasks_running: int = 0
+    tasks_completed: int = 0
+    tasks_terminated: int = 0
+    depends_on: List[Id] = []
+
+
+class JobEvent(BaseModel):
+    job_id: Id
+    status: JobStatus
+    node_id: Optional[Id] = None
+    time: float
 
 
 class NewNode(BaseModel):
@@ -49,3 +72,81 @@ class Node(BaseModel):
     cpu_allocated: Optional[float]
     memory_capacity: int
     memory_allocated: Optional[int]
+
+
+# Scheduler and memory storage keep jobs and nodes as slotted records, a fraction of the size of the
+# pydantic models, which are only built when records leave storage.
+@dataclass(slots=True)
+class JobRecord:
+    id: Id
+    status: JobStatus
+    expected_run_time: int
+    requests_cpu: float
+    requests_memory: int
+    created_at: float
+    started_at: Optional[float]
+    node_id: Optional[Id] = None
+    priority: int = 0
+    tenant: Optional[str] = None
+    tasks: int = 1
+    tasks_started: int = 0
+    tasks_running: int = 0
+    tasks_completed: int = 0
+    tasks_terminated: int = 0
+    depends_on: Tuple[Id, ...] = ()
+
+    @classmethod
+    def from_model(cls, job: Job) -> 'JobRecord':
+        return cls(job.id, job.status, job.expected_run_time, job.requests_cpu, job.requests_memory,
+                   job.created_at, job.started_at, job.node_id, job.priority, job.tenant, job.tasks,
+                   job.tasks_started, job.tasks_running, job.tasks_completed, job.tasks_terminated,
+                   tuple(job.depends_on))
+
+    def to_model(self) -> Job:
+        return Job(id=self.id, status=self.status, expected_run_time=self.expected_run_time,
+                   requests_cpu=self.requests_cpu, requests_memory=self.requests_memory,
+                   created_at=self.created_at, started_at=self.started_at, node_id=self.node_id,
+                   priority=self.priority, tenant=self.tenant, tasks=self.tasks, tasks_started=self.tasks_started,
+                   tasks_running=self.tasks_running, tasks_completed=self.tasks_completed,
+                   tasks_terminated=self.tasks_terminated, depends_on=list(self.depends_on))
+
+
+@dataclass(slots=True)
+class NodeRecord:
+    id: Id
+    jobs_capacity: int
+    jobs_allocated: Optional[int]
+    cpu_capacity: float
+    cpu_allocated: Optional[float]
+    memory_capacity: int
+    memory_allocated: Optional[int]
+
+    @classmethod
+    def from_model(cls, node: Node) -> 'NodeRecord':
+        return cls(node.id, node.jobs_capacity, node.jobs_allocated, node.cpu_capacity, node.cpu_allocated,
+                   node.memory_capacity, node.memory_allocated)
+
+    def to_model(self) -> Node:
+        return Node(id=self.id, jobs_capacity=self.jobs_capacity, jobs_allocated=self.jobs_allocated,
+                    cpu_capacity=self.cpu_capacity, cpu_allocated=self.cpu_allocated,
+                    memory_capacity=self.memory_capacity, memory_allocated=self.memory_allocated)
+
+
+# Storages keep copies, the scheduler goes on changing its own records until it stores them again.
+def job_record(job: Job | JobRecord) -> JobRecord:
+    return replace(job) if type(job) is JobRecord else JobRecord.from_model(job)
+
+
+def node_record(node: Node | NodeRecord) -> NodeRecord:
+    return replace(node) if type(node) is NodeRecord else NodeRecord.from_model(node)
+
+
+# A job array is one job with tasks > 1, its tasks are addressed as <array id>.<task index> and only
+# have a record of their own while they run or after they were stopped.
+def task_id(array_id: Id, index: int) -> Id:
+    return f'{array_id}.{index}'
+
+
+def task_array(job_id: Id) -> Tuple[Id, int] | None:
+    array_id, _, index = job_id.partition('.')
+    return (array_id, int(index)) if index.isdigit() else None
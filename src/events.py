@@ -0,0 +1,113 @@
+import asyncio
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Set
+
+from entity import Id, JobEvent, JobStatus
+
+EVENT_BUFFER = 1000
+
+
+class Subscription:
+    # Filters of different kinds must all match, any value within one kind does. A subscriber that
+    # falls a whole buffer behind is dropped, it is expected to reconnect and read current state.
+    def __init__(self, bus: 'EventBus', job_ids: Iterable[Id] = (), node_ids: Iterable[Id] = (),
+                 statuses: Iterable[JobStatus] = (), size: int = EVENT_BUFFER):
+        self._bus = bus
+        self.job_ids = frozenset(job_ids)
+        self.node_ids = frozenset(node_ids)
+        self.statuses = frozenset(statuses)
+        self._size = size
+        self._events = deque()
+        self._ready = asyncio.Event()
+        self.overflowed = False
+        self.closed = False
+
+    def matches(self, event: JobEvent) -> bool:
+        return ((not self.job_ids or event.job_id in self.job_ids)
+                and (not self.node_ids or event.node_id in self.node_ids)
+                and (not self.statuses or event.status in self.statuses))
+
+    def push(self, event: JobEvent) -> bool:
+        if len(self._events) >= self._size:
+            self.overflowed = True
+            self.close()
+            return False
+        self._events.append(event)
+        self._ready.set()
+        return True
+
+    async def get(self) -> List[JobEvent]:
+        # Everything buffered so far, an empty list once the subscription is closed.
+        while not self._events and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._ready.set()
+            self._bus.unsubscribe(self)
+
+
+class EventBus:
+    # In-process fan-out of job state changes. Subscriptions are indexed by their most selective
+    # filter so a change only visits the subscribers that may want it.
+    def __init__(self):
+        self._by_job: Dict[Id, Set[Subscription]] = {}
+        self._by_node: Dict[Id, Set[Subscription]] = {}
+        self._by_status: Dict[JobStatus, Set[Subscription]] = {}
+        self._all: Set[Subscription] = set()
+        self._listeners: List[Callable[[List[JobEvent]], None]] = []
+        self._count = 0
+
+    @property
+    def active(self) -> bool:
+        return self._count > 0 or bool(self._listeners)
+
+    def subscribe(self, job_ids: Iterable[Id] = (), node_ids: Iterable[Id] = (),
+                  statuses: Iterable[JobStatus] = (), size: int = EVENT_BUFFER) -> Subscription:
+        subscription = Subscription(self, job_ids, node_ids, statuses, size)
+        for key, index in self._keys(subscription):
+            index.setdefault(key, set()).add(subscription)
+        if not subscription.job_ids and not subscription.node_ids and not subscription.statuses:
+            self._all.add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for key, index in self._keys(subscription):
+            subscribers = index.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del index[key]
+        self._all.discard(subscription)
+        self._count -= 1
+
+    def _keys(self, subscription: Subscription) -> list:
+        if subscription.job_ids:
+            return [(job_id, self._by_job) for job_id in subscription.job_ids]
+        if subscription.node_ids:
+            return [(node_id, self._by_node) for node_id in subscription.node_ids]
+        return [(status, self._by_status) for status in subscription.statuses]
+
+    def add_listener(self, listener: Callable[[List[JobEvent]], None]):
+        self._listeners.append(listener)
+
+    def publish(self, events: List[JobEvent]):
+        if not events:
+            return
+        for listener in self._listeners:
+            listener(events)
+        if not self._count:
+            return
+        for event in events:
+            for subscribers in (self._by_job.get(event.job_id), self._by_node.get(event.node_id),
+                                self._by_status.get(event.status), self._all):
+                if subscribers:
+                    for subscription in list(subscribers):
+                        if subscription.matches(event):
+                            subscription.push(event)
@@ -0,0 +1,180 @@
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from capacity import NO_CAPACITY, NodeScore, release_row, row_node
+from entity import Id, Job, Node, NodeRecord
+
+
+class ArrayCapacityIndex:
+    def __init__(self, size: int = 64, score: NodeScore | None = None):
+        self._score = score
+        self._count = 0
+        self._positions: Dict[Id, int] = {}
+        self._ids: List[Id | None] = []
+        self._jobs_capacity = np.zeros(size, dtype=np.int64)
+        self._jobs_allocated = np.zeros(size, dtype=np.int64)
+        self._cpu_capacity = np.zeros(size, dtype=np.float64)
+        self._cpu_allocated = np.zeros(size, dtype=np.float64)
+        self._memory_capacity = np.zeros(size, dtype=np.int64)
+        self._memory_allocated = np.zeros(size, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, node_id: Id):
+        return node_id in self._positions
+
+    def add(self, node: Node):
+        if node.id in self._positions:
+            self.update(node)
+            return
+        if self._count == len(self._jobs_capacity):
+            self._grow()
+        position = self._count
+        self._count += 1
+        self._ids.append(node.id)
+        self._positions[node.id] = position
+        self._set(position, node)
+
+    def update(self, node: Node):
+        position = self._positions.get(node.id)
+        if position is not None:
+            self._set(position, node)
+
+    def remove(self, node_id: Id):
+        position = self._positions.pop(node_id, None)
+        if position is not None:
+            self._ids[position] = None
+            for column in self._columns():
+                column[position] = 0
+
+    def release(self, node_id: Id, job: Job):
+        position = self._positions.get(node_id)
+        if position is not None:
+            row = self._row(position)
+            release_row(row, job)
+            (self._jobs_capacity[position], self._jobs_allocated[position], self._cpu_capacity[position],
+             self._cpu_allocated[position], self._memory_capacity[position],
+             self._memory_allocated[position]) = row
+
+    def node(self, node_id: Id) -> NodeRecord | None:
+        position = self._positions.get(node_id)
+        return row_node(node_id, self._row(position)) if position is not None else None
+
+    def _row(self, position: int) -> list:
+        return [int(self._jobs_capacity[position]), int(self._jobs_allocated[position]),
+                float(self._cpu_capacity[position]), float(self._cpu_allocated[position]),
+                int(self._memory_capacity[position]), int(self._memory_allocated[position])]
+
+    def max_free(self) -> Tuple[int, float, int]:
+        count = self._count
+        if not self._positions:
+            return NO_CAPACITY
+        return (int((self._jobs_capacity[:count] - self._jobs_allocated[:count]).max()),
+                float((self._cpu_capacity[:count] - self._cpu_allocated[:count]).max()),
+                int((self._memory_capacity[:count] - self._memory_allocated[:count]).max()))
+
+    def free(self, node_id: Id) -> Tuple[int, float, int] | None:
+        position = self._positions.get(node_id)
+        if position is None:
+            return None
+        return (int(self._jobs_capacity[position] - self._jobs_allocated[position]),
+                float(self._cpu_capacity[position] - self._cpu_allocated[position]),
+                int(self._memory_capacity[position] - self._memory_allocated[position]))
+
+    def place(self, jobs: Iterable[Job], stop_at_miss: bool = False,
+              exclude: Id | None = None) -> List[Tuple[Job, Id]]:
+        placements = []
+        count = self._count
+        if count == 0:
+            return placements
+        free_slots = self._jobs_capacity[:count] - self._jobs_allocated[:count]
+        free_cpu = self._cpu_capacity[:count] - self._cpu_allocated[:count]
+        free_memory = self._memory_capacity[:count] - self._memory_allocated[:count]
+        excluded = self._positions.get(exclude)
+        if excluded is not None:
+            free_slots[excluded] = 0
+        slots_left = int(free_slots.clip(min=0).sum())
+        misses = []
+        cursors = {}
+        for job in jobs:
+            if slots_left < 1:
+                break
+            requests_cpu = job.requests_cpu
+            requests_memory = job.requests_memory
+            if any(miss_cpu <= requests_cpu and miss_memory <= requests_memory
+                   for miss_cpu, miss_memory in misses):
+                if stop_at_miss:
+                    break
+                continue
+            shape = (requests_cpu, requests_memory)
+            start = cursors.get(shape, 0) if self._score is None else 0
+            mask = ((free_slots[start:] > 0) & (free_cpu[start:] >= requests_cpu)
+                    & (free_memory[start:] >= requests_memory))
+            offset = int(mask.argmax())
+            if not mask[offset]:
+                misses = [(miss_cpu, miss_memory) for miss_cpu, miss_memory in misses
+                          if miss_cpu < requests_cpu or miss_memory < requests_memory]
+                misses.append(shape)
+                if stop_at_miss:
+                    break
+                continue
+            if self._score is not None:
+                scores = self._score(free_slots, free_cpu, free_memory, self._jobs_capacity[:count],
+                                     self._cpu_capacity[:count], self._memory_capacity[:count], job)
+                offset = int(np.where(mask, scores, np.inf).argmin())
+            position = start + offset
+            cursors[shape] = position
+            self._jobs_allocated[position] += 1
+            self._cpu_allocated[position] += requests_cpu
+            self._memory_allocated[position] += requests_memory
+            free_slots[position] = self._jobs_capacity[position] - self._jobs_allocated[position]
+            slots_left -= 1
+            free_cpu[position] = self._cpu_capacity[position] - self._cpu_allocated[position]
+            free_memory[position] = self._memory_capacity[position] - self._memory_allocated[position]
+            placements.append((job, self._ids[position]))
+        return placements
+
+    def fit(self, job: Job) -> Id | None:
+        mask = self._feasible(job)
+        if mask.size == 0:
+            return None
+        position = int(mask.argmax())
+        return self._ids[position] if mask[position] else None
+
+    def fit_all(self, job: Job) -> List[Id]:
+        return [self._ids[position] for position in np.flatnonzero(self._feasible(job))]
+
+    def _feasible(self, job: Job):
+        count = self._count
+        return (((self._jobs_capacity[:count] - self._jobs_allocated[:count]) > 0)
+                & ((self._cpu_capacity[:count] - self._cpu_allocated[:count]) >= job.requests_cpu)
+                & ((self._memory_capacity[:count] - self._memory_allocated[:count]) >= job.requests_memory))
+
+    def _set(self, position: int, node: Node):
+        self._jobs_capacity[position] = node.jobs_capacity
+        self._jobs_allocated[position] = node.jobs_allocated
+        self._cpu_capacity[position] = node.cpu_capacity
+        self._cpu_allocated[position] = node.cpu_allocated
+        self._memory_capacity[position] = node.memory_capacity
+        self._memory_allocated[position] = node.memory_allocated
+
+    def _columns(self):
+        return (self._jobs_capacity, self._jobs_allocated, self._cpu_capacity,
+                self._cpu_allocated, self._memory_capacity, self._memory_allocated)
+
+    def _grow(self):
+        live = list(self._positions.items())
+        if len(live) * 2 > self._count:
+            size = 2 * len(self._jobs_capacity)
+        else:
+            size = len(self._jobs_capacity)
+        rows = np.array([position for _, position in live], dtype=np.int64)
+        (self._jobs_capacity, self._jobs_allocated, self._cpu_capacity,
+         self._cpu_allocated, self._memory_capacity, self._memory_allocated) = (
+            np.concatenate([column[rows], np.zeros(size - len(rows), dtype=column.dtype)])
+            for column in self._columns())
+        self._count = len(live)
+        self._ids = [node_id for node_id, _ in live]
+        self._positions = {node_id: position for position, (node_id, _) in enumerate(live)}
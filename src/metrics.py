@@ -0,0 +1,132 @@
+from bisect import bisect_left
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+LATENCY_BUCKETS = (.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+WAIT_BUCKETS = (1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0, 4 * 3600.0, 24 * 3600.0)
+
+STORAGE_METHODS = ('add_node', 'add_nodes', 'get_node', 'update_node', 'update_nodes', 'delete_node', 'get_nodes',
+                   'add_job', 'add_jobs', 'get_job', 'update_job', 'update_jobs', 'delete_job', 'delete_jobs',
+                   'get_jobs', 'get_jobs_by_status', 'count_jobs_by_status', 'get_node_jobs', 'query_jobs',
+                   'query_nodes', 'flush')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, value: float = 0):
+        self.name = name
+        self.help = help
+        self.value = value
+
+    def samples(self, labels: Dict[str, str]) -> List[str]:
+        return [f'{self.name}{format_labels(labels)} {format_value(self.value)}']
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.series: Dict[str, float] = {}
+
+    def inc(self, label_value: str = '', amount: float = 1):
+        self.series[label_value] = self.series.get(label_value, 0) + amount
+
+    def value(self, label_value: str = '') -> float:
+        return self.series.get(label_value, 0)
+
+    def samples(self, labels: Dict[str, str]) -> List[str]:
+        return [f'{self.name}{format_labels(dict(labels, **{self.label: label_value}) if self.label else labels)} '
+                f'{format_value(value)}' for label_value, value in self.series.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 label: str | None = None):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        # Per label value: counts per bucket (the last one is +Inf), then the sum of observations.
+        self.series: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, label_value: str = ''):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def samples(self, labels: Dict[str, str]) -> List[str]:
+        lines = []
+        for label_value, (counts, total) in self.series.items():
+            series_labels = dict(labels, **{self.label: label_value}) if self.label else labels
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = format_labels(dict(series_labels, le=format_value(bound)))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(series_labels)} {format_value(total[0])}')
+            lines.append(f'{self.name}_count{format_labels(series_labels)} {cumulative}')
+        return lines
+
+
+class SchedulerMetrics:
+    def __init__(self):
+        self.tick = Histogram('scheduler_tick_seconds', 'Duration of a scheduling loop iteration.')
+        self.complete = Histogram('scheduler_complete_seconds', 'Time spent completing finished jobs per tick.')
+        self.schedule = Histogram('scheduler_schedule_seconds', 'Time spent placing pending jobs per tick.')
+        self.storage = Histogram('scheduler_storage_seconds', 'Storage call latency.', label='method')
+        self.lock_wait = Histogram('scheduler_lock_wait_seconds', 'Time spent waiting for the storage write lock.')
+        self.job_wait = Histogram('scheduler_job_wait_seconds', 'Time from job creation to start.', WAIT_BUCKETS)
+
+    def histograms(self) -> List[Histogram]:
+        return [self.tick, self.complete, self.schedule, self.storage, self.lock_wait, self.job_wait]
+
+
+def timed(method, histogram: Histogram, label_value: str):
+    async def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - started, label_value)
+    return wrapper
+
+
+def instrument_storage(storage, histogram: Histogram):
+    # Wraps the bound methods of this one instance, an uninstrumented storage pays nothing.
+    for method in STORAGE_METHODS:
+        setattr(storage, method, timed(getattr(storage, method), histogram, method))
+    return storage
+
+
+def render(sources: List[Tuple[list, Dict[str, str]]]) -> str:
+    families = {}
+    for metrics, labels in sources:
+        for metric in metrics:
+            families.setdefault(metric.name, []).append((metric, labels))
+    lines = []
+    for name, members in families.items():
+        lines.append(f'# HELP {name} {members[0][0].help}')
+        lines.append(f'# TYPE {name} {members[0][0].type}')
+        for metric, labels in members:
+            lines.extend(metric.samples(labels))
+    return '\n'.join(lines) + '\n'
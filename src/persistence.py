@@ -0,0 +1,172 @@
+import asyncio
+import mmap
+import os
+import pickle
+import re
+import struct
+import threading
+import zlib
+from enum import IntEnum
+from typing import Callable, Iterator, List, Tuple
+
+from entity import JobRecord, JobStatus, NodeRecord
+
+FRAME_HEADER = struct.Struct('<II')
+SNAPSHOT_NAME = 'snapshot'
+LOG_NAME = re.compile(r'^wal\.(\d+)$')
+SNAPSHOT_LOG_BYTES = 64 << 20
+JOB_STATUSES = {status.value: status for status in JobStatus}
+
+
+class Operation(IntEnum):
+    ADD_JOBS = 1
+    UPDATE_JOBS = 2
+    DELETE_JOBS = 3
+    ADD_NODES = 4
+    UPDATE_NODES = 5
+    DELETE_NODE = 6
+
+
+def job_values(job: JobRecord) -> tuple:
+    return (job.id, job.status.value, job.expected_run_time, job.requests_cpu, job.requests_memory,
+            job.created_at, job.started_at, job.node_id, job.priority, job.tenant, job.tasks, job.tasks_started,
+            job.tasks_running, job.tasks_completed, job.tasks_terminated, job.depends_on)
+
+
+def values_job(values: tuple) -> JobRecord:
+    # Older logs end at tenant or at the task counts, the fields after that keep their defaults.
+    return JobRecord(values[0], JOB_STATUSES[values[1]], *values[2:])
+
+
+def node_values(node: NodeRecord) -> tuple:
+    return (node.id, node.jobs_capacity, node.jobs_allocated, node.cpu_capacity, node.cpu_allocated,
+            node.memory_capacity, node.memory_allocated)
+
+
+def values_node(values: tuple) -> NodeRecord:
+    return NodeRecord(*values)
+
+
+def log_path(directory: str, generation: int) -> str:
+    return os.path.join(directory, f'wal.{generation:08d}')
+
+
+def log_generations(directory: str) -> List[int]:
+    return sorted(int(match.group(1)) for name in os.listdir(directory) if (match := LOG_NAME.match(name)))
+
+
+def fsync_directory(directory: str):
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def read_log(path: str) -> Iterator[Tuple[Operation, list]]:
+    # Frames are length and crc prefixed, a frame torn by a crash ends the log and is cut off.
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        length, checksum = FRAME_HEADER.unpack_from(data, offset)
+        payload = data[offset + FRAME_HEADER.size:offset + FRAME_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        operation, items = pickle.loads(payload)
+        yield Operation(operation), items
+        offset += FRAME_HEADER.size + length
+    if offset < len(data):
+        os.truncate(path, offset)
+
+
+def read_snapshot(directory: str) -> Tuple[int, list, list] | None:
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return pickle.loads(data)
+
+
+def write_snapshot(directory: str, generation: int, jobs: list, nodes: list):
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    with open(path + '.tmp', 'wb') as file:
+        pickle.dump((generation, jobs, nodes), file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + '.tmp', path)
+    fsync_directory(directory)
+    for old_generation in log_generations(directory):
+        if old_generation < generation:
+            os.remove(log_path(directory, old_generation))
+
+
+class WriteAheadLog:
+    # Appends are buffered and written by one flush at a time, every commit waiting meanwhile shares
+    # the next write and fsync.
+    def __init__(self, directory: str, generation: int):
+        self._directory = directory
+        self.generation = generation
+        self._file = open(log_path(directory, generation), 'ab')
+        self.size = self._file.tell()
+        self._buffer: List[bytes] = []
+        self._waiters: List[asyncio.Future] = []
+        self._flusher: asyncio.Task | None = None
+        self._write_lock = asyncio.Lock()
+        self._file_lock = threading.Lock()
+
+    def append(self, operation: Operation, items: list):
+        payload = pickle.dumps((int(operation), items), protocol=pickle.HIGHEST_PROTOCOL)
+        self._buffer.append(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.size += FRAME_HEADER.size + len(payload)
+
+    async def commit(self):
+        if not self._buffer:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        await future
+
+    async def _flush(self):
+        while self._buffer:
+            frames, self._buffer = self._buffer, []
+            waiters, self._waiters = self._waiters, []
+            try:
+                async with self._write_lock:
+                    await asyncio.to_thread(self._write, b''.join(frames))
+            except Exception as error:
+                for waiter in waiters:
+                    waiter.set_exception(error)
+                raise
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _write(self, data: bytes):
+        with self._file_lock:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    async def rotate(self, capture: Callable[[], tuple]) -> Tuple[int, tuple]:
+        # Switches to the next log file and captures the state in the same step, so every change the
+        # capture misses is in the new file. Buffered frames already in the capture go there too,
+        # replaying them is harmless as every operation writes whole records.
+        async with self._write_lock:
+            with self._file_lock:
+                self._file.close()
+                self.generation += 1
+                self._file = open(log_path(self._directory, self.generation), 'ab')
+                self.size = sum(len(frame) for frame in self._buffer)
+            return self.generation, capture()
+
+    def close(self):
+        with self._file_lock:
+            if self._buffer:
+                self._file.write(b''.join(self._buffer))
+                self._buffer = []
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
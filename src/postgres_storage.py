@@ -0,0 +1,233 @@
+import asyncio
+from typing import List, Tuple
+
+import asyncpg
+
+from entity import Id, Job, JobStatus, Node, ActionStatus
+from storage import Storage
+
+JOB_COLUMNS = ('id, status, expected_run_time, requests_cpu, requests_memory, created_at, started_at, '
+               'node_id, priority, tenant, tasks, tasks_started, tasks_running, tasks_completed, tasks_terminated, '
+               'depends_on')
+NODE_COLUMNS = ('id, jobs_capacity, jobs_allocated, cpu_capacity, cpu_allocated, '
+                'memory_capacity, memory_allocated')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    seq BIGSERIAL,
+    id TEXT PRIMARY KEY,
+    jobs_capacity INTEGER NOT NULL,
+    jobs_allocated INTEGER,
+    cpu_capacity DOUBLE PRECISION NOT NULL,
+    cpu_allocated DOUBLE PRECISION,
+    memory_capacity BIGINT NOT NULL,
+    memory_allocated BIGINT
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    seq BIGSERIAL,
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    expected_run_time INTEGER NOT NULL,
+    requests_cpu DOUBLE PRECISION NOT NULL,
+    requests_memory BIGINT NOT NULL,
+    created_at DOUBLE PRECISION NOT NULL,
+    started_at DOUBLE PRECISION,
+    node_id TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    tenant TEXT,
+    tasks INTEGER NOT NULL DEFAULT 1,
+    tasks_started INTEGER NOT NULL DEFAULT 0,
+    tasks_running INTEGER NOT NULL DEFAULT 0,
+    tasks_completed INTEGER NOT NULL DEFAULT 0,
+    tasks_terminated INTEGER NOT NULL DEFAULT 0,
+    depends_on TEXT[] NOT NULL DEFAULT '{}'
+);
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS node_id TEXT;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS tenant TEXT;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS tasks INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS tasks_started INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS tasks_running INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS tasks_completed INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS tasks_terminated INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS depends_on TEXT[] NOT NULL DEFAULT '{}';
+CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, seq);
+CREATE INDEX IF NOT EXISTS jobs_node_idx ON jobs (node_id, status);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_seq_idx ON jobs (seq);
+CREATE UNIQUE INDEX IF NOT EXISTS nodes_seq_idx ON nodes (seq);
+"""
+
+INSERT_NODE = (f"INSERT INTO nodes ({NODE_COLUMNS}) VALUES ($1, $2, $3, $4, $5, $6, $7) "
+               "ON CONFLICT (id) DO UPDATE SET jobs_capacity = EXCLUDED.jobs_capacity, "
+               "jobs_allocated = EXCLUDED.jobs_allocated, cpu_capacity = EXCLUDED.cpu_capacity, "
+               "cpu_allocated = EXCLUDED.cpu_allocated, memory_capacity = EXCLUDED.memory_capacity, "
+               "memory_allocated = EXCLUDED.memory_allocated")
+UPDATE_NODE = ("UPDATE nodes SET jobs_capacity = $2, jobs_allocated = $3, cpu_capacity = $4, "
+               "cpu_allocated = $5, memory_capacity = $6, memory_allocated = $7 WHERE id = $1")
+INSERT_JOB = (f"INSERT INTO jobs ({JOB_COLUMNS}) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, "
+              "$14, $15, $16) ON CONFLICT (id) DO UPDATE SET status = EXCLUDED.status, "
+              "expected_run_time = EXCLUDED.expected_run_time, requests_cpu = EXCLUDED.requests_cpu, "
+              "requests_memory = EXCLUDED.requests_memory, created_at = EXCLUDED.created_at, "
+              "started_at = EXCLUDED.started_at, node_id = EXCLUDED.node_id, priority = EXCLUDED.priority, "
+              "tenant = EXCLUDED.tenant, tasks = EXCLUDED.tasks, tasks_started = EXCLUDED.tasks_started, "
+              "tasks_running = EXCLUDED.tasks_running, tasks_completed = EXCLUDED.tasks_completed, "
+              "tasks_terminated = EXCLUDED.tasks_terminated, depends_on = EXCLUDED.depends_on")
+QUERY_JOBS = (f"SELECT seq, {JOB_COLUMNS} FROM jobs WHERE ($1::text IS NULL OR status = $1) "
+              "AND ($2::float8 IS NULL OR created_at >= $2) AND ($3::float8 IS NULL OR created_at < $3) "
+              "AND seq > $4 ORDER BY seq LIMIT $5")
+QUERY_NODES = f"SELECT seq, {NODE_COLUMNS} FROM nodes WHERE seq > $1 ORDER BY seq LIMIT $2"
+UPDATE_JOB = ("UPDATE jobs SET status = $2, expected_run_time = $3, requests_cpu = $4, "
+              "requests_memory = $5, created_at = $6, started_at = $7, node_id = $8, priority = $9, "
+              "tenant = $10, tasks = $11, tasks_started = $12, tasks_running = $13, tasks_completed = $14, "
+              "tasks_terminated = $15, depends_on = $16 WHERE id = $1")
+
+
+def node_args(node: Node):
+    return (node.id, node.jobs_capacity, node.jobs_allocated, node.cpu_capacity,
+            node.cpu_allocated, node.memory_capacity, node.memory_allocated)
+
+
+def job_args(job: Job):
+    return (job.id, job.status.value, job.expected_run_time, job.requests_cpu,
+            job.requests_memory, job.created_at, job.started_at, job.node_id, job.priority, job.tenant, job.tasks,
+            job.tasks_started, job.tasks_running, job.tasks_completed, job.tasks_terminated, list(job.depends_on))
+
+
+def without_seq(record) -> dict:
+    values = dict(record)
+    del values['seq']
+    return values
+
+
+def next_cursor(records, limit: int | None) -> str | None:
+    return str(records[-1]['seq']) if limit and len(records) == limit else None
+
+
+def affected_status(result: str) -> ActionStatus:
+    return ActionStatus.OK if result.split()[-1] != '0' else ActionStatus.NOT_FOUND
+
+
+class PostgresStorage(Storage):
+    def __init__(self, url: str, min_pool_size: int = 2, max_pool_size: int = 10):
+        self._url = url
+        self._min_pool_size = min_pool_size
+        self._max_pool_size = max_pool_size
+        self._pool: asyncpg.Pool | None = None
+        self._pool_lock = asyncio.Lock()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    pool = await asyncpg.create_pool(self._url, min_size=self._min_pool_size,
+                                                     max_size=self._max_pool_size)
+                    async with pool.acquire() as connection:
+                        await connection.execute(SCHEMA)
+                    self._pool = pool
+        return self._pool
+
+    async def add_node(self, node: Node):
+        pool = await self._get_pool()
+        await pool.execute(INSERT_NODE, *node_args(node))
+
+    async def add_nodes(self, nodes: List[Node]):
+        if nodes:
+            pool = await self._get_pool()
+            await pool.executemany(INSERT_NODE, [node_args(node) for node in nodes])
+
+    async def get_node(self, node_id: Id) -> Node | None:
+        pool = await self._get_pool()
+        record = await pool.fetchrow(f"SELECT {NODE_COLUMNS} FROM nodes WHERE id = $1", node_id)
+        return Node(**record) if record else None
+
+    async def update_node(self, node: Node) -> ActionStatus:
+        pool = await self._get_pool()
+        return affected_status(await pool.execute(UPDATE_NODE, *node_args(node)))
+
+    async def update_nodes(self, nodes: List[Node]):
+        if nodes:
+            pool = await self._get_pool()
+            await pool.executemany(UPDATE_NODE, [node_args(node) for node in nodes])
+
+    async def delete_node(self, node_id: Id) -> ActionStatus:
+        pool = await self._get_pool()
+        return affected_status(await pool.execute("DELETE FROM nodes WHERE id = $1", node_id))
+
+    async def get_nodes(self) -> List[Node]:
+        pool = await self._get_pool()
+        records = await pool.fetch(f"SELECT {NODE_COLUMNS} FROM nodes ORDER BY seq")
+        return [Node(**record) for record in records]
+
+    async def add_job(self, job: Job):
+        pool = await self._get_pool()
+        await pool.execute(INSERT_JOB, *job_args(job))
+
+    async def add_jobs(self, jobs: List[Job]):
+        if jobs:
+            pool = await self._get_pool()
+            await pool.executemany(INSERT_JOB, [job_args(job) for job in jobs])
+
+    async def get_job(self, job_id: Id) -> Job | None:
+        pool = await self._get_pool()
+        record = await pool.fetchrow(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = $1", job_id)
+        return Job(**record) if record else None
+
+    async def update_job(self, job: Job) -> ActionStatus:
+        pool = await self._get_pool()
+        return affected_status(await pool.execute(UPDATE_JOB, *job_args(job)))
+
+    async def update_jobs(self, jobs: List[Job]):
+        if jobs:
+            pool = await self._get_pool()
+            await pool.executemany(UPDATE_JOB, [job_args(job) for job in jobs])
+
+    async def delete_job(self, job_id: Id) -> ActionStatus:
+        pool = await self._get_pool()
+        return affected_status(await pool.execute("DELETE FROM jobs WHERE id = $1", job_id))
+
+    async def delete_jobs(self, job_ids: List[Id]):
+        pool = await self._get_pool()
+        await pool.execute("DELETE FROM jobs WHERE id = ANY($1::text[])", job_ids)
+
+    async def get_jobs(self) -> List[Job]:
+        pool = await self._get_pool()
+        records = await pool.fetch(f"SELECT {JOB_COLUMNS} FROM jobs ORDER BY seq")
+        return [Job(**record) for record in records]
+
+    async def get_job_ids(self) -> List[Id]:
+        pool = await self._get_pool()
+        return [record['id'] for record in await pool.fetch("SELECT id FROM jobs")]
+
+    async def get_jobs_by_status(self, status: JobStatus) -> List[Job]:
+        pool = await self._get_pool()
+        records = await pool.fetch(f"SELECT {JOB_COLUMNS} FROM jobs WHERE status = $1 ORDER BY seq", status.value)
+        return [Job(**record) for record in records]
+
+    async def count_jobs_by_status(self, status: JobStatus) -> int:
+        pool = await self._get_pool()
+        return await pool.fetchval("SELECT count(*) FROM jobs WHERE status = $1", status.value)
+
+    async def get_node_jobs(self, node_id: Id) -> List[Job]:
+        pool = await self._get_pool()
+        records = await pool.fetch(f"SELECT {JOB_COLUMNS} FROM jobs WHERE node_id = $1 AND status = $2 "
+                                   "ORDER BY seq", node_id, JobStatus.RUNNING.value)
+        return [Job(**record) for record in records]
+
+    async def query_jobs(self, status: JobStatus | None = None, created_after: float | None = None,
+                         created_before: float | None = None, cursor: str | None = None,
+                         limit: int | None = None) -> Tuple[List[Job], str | None]:
+        pool = await self._get_pool()
+        records = await pool.fetch(QUERY_JOBS, status.value if status else None, created_after,
+                                   created_before, int(cursor) if cursor else 0, limit)
+        return [Job(**without_seq(record)) for record in records], next_cursor(records, limit)
+
+    async def query_nodes(self, cursor: str | None = None,
+                          limit: int | None = None) -> Tuple[List[Node], str | None]:
+        pool = await self._get_pool()
+        records = await pool.fetch(QUERY_NODES, int(cursor) if cursor else 0, limit)
+        return [Node(**without_seq(record)) for record in records], next_cursor(records, limit)
@@ -0,0 +1,202 @@
+import heapq
+from collections import OrderedDict
+from enum import StrEnum
+from typing import Dict, Iterable, Iterator, List
+
+from entity import Id, Job
+
+DEFAULT_TENANT = 'default'
+
+
+class QueueType(StrEnum):
+    FIFO = 'fifo'
+    PRIORITY = 'priority'
+    FAIR_SHARE = 'fair-share'
+
+
+class FifoQueue:
+    def __init__(self):
+        self._jobs: OrderedDict[Id, None] = OrderedDict()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, job_id: Id):
+        return job_id in self._jobs
+
+    def __iter__(self) -> Iterator[Id]:
+        return iter(self._jobs)
+
+    def push(self, job: Job):
+        self._jobs[job.id] = None
+
+    def extend(self, jobs: Iterable[Job]):
+        self._jobs.update((job.id, None) for job in jobs)
+
+    def push_front(self, jobs: Iterable[Job]):
+        for job in reversed(list(jobs)):
+            self._jobs[job.id] = None
+            self._jobs.move_to_end(job.id, last=False)
+
+    def remove(self, job_id: Id) -> bool:
+        if job_id in self._jobs:
+            del self._jobs[job_id]
+            return True
+        return False
+
+    def charge(self, job: Job):
+        pass
+
+
+class PriorityQueue:
+    def __init__(self):
+        self._heap: List[list] = []
+        self._entries: Dict[Id, list] = {}
+        self._next_seq = 0
+        self._front_seq = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job_id: Id):
+        return job_id in self._entries
+
+    def __iter__(self) -> Iterator[Id]:
+        # Walks the heap in order without sorting it, a pass that stops early only pays for what it took.
+        # Jobs may be removed on the way, not pushed.
+        heap, entries = self._heap, self._entries
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier:
+            entry, index = heapq.heappop(frontier)
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            if entries.get(entry[2]) is entry:
+                yield entry[2]
+
+    def push(self, job: Job):
+        self._next_seq += 1
+        self._add([-job.priority, self._next_seq, job.id])
+
+    def extend(self, jobs: Iterable[Job]):
+        for job in jobs:
+            self.push(job)
+
+    def push_front(self, jobs: Iterable[Job]):
+        for job in reversed(list(jobs)):
+            self._front_seq -= 1
+            self._add([-job.priority, self._front_seq, job.id])
+
+    def pop(self) -> Id | None:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if self._entries.get(entry[2]) is entry:
+                del self._entries[entry[2]]
+                return entry[2]
+        return None
+
+    def remove(self, job_id: Id) -> bool:
+        if self._entries.pop(job_id, None) is None:
+            return False
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+        return True
+
+    def charge(self, job: Job):
+        pass
+
+    def _add(self, entry: list):
+        self.remove(entry[2])
+        self._entries[entry[2]] = entry
+        heapq.heappush(self._heap, entry)
+
+
+class FairShareQueue:
+    def __init__(self, weights: Dict[str, float] | None = None):
+        self._weights = weights or {}
+        self._tenants: Dict[str, PriorityQueue] = {}
+        self._job_tenants: Dict[Id, str] = {}
+        self._costs: Dict[Id, float] = {}
+        self._usage: Dict[str, float] = {}
+
+    def __len__(self):
+        return len(self._job_tenants)
+
+    def __contains__(self, job_id: Id):
+        return job_id in self._job_tenants
+
+    def __iter__(self) -> Iterator[Id]:
+        active = [(self._usage[tenant], tenant) for tenant, queue in self._tenants.items() if len(queue)]
+        heapq.heapify(active)
+        tenant_jobs = {tenant: iter(self._tenants[tenant]) for _, tenant in active}
+        while active:
+            usage, tenant = heapq.heappop(active)
+            job_id = next(tenant_jobs[tenant], None)
+            if job_id is not None:
+                heapq.heappush(active, (usage + self._costs[job_id] / self._weight(tenant), tenant))
+                yield job_id
+
+    def push(self, job: Job):
+        self._register(job).push(job)
+
+    def extend(self, jobs: Iterable[Job]):
+        for job in jobs:
+            self.push(job)
+
+    def push_front(self, jobs: Iterable[Job]):
+        tenant_jobs: Dict[str, List[Job]] = {}
+        for job in jobs:
+            tenant_jobs.setdefault(job_tenant(job), []).append(job)
+        for jobs in tenant_jobs.values():
+            queue = None
+            for job in jobs:
+                queue = self._register(job)
+            queue.push_front(jobs)
+
+    def remove(self, job_id: Id) -> bool:
+        tenant = self._job_tenants.pop(job_id, None)
+        if tenant is None:
+            return False
+        del self._costs[job_id]
+        return self._tenants[tenant].remove(job_id)
+
+    def charge(self, job: Job):
+        tenant = job_tenant(job)
+        self._usage[tenant] = self._usage.get(tenant, 0.0) + job_cost(job) / self._weight(tenant)
+
+    def _register(self, job: Job) -> PriorityQueue:
+        tenant = job_tenant(job)
+        queue = self._tenants.get(tenant)
+        if queue is None:
+            queue = self._tenants[tenant] = PriorityQueue()
+        if not len(queue):
+            # A tenant that was idle must not bank credit: it rejoins at the lowest active usage.
+            active_usage = [self._usage[other] for other, other_queue in self._tenants.items() if len(other_queue)]
+            self._usage[tenant] = max(self._usage.get(tenant, 0.0), min(active_usage, default=0.0))
+        self._job_tenants[job.id] = tenant
+        self._costs[job.id] = job_cost(job)
+        return queue
+
+    def _weight(self, tenant: str) -> float:
+        return self._weights.get(tenant, 1.0)
+
+
+def job_tenant(job: Job) -> str:
+    return job.tenant or DEFAULT_TENANT
+
+
+def job_cost(job: Job) -> float:
+    return job.requests_cpu * job.expected_run_time
+
+
+def get_queue(queue_type: QueueType, tenant_weights: Dict[str, float] | None = None):
+    match queue_type:
+        case QueueType.FIFO:
+            return FifoQueue()
+        case QueueType.PRIORITY:
+            return PriorityQueue()
+        case QueueType.FAIR_SHARE:
+            return FairShareQueue(tenant_weights)
+        case _:
+            raise Exception(f"Unexpected queue type {queue_type}")
@@ -0,0 +1,234 @@
+import asyncio
+from typing import List, Tuple
+
+from redis.asyncio import Redis
+
+from entity import Id, Job, JobStatus, Node, ActionStatus
+from storage import Storage, job_matches
+
+JOB_FIELDS = ('status', 'expected_run_time', 'requests_cpu', 'requests_memory', 'created_at', 'started_at',
+              'node_id', 'priority', 'tenant', 'tasks', 'tasks_started', 'tasks_running', 'tasks_completed',
+              'tasks_terminated', 'depends_on')
+LIST_FIELDS = {'depends_on'}
+NODE_FIELDS = ('jobs_capacity', 'jobs_allocated', 'cpu_capacity', 'cpu_allocated',
+               'memory_capacity', 'memory_allocated')
+
+
+def encode(entity, fields) -> dict:
+    result = {}
+    for field in fields:
+        value = getattr(entity, field)
+        if field in LIST_FIELDS:
+            result[field] = ','.join(value)
+        else:
+            result[field] = '' if value is None else str(value)
+    return result
+
+
+def decode(values: dict) -> dict:
+    result = {}
+    for field, value in values.items():
+        if field in LIST_FIELDS:
+            result[field] = value.split(',') if value else []
+        else:
+            result[field] = None if value == '' else value
+    return result
+
+
+class RedisStorage(Storage):
+    def __init__(self, url: str | None = None, prefix: str = 'scheduler', client: Redis | None = None):
+        self._client = client if client is not None else Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._seq_key = f'{prefix}:seq'
+        self._jobs_key = f'{prefix}:jobs'
+        self._nodes_key = f'{prefix}:nodes'
+
+    def close(self):
+        try:
+            asyncio.get_running_loop().create_task(self._client.aclose())
+        except RuntimeError:
+            asyncio.run(self._client.aclose())
+
+    def _job_key(self, job_id: Id) -> str:
+        return f'{self._prefix}:job:{job_id}'
+
+    def _node_key(self, node_id: Id) -> str:
+        return f'{self._prefix}:node:{node_id}'
+
+    def _status_key(self, status: JobStatus) -> str:
+        return f'{self._prefix}:jobs:status:{status.value}'
+
+    def _node_jobs_key(self, node_id: Id) -> str:
+        return f'{self._prefix}:node:{node_id}:jobs'
+
+    async def _next_seq(self, count: int) -> int:
+        return await self._client.incrby(self._seq_key, count) - count + 1
+
+    def _write_node(self, pipeline, node: Node):
+        pipeline.hset(self._node_key(node.id), mapping=encode(node, NODE_FIELDS))
+
+    def _write_job(self, pipeline, job: Job, seq: float | None):
+        # Status indexes are zsets scored like the order of all jobs, so a status is paged directly.
+        pipeline.hset(self._job_key(job.id), mapping=encode(job, JOB_FIELDS))
+        for status in JobStatus:
+            if status != job.status:
+                pipeline.zrem(self._status_key(status), job.id)
+        if seq is not None:
+            pipeline.zadd(self._status_key(job.status), {job.id: seq})
+        if job.node_id is not None:
+            if job.status == JobStatus.RUNNING:
+                pipeline.sadd(self._node_jobs_key(job.node_id), job.id)
+            else:
+                pipeline.srem(self._node_jobs_key(job.node_id), job.id)
+
+    async def add_node(self, node: Node):
+        await self.add_nodes([node])
+
+    async def add_nodes(self, nodes: List[Node]):
+        if not nodes:
+            return
+        seq = await self._next_seq(len(nodes))
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for i, node in enumerate(nodes):
+                self._write_node(pipeline, node)
+                pipeline.zadd(self._nodes_key, {node.id: seq + i}, nx=True)
+            await pipeline.execute()
+
+    async def get_node(self, node_id: Id) -> Node | None:
+        values = await self._client.hgetall(self._node_key(node_id))
+        return Node(id=node_id, **decode(values)) if values else None
+
+    async def update_node(self, node: Node) -> ActionStatus:
+        if not await self._client.exists(self._node_key(node.id)):
+            return ActionStatus.NOT_FOUND
+        await self.update_nodes([node])
+        return ActionStatus.OK
+
+    async def update_nodes(self, nodes: List[Node]):
+        if not nodes:
+            return
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for node in nodes:
+                self._write_node(pipeline, node)
+            await pipeline.execute()
+
+    async def delete_node(self, node_id: Id) -> ActionStatus:
+        async with self._client.pipeline(transaction=True) as pipeline:
+            pipeline.delete(self._node_key(node_id))
+            pipeline.zrem(self._nodes_key, node_id)
+            pipeline.delete(self._node_jobs_key(node_id))
+            deleted, _, _ = await pipeline.execute()
+        return ActionStatus.OK if deleted else ActionStatus.NOT_FOUND
+
+    async def get_nodes(self) -> List[Node]:
+        return await self._get_nodes(await self._client.zrange(self._nodes_key, 0, -1))
+
+    async def _get_nodes(self, node_ids: List[Id]) -> List[Node]:
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for node_id in node_ids:
+                pipeline.hgetall(self._node_key(node_id))
+            rows = await pipeline.execute()
+        return [Node(id=node_id, **decode(values)) for node_id, values in zip(node_ids, rows) if values]
+
+    async def add_job(self, job: Job):
+        await self.add_jobs([job])
+
+    async def add_jobs(self, jobs: List[Job]):
+        if not jobs:
+            return
+        seq = await self._next_seq(len(jobs))
+        known = await self._client.zmscore(self._jobs_key, [job.id for job in jobs])
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for i, (job, job_seq) in enumerate(zip(jobs, known)):
+                self._write_job(pipeline, job, job_seq if job_seq is not None else seq + i)
+                pipeline.zadd(self._jobs_key, {job.id: seq + i}, nx=True)
+            await pipeline.execute()
+
+    async def get_job(self, job_id: Id) -> Job | None:
+        values = await self._client.hgetall(self._job_key(job_id))
+        return Job(id=job_id, **decode(values)) if values else None
+
+    async def update_job(self, job: Job) -> ActionStatus:
+        if not await self._client.exists(self._job_key(job.id)):
+            return ActionStatus.NOT_FOUND
+        await self.update_jobs([job])
+        return ActionStatus.OK
+
+    async def update_jobs(self, jobs: List[Job]):
+        if not jobs:
+            return
+        seqs = await self._client.zmscore(self._jobs_key, [job.id for job in jobs])
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for job, seq in zip(jobs, seqs):
+                self._write_job(pipeline, job, seq)
+            await pipeline.execute()
+
+    async def delete_job(self, job_id: Id) -> ActionStatus:
+        node_id = await self._client.hget(self._job_key(job_id), 'node_id')
+        async with self._client.pipeline(transaction=True) as pipeline:
+            pipeline.delete(self._job_key(job_id))
+            pipeline.zrem(self._jobs_key, job_id)
+            for status in JobStatus:
+                pipeline.zrem(self._status_key(status), job_id)
+            if node_id:
+                pipeline.srem(self._node_jobs_key(node_id), job_id)
+            deleted = (await pipeline.execute())[0]
+        return ActionStatus.OK if deleted else ActionStatus.NOT_FOUND
+
+    async def get_jobs(self) -> List[Job]:
+        return await self._get_jobs(await self._client.zrange(self._jobs_key, 0, -1))
+
+    async def get_job_ids(self) -> List[Id]:
+        return await self._client.zrange(self._jobs_key, 0, -1)
+
+    async def get_jobs_by_status(self, status: JobStatus) -> List[Job]:
+        return await self._get_jobs(await self._client.zrange(self._status_key(status), 0, -1))
+
+    async def count_jobs_by_status(self, status: JobStatus) -> int:
+        return await self._client.zcard(self._status_key(status))
+
+    async def get_node_jobs(self, node_id: Id) -> List[Job]:
+        job_ids = await self._client.execute_command(
+            'ZINTER', 2, self._jobs_key, self._node_jobs_key(node_id), 'WEIGHTS', 1, 0)
+        return await self._get_jobs(job_ids)
+
+    async def _get_jobs(self, job_ids: List[Id]) -> List[Job]:
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for job_id in job_ids:
+                pipeline.hgetall(self._job_key(job_id))
+            rows = await pipeline.execute()
+        return [Job(id=job_id, **decode(values)) for job_id, values in zip(job_ids, rows) if values]
+
+    async def query_jobs(self, status: JobStatus | None = None, created_after: float | None = None,
+                         created_before: float | None = None, cursor: str | None = None,
+                         limit: int | None = None) -> Tuple[List[Job], str | None]:
+        page = []
+        seq = int(cursor) if cursor else 0
+        filtered = created_after is not None or created_before is not None
+        chunk_size = max(limit or 0, 1000) if filtered or not limit else limit
+        while True:
+            entries = await self._job_entries(status, seq, chunk_size)
+            jobs = await self._get_jobs([job_id for job_id, _ in entries])
+            scores = dict(entries)
+            for job in jobs:
+                if job_matches(job, status, created_after, created_before):
+                    page.append(job)
+                    if limit and len(page) == limit:
+                        return page, str(int(scores[job.id]))
+            if len(entries) < chunk_size:
+                return page, None
+            seq = int(entries[-1][1])
+
+    async def _job_entries(self, status: JobStatus | None, after: int, count: int) -> list:
+        key = self._jobs_key if status is None else self._status_key(status)
+        return await self._client.zrangebyscore(key, f'({after}', '+inf', start=0, num=count, withscores=True)
+
+    async def query_nodes(self, cursor: str | None = None,
+                          limit: int | None = None) -> Tuple[List[Node], str | None]:
+        seq = int(cursor) if cursor else 0
+        entries = await self._client.zrangebyscore(self._nodes_key, f'({seq}', '+inf', start=0,
+                                                   num=limit or -1, withscores=True)
+        nodes = await self._get_nodes([node_id for node_id, _ in entries])
+        if limit and len(entries) == limit:
+            return nodes, str(int(entries[-1][1]))
+        return nodes, None
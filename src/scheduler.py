@@ -1,17 +1,37 @@
 import asyncio
+import heapq
 import signal
 import logging
-from typing import List
-from time import time
+import math
+import sys
+from collections import OrderedDict
+from itertools import repeat
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from enum import StrEnum
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Tuple
+from time import perf_counter, time
 
-from storage import get_storage
-from entity import NewJob, Job, NewNode, Node, ActionStatus, JobStatus, Id
+from admission import Admission
+from archive import JobArchive
+from capacity import PlacementEngine, PlacementStrategy, get_capacity_index
+from events import EVENT_BUFFER, EventBus, Subscription
+from metrics import Gauge, SchedulerMetrics, instrument_storage, render
+from queues import QueueType, get_queue
+from storage import CACHE_FLUSH_INTERVAL, get_storage
+from entity import (NewJob, Job, JobEvent, JobRecord, NewNode, Node, NodeRecord, ActionStatus, JobStatus, Id,
+                    task_array, task_id)
 
 logger = logging.getLogger("scheduler")
 
 SCHEDULING_INTERVAL = 60
 
 
+class DependencyPolicy(StrEnum):
+    FAIL = 'fail'
+    CASCADE = 'cascade'
+
+
 def fit_available(job: Job, nodes: List[Node]) -> List[Node]:
     result = []
     for node in nodes:
@@ -33,99 +53,584 @@ def recalc_allocated_resources(node: Node, running_jobs: List[Job]):
     return node
 
 
+def allocate_resources(node: Node, job: Job):
+    node.jobs_allocated += 1
+    node.cpu_allocated += job.requests_cpu
+    node.memory_allocated += job.requests_memory
+    return node
+
+
+def release_resources(node: Node, job: Job):
+    node.jobs_allocated -= 1
+    node.cpu_allocated -= job.requests_cpu
+    node.memory_allocated -= job.requests_memory
+    if node.jobs_allocated == 0:
+        node.cpu_allocated = 0
+        node.memory_allocated = 0
+    return node
+
+
 class Scheduler:
-    def __init__(self, storage_type):
+    def __init__(self, storage_type, engine: PlacementEngine = PlacementEngine.INDEX,
+                 storage_url: str | None = None, queue: QueueType = QueueType.FIFO,
+                 tenant_weights: Dict[str, float] | None = None,
+                 strategy: PlacementStrategy = PlacementStrategy.FIRST_FIT, backfill: bool = False,
+                 check_interval: float = 0, id_start: int = 1, id_step: int = 1, metrics: bool = True,
+                 clock: Callable[[], float] = time, retention_age: float = 0, retention_count: int = 0,
+                 archive_path: str | None = None, cache_size: int = 0,
+                 cache_flush_interval: float = CACHE_FLUSH_INTERVAL,
+                 dependency_policy: DependencyPolicy = DependencyPolicy.FAIL, max_pending: int = 0,
+                 max_tenant_pending: int = 0, submit_rate: float = 0, tenant_submit_rate: float = 0,
+                 submit_burst: int = 0):
         signal.signal(signal.SIGINT, self._shutdown)
-        storage = get_storage(storage_type)
+        self._clock = clock
+        storage = get_storage(storage_type, storage_url, cache_size, cache_flush_interval)
+        self._metrics = SchedulerMetrics() if metrics else None
+        if self._metrics:
+            instrument_storage(storage, self._metrics.storage)
         self._storage = storage
-        self.next_job_id = 1
-        self.next_node_id = 1
-        self.node_jobs = {}
+        self.next_job_id = id_start
+        self.next_node_id = id_start
+        self._id_start = id_start
+        self._id_step = id_step
+        self._started = False
+        self.node_jobs: Dict[Id, Dict[Id, JobRecord]] = {}
         self.jobs_nodes = {}
-        self.pending_jobs = []
+        self.pending_jobs = get_queue(queue, tenant_weights)
+        self._pending: Dict[Id, JobRecord] = {}
+        self._intake: Dict[Id, JobRecord] = {}
+        self._capacity = get_capacity_index(engine, strategy)
+        self._backfill = backfill
+        self._dirty_nodes = {}
+        self._check_interval = check_interval
+        self._next_check_time = self._clock() + check_interval
+        self._completions = []
+        self._completion_times = {}
+        self._retention_age = retention_age
+        self._retention_count = retention_count
+        self._finished: OrderedDict[Id, Tuple[float, JobRecord]] = OrderedDict()
+        self._arrays: Dict[Id, JobRecord] = {}
+        self._dependency_policy = dependency_policy
+        self._waiting: Dict[Id, JobRecord] = {}
+        self._unmet: Dict[Id, int] = {}
+        self._dependents: Dict[Id, List[Id]] = {}
+        self._changed: Dict[Id, JobRecord] = {}
+        self._admission = (Admission(max_pending, max_tenant_pending, submit_rate, tenant_submit_rate, submit_burst)
+                           if max_pending or max_tenant_pending or submit_rate or tenant_submit_rate else None)
+        self._archive = JobArchive(archive_path) if archive_path else None
+        self.events = EventBus()
+        self._wakeup = asyncio.Event()
         self.lock = asyncio.Lock()
-        self.next_schedule_time = time()
+        self.next_schedule_time = self._clock()
 
     def _shutdown(self, _sig, _frame):
+        self.close()
+
+    async def flush(self):
+        await self._storage.flush()
+
+    def close(self):
         self._storage.close()
+        if self._archive:
+            self._archive.close()
+
+    async def start(self):
+        # Takes over what storage already holds, so a restart over persistent storage carries on with
+        # the nodes, running and pending jobs and ids the previous process left behind.
+        if self._started:
+            return
+        self._started = True
+        now = self._clock()
+        stored_nodes = await self._storage.get_nodes()
+        stored_node_ids = {node.id for node in stored_nodes}
+        node_jobs = {node.id: {} for node in stored_nodes if self._owns(node.id)}
+        interrupted = []
+        arrays = []
+        for job in await self._storage.get_jobs_by_status(JobStatus.RUNNING):
+            if job.tasks > 1:
+                if self._owns(job.id):
+                    arrays.append(JobRecord.from_model(job))
+            elif job.node_id in node_jobs:
+                node_jobs[job.node_id][job.id] = JobRecord.from_model(job)
+            elif self._owns(job.id) and job.node_id not in stored_node_ids:
+                interrupted.append(JobRecord.from_model(job.model_copy(
+                    update={'status': JobStatus.NEW, 'started_at': None, 'node_id': None})))
+        for node in stored_nodes:
+            if node.id in node_jobs:
+                running = node_jobs[node.id]
+                self._capacity.add(recalc_allocated_resources(NodeRecord.from_model(node), list(running.values())))
+                self.node_jobs[node.id] = running
+                self._dirty_nodes[node.id] = None
+                for job in running.values():
+                    self.jobs_nodes[job.id] = node.id
+                    self._track_completion(job)
+        pending = [JobRecord.from_model(job) for job in await self._storage.get_jobs_by_status(JobStatus.NEW)
+                   if self._owns(job.id)]
+        arrays += [job for job in pending if job.tasks > 1]
+        self._arrays.update((array.id, array) for array in arrays)
+        for array in arrays:
+            array.tasks_running = 0
+        for job_id in self.jobs_nodes:
+            if (task := task_array(job_id)) is not None and task[0] in self._arrays:
+                self._arrays[task[0]].tasks_running += 1
+        # Running arrays with tasks left to start go back among the pending jobs in creation order.
+        pending = sorted(pending + [array for array in arrays if array.status == JobStatus.RUNNING
+                                    and array.tasks_started < array.tasks], key=lambda job: int(job.id))
+        self._intake.update((job.id, job) for job in interrupted + pending)
+        self._count_pending(interrupted + pending)
+        if self._retention_age or self._retention_count:
+            finished = []
+            for status in (JobStatus.COMPLETED, JobStatus.TERMINATED, JobStatus.FAILED):
+                for job in await self._storage.get_jobs_by_status(status):
+                    if self._owns(job.id):
+                        finished_at = (job.started_at + job.expected_run_time
+                                       if status == JobStatus.COMPLETED and job.started_at is not None else now)
+                        finished.append((finished_at, JobRecord.from_model(job)))
+            finished.sort(key=lambda item: item[0])
+            self._finished.update((job.id, (finished_at, job)) for finished_at, job in finished)
+        # Dependencies may have finished while the scheduler was down, waiting jobs count them again.
+        waiting = sorted((JobRecord.from_model(job) for job in await self._storage.get_jobs_by_status(JobStatus.WAITING)
+                          if self._owns(job.id)), key=lambda job: int(job.id))
+        self._count_pending(waiting)
+        await self._hold_for_dependencies(waiting)
+        ready = [job for job in waiting if job.status == JobStatus.NEW]
+        self._arrays.update((job.id, job) for job in ready if job.tasks > 1)
+        self._intake.update((job.id, job) for job in ready)
+        released = [job for job in waiting if job.status != JobStatus.WAITING]
+        job_ids = [int(job_id) for job_id in await self._storage.get_job_ids() if job_id.isdigit()]
+        if self._archive:
+            job_ids.append(self._archive.max_id())
+        self.next_job_id = self._next_id(max(job_ids, default=0))
+        self.next_node_id = self._next_id(max((int(node.id) for node in stored_nodes if node.id.isdigit()),
+                                              default=0))
+        async with self._locked():
+            await self._storage.update_jobs(interrupted + arrays + released)
+            await self._flush_nodes()
+        if self._intake or self.jobs_nodes:
+            logger.info(f"Recovered {len(self.node_jobs)} nodes, {len(self.jobs_nodes)} running, "
+                        f"{len(self._intake)} pending and {len(self._waiting)} waiting jobs")
+        self._wake()
+
+    def _owns(self, item_id: Id) -> bool:
+        # Shards over shared storage each take the ids they hand out.
+        if self._id_step == 1:
+            return True
+        number = item_id.partition('.')[0]
+        return number.isdigit() and (int(number) - self._id_start) % self._id_step == 0
+
+    def _next_id(self, last_id: int) -> int:
+        if last_id < self._id_start:
+            return self._id_start
+        return self._id_start + ((last_id - self._id_start) // self._id_step + 1) * self._id_step
 
     async def run(self):
+        await self.start()
         while True:
             await self._tick()
-            await asyncio.sleep(1)
+            await self._wait()
+
+    async def _wait(self):
+        timeout = self.next_schedule_time - self._clock()
+        if timeout <= 0:
+            await asyncio.sleep(0)
+            return
+        try:
+            async with asyncio.timeout(timeout):
+                await self._wakeup.wait()
+        except TimeoutError:
+            pass
+
+    def _wake(self):
+        self.next_schedule_time = self._clock()
+        self._wakeup.set()
 
     async def _tick(self):
-        if time() >= self.next_schedule_time:
-            async with self.lock:
-                await self._complete_running_jobs()
-                await self._schedule_jobs()
-
-    async def _complete_running_jobs(self):
-        nodes = await self._storage.get_nodes()
-        next_schedule_time = time() + SCHEDULING_INTERVAL
-        if self.next_schedule_time < time():
-            self.next_schedule_time = next_schedule_time
-        for node in nodes:
-            completed_jobs = []
-            running_jobs = []
-            node_jobs = self.node_jobs[node.id]
-            for job_id in node_jobs:
-                job = await self._storage.get_job(job_id)
-                job_completion_time = job.started_at + job.expected_run_time
-                if job_completion_time < time():
-                    completed_jobs.append(job_id)
-                    job.status = JobStatus.COMPLETED
-                    await self._storage.update_job(job)
-                    del self.jobs_nodes[job_id]
-                    logger.info(f"Completed job {job_id} on node {node.id}")
+        # State changes are applied in memory without awaiting, the lock only orders the storage
+        # writes that follow so they land in the same order as the changes they record.
+        if self._clock() >= self.next_schedule_time:
+            started = perf_counter()
+            changed_jobs = self._complete_running_jobs()
+            completed = perf_counter()
+            started_jobs = self._schedule_jobs()
+            if self._admission:
+                self._admission.update(started_jobs, self._clock())
+            changed_jobs = self._with_changed(changed_jobs + started_jobs)
+            scheduled = perf_counter()
+            # Dependents released above wake the loop too, this tick already took them in.
+            self._wakeup.clear()
+            self.next_schedule_time = self._next_completion_time(self._clock() + SCHEDULING_INTERVAL)
+            expired_jobs = self._expire_jobs()
+            async with self._locked():
+                await self._store_jobs(changed_jobs)
+                await self._flush_nodes()
+                if expired_jobs:
+                    if self._archive:
+                        self._archive.append(expired_jobs)
+                    await self._storage.delete_jobs([job.id for job in expired_jobs])
+            self._publish(changed_jobs)
+            if self._metrics:
+                self._metrics.complete.observe(completed - started)
+                self._metrics.schedule.observe(scheduled - completed)
+                self._metrics.tick.observe(perf_counter() - started)
+            if self._check_interval and self._clock() >= self._next_check_time:
+                await self.check_consistency()
+                self._next_check_time = self._clock() + self._check_interval
+
+    def _with_changed(self, jobs: List[JobRecord]) -> List[JobRecord]:
+        # Adds the arrays and dependents that changed along with the jobs, each once.
+        if not self._changed:
+            return jobs
+        changed, self._changed = self._changed, {}
+        return list(({job.id: job for job in jobs} | changed).values())
+
+    async def _store_jobs(self, jobs: List[JobRecord]):
+        # Tasks get a row when they start and lose it when they complete, only the array row stays.
+        tasks = [job for job in jobs if '.' in job.id]
+        if not tasks:
+            if jobs:
+                await self._storage.update_jobs(jobs)
+            return
+        started = [job for job in tasks if job.status != JobStatus.COMPLETED]
+        completed = [job.id for job in tasks if job.status == JobStatus.COMPLETED]
+        if started:
+            await self._storage.add_jobs(started)
+        await self._storage.update_jobs([job for job in jobs if '.' not in job.id])
+        if completed:
+            await self._storage.delete_jobs(completed)
+
+    def _publish(self, jobs: List[JobRecord], node_id: Id | None = None):
+        # Sent once the change is in storage, so a subscriber reading the job back sees it.
+        if jobs and self.events.active:
+            now = self._clock()
+            self.events.publish([JobEvent(job_id=job.id, status=job.status, node_id=node_id or job.node_id, time=now)
+                                 for job in jobs])
+
+    async def subscribe(self, job_ids: List[Id] = (), node_ids: List[Id] = (), statuses: List[JobStatus] = (),
+                        size: int = EVENT_BUFFER) -> Subscription:
+        return self.events.subscribe(job_ids, node_ids, statuses, size)
+
+    def _locked(self):
+        return self._timed_lock() if self._metrics else self.lock
+
+    @asynccontextmanager
+    async def _timed_lock(self):
+        started = perf_counter()
+        async with self.lock:
+            self._metrics.lock_wait.observe(perf_counter() - started)
+            yield
+
+    def _next_completion_time(self, default: float) -> float:
+        completions = self._completions
+        while completions and self._completion_times.get(completions[0][1]) != completions[0][0]:
+            heapq.heappop(completions)
+        if completions and completions[0][0] < default:
+            return completions[0][0]
+        return default
+
+    def _track_completion(self, job: JobRecord):
+        completion_time = job.started_at + job.expected_run_time
+        self._completion_times[job.id] = completion_time
+        heapq.heappush(self._completions, (completion_time, job.id))
+
+    def _untrack_completion(self, job_id: Id):
+        self._completion_times.pop(job_id, None)
+        if len(self._completions) > 2 * len(self._completion_times) + 1024:
+            self._completions = [(completion_time, job_id)
+                                 for job_id, completion_time in self._completion_times.items()]
+            heapq.heapify(self._completions)
+
+    def _complete_running_jobs(self) -> List[JobRecord]:
+        now = self._clock()
+        completions = self._completions
+        completed_jobs = []
+        while completions and completions[0][0] <= now:
+            completion_time, job_id = heapq.heappop(completions)
+            if self._completion_times.get(job_id) != completion_time:
+                continue
+            del self._completion_times[job_id]
+            node_id = self.jobs_nodes.pop(job_id)
+            job = self.node_jobs[node_id].pop(job_id)
+            job.status = JobStatus.COMPLETED
+            self._finish(job, now)
+            completed_jobs.append(job)
+            self._capacity.release(node_id, job)
+            self._dirty_nodes[node_id] = None
+            logger.info(f"Completed job {job_id} on node {node_id}")
+        return completed_jobs
+
+    def _finish(self, job: JobRecord, now: float):
+        if self._dependents:
+            self._resolve_dependents(job.id, job.status, now)
+        task = task_array(job.id)
+        if task is not None:
+            self._finish_task(task[0], job, now)
+            if job.status == JobStatus.COMPLETED:
+                return
+        self._retain(job, now)
+
+    def _retain(self, job: JobRecord, now: float):
+        if self._retention_age or self._retention_count:
+            self._finished[job.id] = (now, job)
+
+    def _tracks(self, job_id: Id) -> bool:
+        # Tasks an active array has not started yet count as well.
+        if (job_id in self._waiting or job_id in self._intake or job_id in self._pending
+                or job_id in self.jobs_nodes or job_id in self._arrays):
+            return True
+        task = task_array(job_id)
+        return task is not None and task[0] in self._arrays and task[1] < self._arrays[task[0]].tasks
+
+    def finished(self, job_ids: Iterable[Id]) -> List[Id]:
+        # Of the given jobs, the ones that reached an end or were deleted.
+        return [job_id for job_id in job_ids if not self._tracks(job_id)]
+
+    def _resolve_task_dependents(self, array_id: Id, status: JobStatus | None, now: float) -> List[Id]:
+        # Dependents of tasks that will not run any more, once their array is terminated or deleted.
+        prefix = f'{array_id}.'
+        deleted = []
+        for job_id in [job_id for job_id in self._dependents if job_id.startswith(prefix)]:
+            deleted += self._resolve_dependents(job_id, status, now)
+        return deleted
+
+    async def _hold_for_dependencies(self, jobs: List[JobRecord]):
+        # Jobs come in the order they were created, so a job in the batch only depends on the ones before
+        # it. Dependencies the scheduler no longer tracks have finished and storage tells whether they
+        # completed. Nothing is awaited between the last lookup and registering the waiting jobs.
+        batch = {job.id for job in jobs}
+        completed: Dict[Id, bool] = {}
+        while True:
+            unknown = {dependency_id for job in jobs for dependency_id in job.depends_on
+                       if dependency_id not in completed and dependency_id not in batch
+                       and not self._tracks(dependency_id)}
+            if not unknown:
+                break
+            for dependency_id in unknown:
+                dependency = await self.get_job(dependency_id)
+                completed[dependency_id] = dependency is not None and dependency.status == JobStatus.COMPLETED
+        now = self._clock()
+        held = set()
+        for job in jobs:
+            unmet = [dependency_id for dependency_id in job.depends_on
+                     if dependency_id in held or self._tracks(dependency_id)]
+            if not all(completed.get(dependency_id, False) for dependency_id in job.depends_on
+                       if dependency_id not in unmet):
+                job.status = JobStatus.FAILED
+                self._uncount_pending([job])
+                self._finish(job, now)
+                continue
+            held.add(job.id)
+            if unmet:
+                job.status = JobStatus.WAITING
+                self._waiting[job.id] = job
+                self._unmet[job.id] = len(unmet)
+                for dependency_id in unmet:
+                    self._dependents.setdefault(dependency_id, []).append(job.id)
+            else:
+                job.status = JobStatus.NEW
+
+    def _resolve_dependents(self, job_id: Id, status: JobStatus | None, now: float) -> List[Id]:
+        # Waiting jobs count their unmet dependencies, so a job that completes only visits its own
+        # dependents. Any other end fails them, or with the cascade policy terminates or deletes
+        # them (status None) along with their own dependents. Returns the ids to delete.
+        if status == JobStatus.COMPLETED:
+            for dependent_id in self._dependents.pop(job_id, ()):
+                unmet = self._unmet.get(dependent_id)
+                if unmet is None:
+                    continue
+                if unmet > 1:
+                    self._unmet[dependent_id] = unmet - 1
+                    continue
+                del self._unmet[dependent_id]
+                dependent = self._waiting.pop(dependent_id)
+                dependent.status = JobStatus.NEW
+                if dependent.tasks > 1:
+                    self._arrays[dependent_id] = dependent
+                self._intake[dependent_id] = dependent
+                self._changed[dependent_id] = dependent
+                self._wake()
+            return []
+        cascade = self._dependency_policy == DependencyPolicy.CASCADE
+        deleted = []
+        stack = [job_id]
+        while stack:
+            for dependent_id in self._dependents.pop(stack.pop(), ()):
+                if self._unmet.pop(dependent_id, None) is None:
+                    continue
+                dependent = self._waiting.pop(dependent_id)
+                self._uncount_pending([dependent])
+                stack.append(dependent_id)
+                if cascade and status is None:
+                    deleted.append(dependent_id)
+                    self._changed.pop(dependent_id, None)
                 else:
-                    if job_completion_time < next_schedule_time:
-                        next_schedule_time = job_completion_time
-                    running_jobs.append(job)
-            for job_id in completed_jobs:
-                node_jobs.remove(job_id)
-            node = recalc_allocated_resources(node, running_jobs)
-            await self._storage.update_node(node)
-        if self.next_schedule_time > next_schedule_time:
-            self.next_schedule_time = next_schedule_time
-
-    async def _schedule_jobs(self):
-        nodes = await self._storage.get_nodes()
-        next_schedule_time = time() + SCHEDULING_INTERVAL
-        if self.next_schedule_time < time():
-            self.next_schedule_time = next_schedule_time
+                    dependent.status = JobStatus.TERMINATED if cascade else JobStatus.FAILED
+                    self._changed[dependent_id] = dependent
+                    self._retain(dependent, now)
+        return deleted
+
+    def _finish_task(self, array_id: Id, job: JobRecord, now: float):
+        array = self._arrays.get(array_id)
+        if array is None:
+            return
+        array.tasks_running -= 1
+        if job.status == JobStatus.COMPLETED:
+            array.tasks_completed += 1
+        else:
+            array.tasks_terminated += 1
+        self._changed[array.id] = array
+        if array.tasks_completed + array.tasks_terminated == array.tasks:
+            array.status = JobStatus.COMPLETED
+            del self._arrays[array.id]
+            self._finish(array, now)
+
+    def _start_task(self, job: JobRecord) -> JobRecord:
+        # Arrays hand out their next task, a task that was interrupted goes back to its array's count.
+        if job.tasks > 1:
+            array = job
+            job = JobRecord(task_id(array.id, array.tasks_started), JobStatus.NEW, array.expected_run_time,
+                            array.requests_cpu, array.requests_memory, array.created_at, None, None,
+                            array.priority, array.tenant)
+            array.tasks_started += 1
+            if array.status == JobStatus.NEW:
+                array.status = JobStatus.RUNNING
+                array.started_at = self._clock()
+        else:
+            array = self._arrays.get(task_array(job.id)[0])
+            if array is None:
+                return job
+        array.tasks_running += 1
+        self._changed[array.id] = array
+        return job
+
+    def _expand_arrays(self, pending: Iterable[JobRecord]) -> Iterator[JobRecord]:
+        # An array stands for as many of its tasks as the cluster could possibly take in one pass.
+        free_slots = self._capacity.max_free()[0] * len(self._capacity)
+        for job in pending:
+            if job.tasks > 1:
+                yield from repeat(job, min(job.tasks - job.tasks_started, free_slots))
+            else:
+                yield job
+
+    def _expire_jobs(self) -> List[JobRecord]:
+        # Terminal jobs leave storage oldest first once there are too many of them or they are too old.
+        finished = self._finished
+        oldest = self._clock() - self._retention_age if self._retention_age else None
+        expired = []
+        while finished:
+            finished_at, job = finished[next(iter(finished))]
+            if not (self._retention_count and len(finished) > self._retention_count
+                    or oldest is not None and finished_at < oldest):
+                break
+            finished.popitem(last=False)
+            expired.append(job)
+        return expired
+
+    def _schedule_jobs(self) -> List[JobRecord]:
+        if self._intake:
+            intake, self._intake = self._intake, {}
+            self._pending.update(intake)
+            self.pending_jobs.extend(intake.values())
+        # The queue is walked lazily and placement stops once the cluster is full, so a long queue
+        # costs only what is looked at.
+        pending = (self._pending[job_id] for job_id in self.pending_jobs)
+        if self._arrays:
+            pending = self._expand_arrays(pending)
         assigned_jobs = []
-        for job_id in self.pending_jobs:
-            job = await self._storage.get_job(job_id)
-            if not job:
+        job_wait = self._metrics.job_wait if self._metrics else None
+        for job, node_id in self._place(pending):
+            if self._arrays and (job.tasks > 1 or '.' in job.id):
+                job = self._start_task(job)
+            self.jobs_nodes[job.id] = node_id
+            job.status = JobStatus.RUNNING
+            job.started_at = self._clock()
+            job.node_id = node_id
+            self.node_jobs[node_id][job.id] = job
+            self._dirty_nodes[node_id] = None
+            self._track_completion(job)
+            if job_wait:
+                job_wait.observe(job.started_at - job.created_at)
+            assigned_jobs.append(job)
+            logger.info(f"Job {job.id} assigned to node {node_id}")
+        for job in assigned_jobs:
+            if self._pending.pop(job.id, None) is not None:
+                self.pending_jobs.remove(job.id)
+            self.pending_jobs.charge(job)
+        for array in self._changed.values():
+            if array.tasks > 1 and array.tasks_started == array.tasks and self._pending.pop(array.id, None) is not None:
+                self.pending_jobs.remove(array.id)
+        return assigned_jobs
+
+    async def _flush_nodes(self):
+        # The capacity index holds the allocation totals, storage only sees nodes that changed.
+        nodes = [self._capacity.node(node_id) for node_id in self._dirty_nodes if node_id in self._capacity]
+        self._dirty_nodes = {}
+        if nodes:
+            await self._storage.update_nodes(nodes)
+
+    async def check_consistency(self) -> List[Id]:
+        repaired = []
+        for node_id, running_jobs in self.node_jobs.items():
+            node = self._capacity.node(node_id)
+            if node is None:
                 continue
-            available_nodes = fit_available(job, nodes)
-            if len(available_nodes) > 0:
-                node = available_nodes[0]
-                node = await self._storage.get_node(node.id)
-                if not node:
-                    continue
+            expected = recalc_allocated_resources(replace(node), list(running_jobs.values()))
+            if (node.jobs_allocated != expected.jobs_allocated
+                    or not math.isclose(node.cpu_allocated, expected.cpu_allocated, abs_tol=1e-9)
+                    or node.memory_allocated != expected.memory_allocated):
+                logger.warning(f"Node {node_id} allocation drifted: {node.jobs_allocated}/{node.cpu_allocated}/"
+                               f"{node.memory_allocated} instead of {expected.jobs_allocated}/"
+                               f"{expected.cpu_allocated}/{expected.memory_allocated}")
+                self._capacity.update(expected)
+                repaired.append(expected)
+        async with self._locked():
+            await self._storage.update_nodes(repaired)
+        return [node.id for node in repaired]
 
-                self.jobs_nodes[job_id] = node.id
-                job.status = JobStatus.RUNNING
-                job.started_at = time()
-                await self._storage.update_job(job)
-
-                self.node_jobs[node.id].append(job_id)
-                node.jobs_allocated += 1
-                node.cpu_allocated += job.requests_cpu
-                node.memory_allocated += job.requests_memory
-                await self._storage.update_node(node)
-
-                job_completion_time = job.started_at + job.expected_run_time
-                if job_completion_time < next_schedule_time:
-                    next_schedule_time = job_completion_time
-                assigned_jobs.append(job_id)
-                logger.info(f"Job {job_id} assigned to node {node.id}")
-        for job_id in assigned_jobs:
-            self.pending_jobs.remove(job_id)
-        if self.next_schedule_time > next_schedule_time:
-            self.next_schedule_time = next_schedule_time
+    def _place(self, pending: Iterable[JobRecord]) -> List[Tuple[JobRecord, Id]]:
+        if not self._backfill:
+            return self._capacity.place(pending)
+        # Backfill looks behind the blocked head, so it takes the whole queue.
+        pending = list(pending)
+        placements = self._capacity.place(pending, stop_at_miss=True)
+        if len(placements) == len(pending):
+            return placements
+        # EASY backfill: the first job that does not fit gets a reservation on the node that frees
+        # up for it soonest, later jobs may only run on that node if they finish before it.
+        now = self._clock()
+        head = pending[len(placements)]
+        reservation = self._reserve(head, placements, now)
+        rest = pending[len(placements) + 1:]
+        if reservation is None:
+            return placements + self._capacity.place(rest)
+        shadow_time, reserved_node_id = reservation
+        backfilled = self._capacity.place(rest, exclude=reserved_node_id)
+        placed = {job.id for job, _ in backfilled}
+        short = [job for job in rest if job.id not in placed and now + job.expected_run_time <= shadow_time]
+        return placements + backfilled + self._capacity.place(short)
+
+    def _reserve(self, job: JobRecord, placements: List[Tuple[JobRecord, Id]], now: float) -> Tuple[float, Id] | None:
+        releases = {}
+        for node_id, running in self.node_jobs.items():
+            releases[node_id] = [(self._completion_times[job_id], job.requests_cpu, job.requests_memory)
+                                 for job_id, job in running.items()]
+        for placed, node_id in placements:
+            releases[node_id].append((now + placed.expected_run_time, placed.requests_cpu, placed.requests_memory))
+        reservation = None
+        for node_id, node_releases in releases.items():
+            free = self._capacity.free(node_id)
+            if free is None:
+                continue
+            slots, cpu, memory = free
+            for completion_time, requests_cpu, requests_memory in sorted(node_releases):
+                if reservation is not None and completion_time >= reservation[0]:
+                    break
+                slots += 1
+                cpu += requests_cpu
+                memory += requests_memory
+                if slots >= 1 and cpu >= job.requests_cpu and memory >= job.requests_memory:
+                    reservation = (completion_time, node_id)
+                    break
+        return reservation
 
     async def get_jobs(self) -> List[Job]:
         return await self._storage.get_jobs()
@@ -133,97 +638,315 @@ class Scheduler:
     async def get_nodes(self) -> List[Node]:
         return await self._storage.get_nodes()
 
+    async def query_jobs(self, status: JobStatus | None = None, created_after: float | None = None,
+                         created_before: float | None = None, cursor: str | None = None,
+                         limit: int | None = None) -> Tuple[List[Job], str | None]:
+        return await self._storage.query_jobs(status, created_after, created_before, cursor, limit)
+
+    async def query_nodes(self, cursor: str | None = None,
+                          limit: int | None = None) -> Tuple[List[Node], str | None]:
+        return await self._storage.query_nodes(cursor, limit)
+
+    def iter_job_pages(self, status: JobStatus | None = None, created_after: float | None = None,
+                       created_before: float | None = None) -> AsyncIterator[List[Job]]:
+        return self._storage.iter_job_pages(status, created_after, created_before)
+
+    def iter_node_pages(self) -> AsyncIterator[List[Node]]:
+        return self._storage.iter_node_pages()
+
     async def get_job(self, job_id) -> Job | None:
-        return await self._storage.get_job(job_id)
+        job = await self._storage.get_job(job_id)
+        if job is None and self._archive:
+            job = self._archive.get_job(job_id)
+        if job is None and (task := task_array(job_id)) is not None:
+            job = await self._get_task(*task)
+        return job
+
+    async def _get_task(self, array_id: Id, index: int) -> Job | None:
+        # Tasks without a row of their own either have not started yet or completed.
+        array = await self.get_job(array_id)
+        if array is None or array.tasks == 1 or index >= array.tasks:
+            return None
+        if index < array.tasks_started:
+            status = JobStatus.COMPLETED
+        else:
+            status = JobStatus.NEW if array.status in (JobStatus.NEW, JobStatus.RUNNING) else array.status
+        return Job(id=task_id(array_id, index), status=status, expected_run_time=array.expected_run_time,
+                   requests_cpu=array.requests_cpu, requests_memory=array.requests_memory,
+                   created_at=array.created_at, started_at=None, priority=array.priority, tenant=array.tenant)
 
     async def get_node(self, node_id) -> Node | None:
         return await self._storage.get_node(node_id)
 
+    def _admit(self, new_jobs: List[NewJob]):
+        if self._admission:
+            self._admission.admit(new_jobs, self._clock())
+
+    def _count_pending(self, jobs: List[JobRecord]):
+        # Jobs that become pending other than by admission, or stop being pending without starting.
+        if self._admission and jobs:
+            self._admission.add(jobs)
+
+    def _uncount_pending(self, jobs: List[JobRecord]):
+        if self._admission and jobs:
+            self._admission.remove(jobs)
+
     async def new_job(self, new_job: NewJob) -> Id:
-        async with self.lock:
-            job_id = str(self.next_job_id)
-            self.next_job_id += 1
-            job = Job(
-                id=job_id,
-                status=JobStatus.NEW,
-                expected_run_time=new_job.expected_run_time,
-                requests_cpu=new_job.requests_cpu,
-                requests_memory=new_job.requests_memory,
-                created_at=time(),
-                started_at=None
-            )
-            self.pending_jobs.append(job_id)
-            await self._storage.add_job(job)
-            self.next_schedule_time = time()
-            return job_id
+        self._admit([new_job])
+        job = self._create_job(new_job)
+        if job.depends_on:
+            await self.submit_jobs([job])
+            return job.id
+        await self._storage.add_job(job)
+        if job.tasks > 1:
+            self._arrays[job.id] = job
+        self._intake[job.id] = job
+        self._wake()
+        return job.id
+
+    async def new_jobs(self, new_jobs: List[NewJob]) -> List[Id]:
+        self._admit(new_jobs)
+        jobs = [self._create_job(new_job) for new_job in new_jobs]
+        await self.submit_jobs(jobs)
+        return [job.id for job in jobs]
+
+    async def submit_jobs(self, jobs: List[JobRecord], released: bool = False):
+        # Released jobs were spilled by another shard, their dependencies completed over there.
+        if not released and any(job.depends_on for job in jobs):
+            # Held under the lock so a dependency finishing meanwhile is stored after the dependent.
+            async with self._locked():
+                await self._hold_for_dependencies(jobs)
+                await self._storage.add_jobs(jobs)
+            jobs = [job for job in jobs if job.status == JobStatus.NEW]
+        else:
+            await self._storage.add_jobs(jobs)
+        if released:
+            self._count_pending(jobs)
+        self._arrays.update((job.id, job) for job in jobs if job.tasks > 1)
+        self._intake.update((job.id, job) for job in jobs)
+        self._wake()
+
+    async def spill_jobs(self, accept: Callable[[JobRecord], bool], limit: int,
+                         delete: bool) -> List[JobRecord]:
+        # Hands over pending jobs the last tick could not place, intake has not been tried yet.
+        spilled = []
+        for job_id in self.pending_jobs:
+            if len(spilled) == limit:
+                break
+            job = self._pending[job_id]
+            # Arrays and their tasks stay with the shard that counts them, dependencies with their dependents.
+            if job.tasks == 1 and '.' not in job_id and job_id not in self._dependents and accept(job):
+                spilled.append(job)
+        # Taken out after the walk, the queue may not change under its iterator.
+        for job in spilled:
+            self.pending_jobs.remove(job.id)
+            del self._pending[job.id]
+        self._uncount_pending(spilled)
+        if delete and spilled:
+            async with self._locked():
+                for job in spilled:
+                    await self._storage.delete_job(job.id)
+        return spilled
+
+    def status(self) -> dict:
+        return {
+            'pending': len(self.pending_jobs) + len(self._intake),
+            'unplaced': len(self.pending_jobs),
+            'running': len(self.jobs_nodes),
+            'max_free': self._capacity.max_free(),
+        }
+
+    def collect_metrics(self) -> list:
+        status = self.status()
+        gauges = [Gauge('scheduler_pending_jobs', 'Jobs waiting to be placed.', status['pending']),
+                  Gauge('scheduler_running_jobs', 'Jobs running on nodes.', status['running']),
+                  Gauge('scheduler_nodes', 'Nodes known to the scheduler.', len(self.node_jobs))]
+        return (gauges + (self._metrics.histograms() if self._metrics else []) + self._storage.collect_metrics()
+                + (self._admission.collect_metrics() if self._admission else []))
+
+    async def render_metrics(self) -> str:
+        return render([(self.collect_metrics(), {})])
+
+    def _create_job(self, new_job: NewJob) -> JobRecord:
+        job_id = str(self.next_job_id)
+        self.next_job_id += self._id_step
+        return JobRecord(
+            id=job_id,
+            status=JobStatus.NEW,
+            expected_run_time=new_job.expected_run_time,
+            requests_cpu=new_job.requests_cpu,
+            requests_memory=new_job.requests_memory,
+            created_at=self._clock(),
+            started_at=None,
+            priority=new_job.priority,
+            tenant=sys.intern(new_job.tenant) if new_job.tenant else None,
+            tasks=new_job.tasks,
+            depends_on=tuple(new_job.depends_on)
+        )
 
     async def delete_job(self, job_id) -> ActionStatus:
-        async with self.lock:
-            if job_id in self.pending_jobs:
-                self.pending_jobs.remove(job_id)
-                self.next_schedule_time = time()
-            if job_id in self.jobs_nodes:
-                node_id = self.jobs_nodes[job_id]
-                del self.jobs_nodes[job_id]
-                self.node_jobs[node_id].remove(job_id)
-                self.next_schedule_time = time()
-            return await self._storage.delete_job(job_id)
+        if task_array(job_id) is not None:
+            # Tasks go with their array.
+            return ActionStatus.NOT_FOUND
+        array = self._arrays.pop(job_id, None)
+        if array is not None:
+            self._uncount_pending([job for job in self._stop_tasks(job_id) if job.status == JobStatus.NEW])
+        active = array is not None
+        if (job := self._intake.pop(job_id, None) or self._pending.pop(job_id, None)) is not None:
+            self._uncount_pending([job])
+            self.pending_jobs.remove(job_id)
+            self._wake()
+            active = True
+        if job_id in self.jobs_nodes:
+            self._stop_running_job(job_id)
+            active = True
+        if (job := self._waiting.pop(job_id, None)) is not None:
+            self._uncount_pending([job])
+            del self._unmet[job_id]
+            active = True
+        deleted = []
+        if self._dependents:
+            deleted = self._resolve_dependents(job_id, None, self._clock())
+            if array is not None:
+                deleted += self._resolve_task_dependents(job_id, None, self._clock())
+        changed = self._with_changed([])
+        finished = self._finished.pop(job_id, None)
+        if not active:
+            # A finished array keeps the rows of tasks that were terminated.
+            stored = finished[1] if finished is not None else await self._storage.get_job(job_id)
+            if stored is not None and stored.tasks > 1:
+                array = stored
+        async with self._locked():
+            await self._flush_nodes()
+            if array is not None:
+                await self._storage.delete_jobs([task_id(job_id, index) for index in range(array.tasks_started)])
+            if deleted:
+                await self._storage.delete_jobs(deleted)
+            await self._store_jobs(changed)
+            result = await self._storage.delete_job(job_id)
+        self._publish(changed)
+        return result
 
     async def terminate_job(self, job_id) -> ActionStatus:
-        async with self.lock:
-            if job_id in self.jobs_nodes:
-                node_id = self.jobs_nodes[job_id]
-                del self.jobs_nodes[job_id]
-                self.node_jobs[node_id].remove(job_id)
-                self.next_schedule_time = time()
-                job = await self._storage.get_job(job_id)
-                job.status = JobStatus.TERMINATED
-                await self._storage.update_job(job)
-                return ActionStatus.OK
-            else:
-                return ActionStatus.NOT_FOUND
+        now = self._clock()
+        if job_id in self._arrays:
+            jobs = self._with_changed(self._terminate_array(job_id, now))
+        elif job_id in self.jobs_nodes:
+            job = self._stop_running_job(job_id)
+            job.status = JobStatus.TERMINATED
+            self._finish(job, now)
+            jobs = self._with_changed([job])
+        elif job_id in self._waiting:
+            job = self._waiting.pop(job_id)
+            self._uncount_pending([job])
+            del self._unmet[job_id]
+            job.status = JobStatus.TERMINATED
+            self._finish(job, now)
+            jobs = self._with_changed([job])
+        else:
+            return ActionStatus.NOT_FOUND
+        async with self._locked():
+            await self._store_jobs(jobs)
+            await self._flush_nodes()
+        self._publish(jobs)
+        return ActionStatus.OK
+
+    def _terminate_array(self, array_id: Id, now: float) -> List[JobRecord]:
+        array = self._arrays.pop(array_id)
+        if self._intake.pop(array_id, None) is not None or self._pending.pop(array_id, None) is not None:
+            self._uncount_pending([array])
+            self.pending_jobs.remove(array_id)
+        stopped = self._stop_tasks(array_id)
+        self._uncount_pending([job for job in stopped if job.status == JobStatus.NEW])
+        for job in stopped:
+            job.status = JobStatus.TERMINATED
+            self._finish(job, now)
+        array.status = JobStatus.TERMINATED
+        array.tasks_running = 0
+        array.tasks_terminated = array.tasks - array.tasks_completed
+        self._finish(array, now)
+        if self._dependents:
+            self._resolve_task_dependents(array_id, JobStatus.TERMINATED, now)
+        return stopped + [array]
+
+    def _stop_tasks(self, array_id: Id) -> List[JobRecord]:
+        # Running tasks and interrupted ones waiting to run again, the array must be out of _arrays.
+        prefix = f'{array_id}.'
+        stopped = [self._stop_running_job(job_id) for job_id in list(self.jobs_nodes) if job_id.startswith(prefix)]
+        for job_id in [job_id for job_id in self._pending if job_id.startswith(prefix)]:
+            stopped.append(self._pending.pop(job_id))
+            self.pending_jobs.remove(job_id)
+        for job_id in [job_id for job_id in self._intake if job_id.startswith(prefix)]:
+            stopped.append(self._intake.pop(job_id))
+        return stopped
+
+    def _stop_running_job(self, job_id: Id) -> JobRecord:
+        node_id = self.jobs_nodes.pop(job_id)
+        job = self.node_jobs[node_id].pop(job_id)
+        self._untrack_completion(job_id)
+        self._capacity.release(node_id, job)
+        self._dirty_nodes[node_id] = None
+        self._wake()
+        return job
 
     async def get_node_jobs(self, node_id) -> List[Job] | None:
         if node_id not in self.node_jobs:
             return None
-        result = []
-        job_ids = self.node_jobs[node_id]
-        for job_id in job_ids:
-            job = await self._storage.get_job(job_id)
-            if job:
-                result.append(job)
-        return result
+        return await self._storage.get_node_jobs(node_id)
 
     async def add_node(self, new_node: NewNode) -> Id:
-        async with self.lock:
-            node_id = str(self.next_node_id)
-            self.next_node_id += 1
-            node = Node(
-                id=node_id,
-                jobs_capacity=new_node.jobs_capacity,
-                jobs_allocated=0,
-                cpu_capacity=new_node.cpu_capacity,
-                cpu_allocated=0,
-                memory_capacity=new_node.memory_capacity,
-                memory_allocated=0
-            )
+        node = self._create_node(new_node)
+        self._capacity.add(node)
+        self.node_jobs[node.id] = {}
+        async with self._locked():
             await self._storage.add_node(node)
-            self.node_jobs[node_id] = []
-            self.next_schedule_time = time()
-            return node_id
+        self._wake()
+        return node.id
+
+    async def add_nodes(self, new_nodes: List[NewNode]) -> List[Id]:
+        nodes = [self._create_node(new_node) for new_node in new_nodes]
+        for node in nodes:
+            self._capacity.add(node)
+            self.node_jobs[node.id] = {}
+        async with self._locked():
+            await self._storage.add_nodes(nodes)
+        self._wake()
+        return [node.id for node in nodes]
+
+    def _create_node(self, new_node: NewNode) -> NodeRecord:
+        node_id = str(self.next_node_id)
+        self.next_node_id += self._id_step
+        return NodeRecord(
+            id=node_id,
+            jobs_capacity=new_node.jobs_capacity,
+            jobs_allocated=0,
+            cpu_capacity=new_node.cpu_capacity,
+            cpu_allocated=0,
+            memory_capacity=new_node.memory_capacity,
+            memory_allocated=0
+        )
 
     async def delete_node(self, node_id: Id) -> ActionStatus:
-        async with self.lock:
-            interrupted_jobs = self.node_jobs[node_id]
-            if len(interrupted_jobs) > 0:
-                for job_id in interrupted_jobs:
-                    job = await self._storage.get_job(job_id)
-                    job.status = JobStatus.NEW
-                    job.started_at = None
-                    await self._storage.update_job(job)
-                    del self.jobs_nodes[job_id]
-                interrupted_jobs.extend(self.pending_jobs)
-                self.pending_jobs = interrupted_jobs
-                del self.node_jobs[node_id]
-                self.next_schedule_time = time()
-            return await self._storage.delete_node(node_id)
+        interrupted_jobs = list(self.node_jobs.pop(node_id, {}).values())
+        for job in interrupted_jobs:
+            job.status = JobStatus.NEW
+            job.started_at = None
+            job.node_id = None
+            del self.jobs_nodes[job.id]
+            self._untrack_completion(job.id)
+            self._pending[job.id] = job
+            if (task := task_array(job.id)) is not None and (array := self._arrays.get(task[0])) is not None:
+                array.tasks_running -= 1
+                self._changed[array.id] = array
+        self.pending_jobs.push_front(interrupted_jobs)
+        self._count_pending(interrupted_jobs)
+        self._capacity.remove(node_id)
+        if interrupted_jobs:
+            self._wake()
+        changed = self._with_changed(interrupted_jobs)
+        async with self._locked():
+            await self._store_jobs(changed)
+            result = await self._storage.delete_node(node_id)
+        self._publish(interrupted_jobs, node_id)
+        self._publish(changed[len(interrupted_jobs):])
+        return result
@@ -0,0 +1,426 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from typing import AsyncIterator, Dict, List, Tuple
+
+from entity import ActionStatus, Id, Job, JobEvent, JobRecord, JobStatus, NewJob, NewNode, Node
+from events import EVENT_BUFFER, EventBus, Subscription
+from metrics import render
+from scheduler import Scheduler
+from storage import StorageType, get_storage
+
+logger = logging.getLogger("scheduler")
+
+SPILL_INTERVAL = 0.5
+SPILL_BATCH = 1000
+EVENTS_REQUEST_ID = 0
+
+SHARD_METHODS = {'new_jobs', 'submit_jobs', 'flush', 'delete_job', 'terminate_job', 'get_job', 'get_node',
+                 'get_node_jobs', 'add_nodes', 'delete_node', 'query_jobs', 'query_nodes', 'get_jobs', 'get_nodes'}
+
+
+class DependencyError(ValueError):
+    pass
+
+
+def fits(job: JobRecord, free: Tuple[int, float, int]) -> bool:
+    return free[0] >= 1 and free[1] >= job.requests_cpu and free[2] >= job.requests_memory
+
+
+class ShardServer:
+    def __init__(self, connection, scheduler: Scheduler):
+        self._connection = connection
+        self._scheduler = scheduler
+        self._spilled_in = set()
+        self._watching = False
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        await self._scheduler.start()
+        threading.Thread(target=self._receive, args=(loop, messages), daemon=True).start()
+        runner = asyncio.create_task(self._scheduler.run())
+        while (message := await messages.get()) is not None:
+            asyncio.create_task(self._handle(*message))
+        runner.cancel()
+        await self._scheduler.flush()
+        self._scheduler.close()
+
+    def _receive(self, loop, messages: asyncio.Queue):
+        while True:
+            try:
+                message = self._connection.recv()
+            except EOFError:
+                message = None
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+            if message is None:
+                return
+
+    async def _handle(self, request_id: int, method: str, args: tuple):
+        try:
+            if method == 'status':
+                # Jobs that came in by spilling are reported once they finish, so the dispatcher can
+                # forget where they went.
+                result = self._scheduler.status()
+                result['finished_moved'] = self._scheduler.finished(self._spilled_in)
+                self._spilled_in.difference_update(result['finished_moved'])
+            elif method == 'collect_metrics':
+                result = self._scheduler.collect_metrics()
+            elif method == 'watch_events':
+                if not self._watching:
+                    self._watching = True
+                    self._scheduler.events.add_listener(self._forward_events)
+                result = None
+            elif method == 'spill_jobs':
+                result = await self._spill_jobs(*args)
+            elif method in SHARD_METHODS:
+                result = await getattr(self._scheduler, method)(*args)
+                if method == 'submit_jobs':
+                    self._spilled_in.update(job.id for job in args[0])
+            else:
+                raise ValueError(f"Unexpected shard method {method}")
+            self._connection.send((request_id, True, result))
+        except Exception as error:
+            self._connection.send((request_id, False, error))
+
+    def _forward_events(self, events: List[JobEvent]):
+        self._connection.send((EVENTS_REQUEST_ID, True, events))
+
+    async def _spill_jobs(self, targets: List[Tuple[int, float, int] | None],
+                          delete: bool) -> List[Tuple[JobRecord, int]]:
+        # Jobs move at most once and only towards a shard that reports room for them.
+        targets = [list(free) if free is not None else None for free in targets]
+        routes = {}
+
+        def accept(job: JobRecord) -> bool:
+            if job.id in self._spilled_in:
+                return False
+            for shard, free in enumerate(targets):
+                if free is not None and fits(job, free):
+                    free[1] -= job.requests_cpu
+                    free[2] -= job.requests_memory
+                    routes[job.id] = shard
+                    return True
+            return False
+
+        jobs = await self._scheduler.spill_jobs(accept, SPILL_BATCH, delete)
+        return [(job, routes[job.id]) for job in jobs]
+
+
+def serve_shard(connection, options: dict):
+    asyncio.run(ShardServer(connection, Scheduler(**options)).serve())
+
+
+class ShardClient:
+    def __init__(self, shard: int, options: dict):
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=serve_shard, args=(child_connection, options),
+                                        name=f'scheduler-shard-{shard}', daemon=True)
+        self._process.start()
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._next_request_id = 0
+        self._send_lock = threading.Lock()
+        self._loop = None
+        self.on_events = None
+
+    async def call(self, method: str, *args):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            threading.Thread(target=self._receive, daemon=True).start()
+        self._next_request_id += 1
+        future = self._loop.create_future()
+        self._futures[self._next_request_id] = future
+        with self._send_lock:
+            self._connection.send((self._next_request_id, method, args))
+        return await future
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, ok, result = self._connection.recv()
+            except (EOFError, OSError):
+                return
+            if request_id == EVENTS_REQUEST_ID:
+                self._loop.call_soon_threadsafe(self.on_events, result)
+            else:
+                self._loop.call_soon_threadsafe(self._resolve, request_id, ok, result)
+
+    def _resolve(self, request_id: int, ok: bool, result):
+        future = self._futures.pop(request_id)
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+    def close(self):
+        with self._send_lock:
+            self._connection.send(None)
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+
+
+class ShardedScheduler:
+    def __init__(self, workers: int, storage_type, storage_url: str | None = None, **options):
+        self._workers = workers
+        self._shared = storage_type != StorageType.MEMORY
+        self._storage = get_storage(storage_type, storage_url) if self._shared else None
+        self._options = dict(options, storage_type=storage_type, storage_url=storage_url)
+        self._shards: List[ShardClient] = []
+        self._moved_jobs: Dict[Id, int] = {}
+        self._next_shard = 0
+        self.events = EventBus()
+        self._watching = False
+
+    async def start(self):
+        if not self._shards:
+            if self._shared:
+                # Let one connection create the schema before the shards race to do it.
+                await self._storage.count_jobs_by_status(JobStatus.NEW)
+            self._shards = [ShardClient(shard, self._shard_options(shard)) for shard in range(self._workers)]
+
+    def _shard_options(self, shard: int) -> dict:
+        options = dict(self._options, id_start=shard + 1, id_step=self._workers)
+        # Submissions are spread evenly, so each shard admits its share of the limits.
+        for limit in ('max_pending', 'max_tenant_pending', 'submit_burst'):
+            if options.get(limit):
+                options[limit] = math.ceil(options[limit] / self._workers)
+        for rate in ('submit_rate', 'tenant_submit_rate'):
+            if options.get(rate):
+                options[rate] = options[rate] / self._workers
+        if options.get('archive_path'):
+            options['archive_path'] = f"{options['archive_path']}.{shard}"
+        if not self._shared and options.get('storage_url'):
+            options['storage_url'] = os.path.join(options['storage_url'], f'shard-{shard}')
+        return options
+
+    async def flush(self):
+        await asyncio.gather(*(shard.call('flush') for shard in self._shards))
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+        self._shards = []
+        if self._storage is not None:
+            self._storage.close()
+
+    async def run(self):
+        await self.start()
+        while True:
+            await asyncio.sleep(SPILL_INTERVAL)
+            await self.spill()
+
+    async def spill(self) -> int:
+        statuses = await self.status()
+        moved = 0
+        for source, status in enumerate(statuses):
+            if not status['unplaced']:
+                continue
+            targets = [other['max_free'] if index != source else None for index, other in enumerate(statuses)]
+            routes = await self._shards[source].call('spill_jobs', targets, not self._shared)
+            shard_jobs = {}
+            for job, target in routes:
+                shard_jobs.setdefault(target, []).append(job)
+                self._moved_jobs[job.id] = target
+            for target, jobs in shard_jobs.items():
+                await self._shards[target].call('submit_jobs', jobs, True)
+                logger.info(f"Spilled {len(jobs)} jobs from shard {source} to shard {target}")
+            moved += len(routes)
+        return moved
+
+    async def status(self) -> List[dict]:
+        statuses = await asyncio.gather(*(shard.call('status') for shard in self._shards))
+        for shard, status in enumerate(statuses):
+            for job_id in status.pop('finished_moved'):
+                if self._moved_jobs.get(job_id) == shard:
+                    del self._moved_jobs[job_id]
+        return statuses
+
+    async def subscribe(self, job_ids: List[Id] = (), node_ids: List[Id] = (), statuses: List[JobStatus] = (),
+                        size: int = EVENT_BUFFER) -> Subscription:
+        # Shards only start sending their events once somebody listens.
+        await self.start()
+        if not self._watching:
+            self._watching = True
+            for shard in self._shards:
+                shard.on_events = self.events.publish
+            await asyncio.gather(*(shard.call('watch_events') for shard in self._shards))
+        return self.events.subscribe(job_ids, node_ids, statuses, size)
+
+    async def render_metrics(self) -> str:
+        collected = await asyncio.gather(*(shard.call('collect_metrics') for shard in self._shards))
+        return render([(metrics, {'shard': str(shard)}) for shard, metrics in enumerate(collected)])
+
+    def _job_shard(self, job_id: Id) -> ShardClient | None:
+        shard = self._moved_jobs.get(job_id)
+        if shard is None:
+            shard = self._id_shard(job_id)
+        return self._shards[shard] if shard is not None else None
+
+    async def _call_job(self, method: str, job_id: Id, missing):
+        # Moved jobs are forgotten once they finish, a job the shard of its id does not know is then
+        # looked for on the others.
+        shard = self._job_shard(job_id)
+        if shard is None:
+            return missing
+        result = await shard.call(method, job_id)
+        if result is missing and job_id not in self._moved_jobs:
+            for other in self._shards:
+                if other is not shard and (result := await other.call(method, job_id)) is not missing:
+                    break
+        return result
+
+    def _node_shard(self, node_id: Id) -> ShardClient | None:
+        shard = self._id_shard(node_id)
+        return self._shards[shard] if shard is not None else None
+
+    def _id_shard(self, item_id: Id) -> int | None:
+        # Tasks of a job array are on the shard of the array.
+        try:
+            number = int(item_id.partition('.')[0])
+        except ValueError:
+            return None
+        return (number - 1) % self._workers if number > 0 else None
+
+    def _round_robin(self, count: int) -> List[int]:
+        shards = [(self._next_shard + i) % self._workers for i in range(count)]
+        self._next_shard = (self._next_shard + count) % self._workers
+        return shards
+
+    async def _scatter(self, method: str, items: list, shards: List[int] | None = None,
+                       undo: str | None = None) -> List[Id]:
+        shards = shards or self._round_robin(len(items))
+        shard_items = {}
+        for shard, item in zip(shards, items):
+            shard_items.setdefault(shard, []).append(item)
+        results = await asyncio.gather(*(self._shards[shard].call(method, items)
+                                         for shard, items in shard_items.items()), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            # The batch fails as a whole, what other shards took is taken back.
+            if undo:
+                await asyncio.gather(*(self._shards[shard].call(undo, item_id)
+                                       for shard, ids in zip(shard_items, results) if not isinstance(ids, Exception)
+                                       for item_id in ids))
+            raise max(errors, key=lambda error: getattr(error, 'retry_after', 0))
+        shard_ids = {shard: iter(ids) for shard, ids in zip(shard_items, results)}
+        return [next(shard_ids[shard]) for shard in shards]
+
+    async def new_job(self, new_job: NewJob) -> Id:
+        return (await self.new_jobs([new_job]))[0]
+
+    async def new_jobs(self, new_jobs: List[NewJob]) -> List[Id]:
+        await self.start()
+        # Dependencies are tracked by the shard that holds them, a job goes with them and they must
+        # all be on one shard.
+        shards = self._round_robin(len(new_jobs))
+        for index, new_job in enumerate(new_jobs):
+            dependency_shards = {self._moved_jobs.get(dependency_id, self._id_shard(dependency_id))
+                                 for dependency_id in new_job.depends_on} - {None}
+            if len(dependency_shards) > 1:
+                raise DependencyError(f"Dependencies {', '.join(new_job.depends_on)} are held by different shards")
+            if dependency_shards:
+                shards[index] = dependency_shards.pop()
+        return await self._scatter('new_jobs', new_jobs, shards, undo='delete_job')
+
+    async def add_node(self, new_node: NewNode) -> Id:
+        return (await self.add_nodes([new_node]))[0]
+
+    async def add_nodes(self, new_nodes: List[NewNode]) -> List[Id]:
+        await self.start()
+        return await self._scatter('add_nodes', new_nodes)
+
+    async def delete_job(self, job_id: Id) -> ActionStatus:
+        result = await self._call_job('delete_job', job_id, ActionStatus.NOT_FOUND)
+        self._moved_jobs.pop(job_id, None)
+        return result
+
+    async def terminate_job(self, job_id: Id) -> ActionStatus:
+        return await self._call_job('terminate_job', job_id, ActionStatus.NOT_FOUND)
+
+    async def delete_node(self, node_id: Id) -> ActionStatus:
+        shard = self._node_shard(node_id)
+        return await shard.call('delete_node', node_id) if shard else ActionStatus.NOT_FOUND
+
+    async def get_job(self, job_id: Id) -> Job | None:
+        if self._shared and (job := await self._storage.get_job(job_id)) is not None:
+            return job
+        # Jobs evicted by retention are only found in the archive of the shard that ran them.
+        return await self._call_job('get_job', job_id, None)
+
+    async def get_node(self, node_id: Id) -> Node | None:
+        if self._shared:
+            return await self._storage.get_node(node_id)
+        shard = self._node_shard(node_id)
+        return await shard.call('get_node', node_id) if shard else None
+
+    async def get_node_jobs(self, node_id: Id) -> List[Job] | None:
+        shard = self._node_shard(node_id)
+        return await shard.call('get_node_jobs', node_id) if shard else None
+
+    async def get_jobs(self) -> List[Job]:
+        if self._shared:
+            return await self._storage.get_jobs()
+        return [job for jobs in await asyncio.gather(*(shard.call('get_jobs') for shard in self._shards))
+                for job in jobs]
+
+    async def get_nodes(self) -> List[Node]:
+        if self._shared:
+            return await self._storage.get_nodes()
+        return [node for nodes in await asyncio.gather(*(shard.call('get_nodes') for shard in self._shards))
+                for node in nodes]
+
+    async def query_jobs(self, status: JobStatus | None = None, created_after: float | None = None,
+                         created_before: float | None = None, cursor: str | None = None,
+                         limit: int | None = None) -> Tuple[List[Job], str | None]:
+        if self._shared:
+            return await self._storage.query_jobs(status, created_after, created_before, cursor, limit)
+        return await self._query_shards('query_jobs', (status, created_after, created_before), cursor, limit)
+
+    async def query_nodes(self, cursor: str | None = None,
+                          limit: int | None = None) -> Tuple[List[Node], str | None]:
+        if self._shared:
+            return await self._storage.query_nodes(cursor, limit)
+        return await self._query_shards('query_nodes', (), cursor, limit)
+
+    async def _query_shards(self, method: str, filters: tuple, cursor: str | None,
+                            limit: int | None) -> Tuple[list, str | None]:
+        # Shards are listed one after another, the cursor is the shard and its own cursor.
+        shard, _, shard_cursor = (cursor or '0:').partition(':')
+        shard = int(shard)
+        items = []
+        while shard < self._workers:
+            page, next_cursor = await self._shards[shard].call(method, *filters, shard_cursor or None,
+                                                               limit - len(items) if limit else None)
+            items.extend(page)
+            if next_cursor is not None:
+                return items, f'{shard}:{next_cursor}'
+            shard += 1
+            shard_cursor = None
+            if limit and len(items) == limit:
+                return items, f'{shard}:' if shard < self._workers else None
+        return items, None
+
+    async def iter_job_pages(self, status: JobStatus | None = None, created_after: float | None = None,
+                             created_before: float | None = None,
+                             page_size: int = 1000) -> AsyncIterator[List[Job]]:
+        cursor = None
+        while True:
+            jobs, cursor = await self.query_jobs(status, created_after, created_before, cursor, page_size)
+            if jobs:
+                yield jobs
+            if cursor is None:
+                return
+
+    async def iter_node_pages(self, page_size: int = 1000) -> AsyncIterator[List[Node]]:
+        cursor = None
+        while True:
+            nodes, cursor = await self.query_nodes(cursor, page_size)
+            if nodes:
+                yield nodes
+            if cursor is None:
+                return
@@ -1,8 +1,17 @@
+import asyncio
+import os
+import threading
 from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
 from enum import StrEnum
-from typing import List
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
 
-from entity import Id, Job, Node, ActionStatus
+from entity import Id, Job, JobRecord, JobStatus, Node, NodeRecord, ActionStatus, job_record, node_record
+from persistence import (SNAPSHOT_LOG_BYTES, Operation, WriteAheadLog, job_values, log_generations, log_path,
+                         node_values, read_log, read_snapshot, values_job, values_node, write_snapshot)
+
+CACHE_FLUSH_INTERVAL = 0.1
+SEQ_CHUNK = 1000
 
 
 class StorageType(StrEnum):
@@ -24,6 +33,10 @@ class Storage(ABC):
     async def add_node(self, node: Node):
         pass
 
+    @abstractmethod
+    async def add_nodes(self, nodes: List[Node]):
+        pass
+
     @abstractmethod
     async def get_node(self, node_id: Id) -> Node | None:
         pass
@@ -32,6 +45,10 @@ class Storage(ABC):
     async def update_node(self, node: Node) -> ActionStatus:
         pass
 
+    @abstractmethod
+    async def update_nodes(self, nodes: List[Node]):
+        pass
+
     @abstractmethod
     async def delete_node(self, node_id: Id) -> ActionStatus:
         pass
@@ -44,6 +61,10 @@ class Storage(ABC):
     async def add_job(self, job: Job):
         pass
 
+    @abstractmethod
+    async def add_jobs(self, jobs: List[Job]):
+        pass
+
     @abstractmethod
     async def get_job(self, job_id: Id) -> Job | None:
         pass
@@ -52,6 +73,10 @@ class Storage(ABC):
     async def update_job(self, job: Job) -> ActionStatus:
         pass
 
+    @abstractmethod
+    async def update_jobs(self, jobs: List[Job]):
+        pass
+
     @abstractmethod
     async def delete_job(self, job_id: Id) -> ActionStatus:
         pass
@@ -60,70 +85,448 @@ class Storage(ABC):
     async def get_jobs(self) -> List[Job]:
         pass
 
+    async def delete_jobs(self, job_ids: List[Id]):
+        for job_id in job_ids:
+            await self.delete_job(job_id)
 
-class MemoryStorage(Storage):
+    async def flush(self):
+        pass
+
+    def collect_metrics(self) -> list:
+        return []
+
+    async def get_jobs_by_status(self, status: JobStatus) -> List[Job]:
+        return [job for job in await self.get_jobs() if job.status == status]
+
+    async def get_job_ids(self) -> List[Id]:
+        return [job.id for job in await self.get_jobs()]
+
+    async def count_jobs_by_status(self, status: JobStatus) -> int:
+        return len(await self.get_jobs_by_status(status))
+
+    async def get_node_jobs(self, node_id: Id) -> List[Job]:
+        return [job for job in await self.get_jobs_by_status(JobStatus.RUNNING) if job.node_id == node_id]
+
+    async def query_jobs(self, status: JobStatus | None = None, created_after: float | None = None,
+                         created_before: float | None = None, cursor: str | None = None,
+                         limit: int | None = None) -> Tuple[List[Job], str | None]:
+        jobs = [job for job in await self.get_jobs() if job_matches(job, status, created_after, created_before)]
+        return page_by_position(jobs, cursor, limit)
+
+    async def query_nodes(self, cursor: str | None = None,
+                          limit: int | None = None) -> Tuple[List[Node], str | None]:
+        return page_by_position(await self.get_nodes(), cursor, limit)
+
+    async def iter_job_pages(self, status: JobStatus | None = None, created_after: float | None = None,
+                             created_before: float | None = None,
+                             page_size: int = 1000) -> AsyncIterator[List[Job]]:
+        cursor = None
+        while True:
+            jobs, cursor = await self.query_jobs(status, created_after, created_before, cursor, page_size)
+            if jobs:
+                yield jobs
+            if cursor is None:
+                return
+
+    async def iter_node_pages(self, page_size: int = 1000) -> AsyncIterator[List[Node]]:
+        cursor = None
+        while True:
+            nodes, cursor = await self.query_nodes(cursor, page_size)
+            if nodes:
+                yield nodes
+            if cursor is None:
+                return
+
+
+def job_matches(job: Job, status: JobStatus | None, created_after: float | None,
+                created_before: float | None) -> bool:
+    return ((status is None or job.status == status)
+            and (created_after is None or job.created_at >= created_after)
+            and (created_before is None or job.created_at < created_before))
+
+
+def page_by_position(items: list, cursor: str | None, limit: int | None) -> Tuple[list, str | None]:
+    start = int(cursor) if cursor else 0
+    page = items[start:start + limit] if limit else items[start:]
+    next_cursor = str(start + len(page)) if limit and len(page) == limit else None
+    return page, next_cursor
+
+
+class InsertionOrder:
     def __init__(self):
-        self.jobs = {}
-        self.nodes = {}
+        self._seqs: Dict[Id, int] = {}
+        self._order_seqs: List[int] = []
+        self._order_ids: List[Id] = []
+        self._next_seq = 1
+
+    def add(self, item_id: Id):
+        if item_id not in self._seqs:
+            self._seqs[item_id] = self._next_seq
+            self._order_seqs.append(self._next_seq)
+            self._order_ids.append(item_id)
+            self._next_seq += 1
+
+    def seq(self, item_id: Id) -> int | None:
+        return self._seqs.get(item_id)
+
+    def remove(self, item_id: Id):
+        if self._seqs.pop(item_id, None) is not None and len(self._order_ids) > 2 * len(self._seqs) + 1024:
+            self._order_ids = list(self._seqs)
+            self._order_seqs = list(self._seqs.values())
+
+    def after(self, cursor: int) -> Iterator[Tuple[int, Id]]:
+        order_seqs, order_ids = self._order_seqs, self._order_ids
+        for position in range(bisect_right(order_seqs, cursor), len(order_ids)):
+            item_id = order_ids[position]
+            seq = order_seqs[position]
+            if self._seqs.get(item_id) == seq:
+                yield seq, item_id
+
+
+class SeqIndex:
+    # Ids ordered by the seq another order gave them. Seqs are kept in sorted chunks, so an id that
+    # comes in or leaves out of order only moves the chunk it falls in.
+    def __init__(self, chunk_size: int = SEQ_CHUNK):
+        self._seqs: Dict[Id, int] = {}
+        self._ids: Dict[int, Id] = {}
+        self._chunks: List[List[int]] = []
+        self._maxes: List[int] = []
+        self._chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self._seqs)
+
+    def __contains__(self, item_id: Id):
+        return item_id in self._seqs
+
+    def __iter__(self) -> Iterator[Id]:
+        return iter(self._seqs)
+
+    def add(self, item_id: Id, seq: int):
+        if item_id in self._seqs:
+            return
+        self._seqs[item_id] = seq
+        self._ids[seq] = item_id
+        chunks, maxes = self._chunks, self._maxes
+        if not maxes or seq > maxes[-1]:
+            if chunks and len(chunks[-1]) < self._chunk_size:
+                chunks[-1].append(seq)
+                maxes[-1] = seq
+            else:
+                chunks.append([seq])
+                maxes.append(seq)
+            return
+        position = bisect_left(maxes, seq)
+        chunk = chunks[position]
+        insort(chunk, seq)
+        if len(chunk) > 2 * self._chunk_size:
+            half = len(chunk) // 2
+            chunks[position:position + 1] = [chunk[:half], chunk[half:]]
+            maxes[position:position + 1] = [chunk[half - 1], chunk[-1]]
+
+    def remove(self, item_id: Id):
+        seq = self._seqs.pop(item_id, None)
+        if seq is None:
+            return
+        del self._ids[seq]
+        chunks, maxes = self._chunks, self._maxes
+        position = bisect_left(maxes, seq)
+        chunk = chunks[position]
+        del chunk[bisect_left(chunk, seq)]
+        if not chunk:
+            del chunks[position]
+            del maxes[position]
+        else:
+            maxes[position] = chunk[-1]
+
+    def after(self, cursor: int) -> Iterator[Tuple[int, Id]]:
+        position = bisect_right(self._maxes, cursor)
+        for index in range(position, len(self._chunks)):
+            chunk = self._chunks[index]
+            start = bisect_right(chunk, cursor) if index == position else 0
+            for seq in chunk[start:]:
+                yield seq, self._ids[seq]
+
+
+def page_in_order(order: InsertionOrder | SeqIndex, items: dict, cursor: str | None, limit: int | None,
+                  matches=lambda item: True) -> Tuple[list, str | None]:
+    page = []
+    seq = int(cursor) if cursor else 0
+    for seq, item_id in order.after(seq):
+        item = items[item_id]
+        if matches(item):
+            page.append(item)
+            if limit and len(page) == limit:
+                return page, str(seq)
+    return page, None
+
+
+class MemoryStorage(Storage):
+    # With a data directory every change is appended to a write-ahead log before the call returns,
+    # and the log is folded into a snapshot once it grows past snapshot_bytes.
+    def __init__(self, path: str | None = None, snapshot_bytes: int = SNAPSHOT_LOG_BYTES):
+        self.jobs: Dict[Id, JobRecord] = {}
+        self.nodes: Dict[Id, NodeRecord] = {}
+        self._job_order = InsertionOrder()
+        self._node_order = InsertionOrder()
+        # Jobs of each status in the order of all jobs, so a status is paged without a scan.
+        self._status_jobs: Dict[JobStatus, SeqIndex] = {status: SeqIndex() for status in JobStatus}
+        self._node_jobs: Dict[Id, Dict[Id, None]] = {}
+        self._job_nodes: Dict[Id, Id] = {}
+        self._path = path
+        self._snapshot_bytes = snapshot_bytes
+        self._snapshot_task: asyncio.Task | None = None
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_generation = 0
+        self._log: WriteAheadLog | None = None
+        if path:
+            self._recover()
+
+    def _recover(self):
+        os.makedirs(self._path, exist_ok=True)
+        snapshot = read_snapshot(self._path)
+        if snapshot is not None:
+            self._snapshot_generation, jobs, nodes = snapshot
+            self._put_nodes([values_node(values) for values in nodes])
+            self._put_jobs([values_job(values) for values in jobs])
+        generation = self._snapshot_generation
+        for log_generation in log_generations(self._path):
+            if log_generation < self._snapshot_generation:
+                os.remove(log_path(self._path, log_generation))
+                continue
+            for operation, items in read_log(log_path(self._path, log_generation)):
+                self._replay(operation, items)
+            generation = log_generation
+        self._log = WriteAheadLog(self._path, generation)
+
+    def _replay(self, operation: Operation, items: list):
+        match operation:
+            case Operation.ADD_JOBS:
+                self._put_jobs([values_job(values) for values in items])
+            case Operation.UPDATE_JOBS:
+                self._replace_jobs([values_job(values) for values in items])
+            case Operation.DELETE_JOBS:
+                self._remove_jobs(items)
+            case Operation.ADD_NODES:
+                self._put_nodes([values_node(values) for values in items])
+            case Operation.UPDATE_NODES:
+                self._replace_nodes([values_node(values) for values in items])
+            case Operation.DELETE_NODE:
+                self._remove_node(items[0])
+            case _:
+                raise Exception(f"Unexpected log operation {operation}")
+
+    async def _persist(self, operation: Operation, items: list, values=None):
+        if self._log is None or not items:
+            return
+        self._log.append(operation, [values(item) for item in items] if values else items)
+        if self._log.size > self._snapshot_bytes and (self._snapshot_task is None or self._snapshot_task.done()):
+            self._snapshot_task = asyncio.create_task(self.snapshot())
+        await self._log.commit()
+
+    def _capture(self) -> Tuple[list, list]:
+        return ([job_values(self.jobs[job_id]) for _, job_id in self._job_order.after(0)],
+                [node_values(self.nodes[node_id]) for _, node_id in self._node_order.after(0)])
+
+    async def snapshot(self):
+        generation, (jobs, nodes) = await self._log.rotate(self._capture)
+        await asyncio.to_thread(self._write_snapshot, generation, jobs, nodes)
+
+    def _write_snapshot(self, generation: int, jobs: list, nodes: list):
+        # A snapshot started in the background may finish after the one written on close.
+        with self._snapshot_lock:
+            if generation > self._snapshot_generation:
+                write_snapshot(self._path, generation, jobs, nodes)
+                self._snapshot_generation = generation
+
+    def _index_job(self, job: JobRecord):
+        status_jobs = self._status_jobs[job.status]
+        if job.id not in status_jobs:
+            for job_ids in self._status_jobs.values():
+                job_ids.remove(job.id)
+            status_jobs.add(job.id, self._job_order.seq(job.id))
+        node_id = job.node_id if job.status == JobStatus.RUNNING else None
+        if self._job_nodes.get(job.id) != node_id:
+            self._unindex_job_node(job.id)
+            if node_id is not None:
+                self._node_jobs.setdefault(node_id, {})[job.id] = None
+                self._job_nodes[job.id] = node_id
+
+    def _unindex_job(self, job_id: Id):
+        for job_ids in self._status_jobs.values():
+            job_ids.remove(job_id)
+        self._unindex_job_node(job_id)
+
+    def _unindex_job_node(self, job_id: Id):
+        node_id = self._job_nodes.pop(job_id, None)
+        if node_id is not None:
+            node_jobs = self._node_jobs[node_id]
+            del node_jobs[job_id]
+            if not node_jobs:
+                del self._node_jobs[node_id]
+
+    def _put_nodes(self, nodes: List[NodeRecord]):
+        for node in nodes:
+            self.nodes[node.id] = node
+            self._node_order.add(node.id)
+
+    def _replace_nodes(self, nodes: List[NodeRecord]) -> List[NodeRecord]:
+        replaced = [node for node in nodes if node.id in self.nodes]
+        for node in replaced:
+            self.nodes[node.id] = node
+        return replaced
+
+    def _remove_node(self, node_id: Id) -> bool:
+        if node_id not in self.nodes:
+            return False
+        del self.nodes[node_id]
+        self._node_order.remove(node_id)
+        return True
+
+    def _put_jobs(self, jobs: List[JobRecord]):
+        for job in jobs:
+            if job.id in self.jobs:
+                self.jobs[job.id] = job
+                self._index_job(job)
+                continue
+            # New ids skip the search through every status index, this is most of loading a snapshot.
+            self.jobs[job.id] = job
+            self._job_order.add(job.id)
+            self._status_jobs[job.status].add(job.id, self._job_order.seq(job.id))
+            if job.status == JobStatus.RUNNING and job.node_id is not None:
+                self._node_jobs.setdefault(job.node_id, {})[job.id] = None
+                self._job_nodes[job.id] = job.node_id
+
+    def _replace_jobs(self, jobs: List[JobRecord]) -> List[JobRecord]:
+        replaced = [job for job in jobs if job.id in self.jobs]
+        for job in replaced:
+            self.jobs[job.id] = job
+            self._index_job(job)
+        return replaced
+
+    def _remove_jobs(self, job_ids: List[Id]) -> List[Id]:
+        removed = [job_id for job_id in job_ids if job_id in self.jobs]
+        for job_id in removed:
+            del self.jobs[job_id]
+            self._job_order.remove(job_id)
+            self._unindex_job(job_id)
+        return removed
 
     def close(self):
+        if self._log is not None:
+            self._log.close()
+            jobs, nodes = self._capture()
+            self._write_snapshot(self._log.generation + 1, jobs, nodes)
         del self.nodes
         del self.jobs
 
     async def add_node(self, node: Node):
-        self.nodes.update({node.id: node})
+        node = node_record(node)
+        self._put_nodes([node])
+        await self._persist(Operation.ADD_NODES, [node], node_values)
+
+    async def add_nodes(self, nodes: List[Node]):
+        nodes = [node_record(node) for node in nodes]
+        self._put_nodes(nodes)
+        await self._persist(Operation.ADD_NODES, nodes, node_values)
 
     async def get_node(self, node_id: Id) -> Node | None:
-        return self.nodes.get(node_id, None)
+        node = self.nodes.get(node_id, None)
+        return node.to_model() if node else None
 
     async def update_node(self, node: Node) -> ActionStatus:
-        if node.id in self.nodes:
-            self.nodes[node.id] = node
-            return ActionStatus.OK
-        else:
-            return ActionStatus.NOT_FOUND
+        replaced = self._replace_nodes([node_record(node)])
+        await self._persist(Operation.UPDATE_NODES, replaced, node_values)
+        return ActionStatus.OK if replaced else ActionStatus.NOT_FOUND
+
+    async def update_nodes(self, nodes: List[Node]):
+        replaced = self._replace_nodes([node_record(node) for node in nodes])
+        await self._persist(Operation.UPDATE_NODES, replaced, node_values)
 
     async def delete_node(self, node_id: Id) -> ActionStatus:
-        if node_id in self.nodes:
-            del self.nodes[node_id]
-            return ActionStatus.OK
-        else:
+        if not self._remove_node(node_id):
             return ActionStatus.NOT_FOUND
+        await self._persist(Operation.DELETE_NODE, [node_id])
+        return ActionStatus.OK
 
     async def get_nodes(self) -> List[Node]:
-        return list(self.nodes.values())
+        return [node.to_model() for node in self.nodes.values()]
 
     async def add_job(self, job: Job):
-        self.jobs.update({job.id: job})
+        job = job_record(job)
+        self._put_jobs([job])
+        await self._persist(Operation.ADD_JOBS, [job], job_values)
+
+    async def add_jobs(self, jobs: List[Job]):
+        jobs = [job_record(job) for job in jobs]
+        self._put_jobs(jobs)
+        await self._persist(Operation.ADD_JOBS, jobs, job_values)
 
     async def get_job(self, job_id: Id) -> Job | None:
-        return self.jobs.get(job_id, None)
+        job = self.jobs.get(job_id, None)
+        return job.to_model() if job else None
 
     async def update_job(self, job: Job) -> ActionStatus:
-        if job.id in self.jobs:
-            self.jobs[job.id] = job
-            return ActionStatus.OK
-        else:
-            return ActionStatus.NOT_FOUND
+        replaced = self._replace_jobs([job_record(job)])
+        await self._persist(Operation.UPDATE_JOBS, replaced, job_values)
+        return ActionStatus.OK if replaced else ActionStatus.NOT_FOUND
+
+    async def update_jobs(self, jobs: List[Job]):
+        replaced = self._replace_jobs([job_record(job) for job in jobs])
+        await self._persist(Operation.UPDATE_JOBS, replaced, job_values)
 
     async def delete_job(self, job_id: Id):
-        if job_id in self.jobs:
-            del self.jobs[job_id]
-            return ActionStatus.OK
-        else:
+        if not self._remove_jobs([job_id]):
             return ActionStatus.NOT_FOUND
+        await self._persist(Operation.DELETE_JOBS, [job_id])
+        return ActionStatus.OK
+
+    async def delete_jobs(self, job_ids: List[Id]):
+        await self._persist(Operation.DELETE_JOBS, self._remove_jobs(job_ids))
 
     async def get_jobs(self) -> List[Job]:
-        return list(self.jobs.values())
+        return [job.to_model() for job in self.jobs.values()]
+
+    async def get_job_ids(self) -> List[Id]:
+        return list(self.jobs)
+
+    async def get_jobs_by_status(self, status: JobStatus) -> List[Job]:
+        return [self.jobs[job_id].to_model() for job_id in self._status_jobs[status]]
+
+    async def count_jobs_by_status(self, status: JobStatus) -> int:
+        return len(self._status_jobs[status])
+
+    async def get_node_jobs(self, node_id: Id) -> List[Job]:
+        return [self.jobs[job_id].to_model() for job_id in self._node_jobs.get(node_id, ())]
+
+    async def query_jobs(self, status: JobStatus | None = None, created_after: float | None = None,
+                         created_before: float | None = None, cursor: str | None = None,
+                         limit: int | None = None) -> Tuple[List[Job], str | None]:
+        order = self._job_order if status is None else self._status_jobs[status]
+        jobs, next_cursor = page_in_order(order, self.jobs, cursor, limit,
+                                          lambda job: job_matches(job, status, created_after, created_before))
+        return [job.to_model() for job in jobs], next_cursor
+
+    async def query_nodes(self, cursor: str | None = None,
+                          limit: int | None = None) -> Tuple[List[Node], str | None]:
+        nodes, next_cursor = page_in_order(self._node_order, self.nodes, cursor, limit)
+        return [node.to_model() for node in nodes], next_cursor
 
 
-def get_storage(storage_type: StorageType) -> Storage:
+def get_storage(storage_type: StorageType, url: str | None = None, cache_size: int = 0,
+                cache_flush_interval: float = CACHE_FLUSH_INTERVAL) -> Storage:
     match storage_type:
         case StorageType.MEMORY:
-            return MemoryStorage()
+            storage = MemoryStorage(url)
         case StorageType.POSTGRESQL:
-            raise NotImplementedError(f"Storage {storage_type} not implemented")
+            from postgres_storage import PostgresStorage
+            storage = PostgresStorage(url or 'postgresql://localhost/scheduler')
         case StorageType.REDIS:
-            raise NotImplementedError(f"Storage {storage_type} not implemented")
+            from redis_storage import RedisStorage
+            storage = RedisStorage(url or 'redis://localhost:6379/0')
         case _:
             raise Exception(f"Unexpected storage type {storage_type}")
+    if cache_size:
+        from cached_storage import CachedStorage
+        storage = CachedStorage(storage, cache_size, cache_flush_interval)
+    return storage
@@ -1,14 +1,22 @@
 import logging
+import math
 import sys
-from typing import Literal, List
+from typing import Annotated, AsyncIterator, Literal, List
 from pydantic import BaseModel
 import click
 import asyncio
-from fastapi import FastAPI, Response, status
+from fastapi import FastAPI, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 
-from entity import ActionStatus, NewJob, NewNode, Job, Node, Id
-from scheduler import Scheduler
+from admission import Overloaded
+from entity import ActionStatus, NewJob, NewNode, Job, JobStatus, Node, Id
+from events import Subscription
+from capacity import PlacementEngine, PlacementStrategy
+from metrics import CONTENT_TYPE
+from queues import QueueType
+from scheduler import DependencyPolicy, Scheduler
+from sharding import DependencyError, ShardedScheduler
 from storage import StorageType
 
 
@@ -21,16 +29,83 @@ class CreateResponseModel(BaseModel):
     id: Id
 
 
+class CreateBatchResponseModel(BaseModel):
+    status: Literal['ok', 'error']
+    ids: List[Id]
+
+
+MAX_PAGE_SIZE = 10000
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+EVENT_STREAM_MEDIA_TYPE = 'text/event-stream'
+KEEPALIVE_INTERVAL = 15
+
+PageSize = Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)]
+OutputFormat = Annotated[Literal['json', 'ndjson'], Query(alias='format')]
+
+
+async def ndjson_lines(pages: AsyncIterator[List[BaseModel]]):
+    async for page in pages:
+        yield ''.join(item.model_dump_json() + '\n' for item in page)
+
+
+async def event_lines(subscription: Subscription, keepalive: float = KEEPALIVE_INTERVAL):
+    # Server-sent events, a comment line now and then lets proxies and clients see the stream is alive.
+    try:
+        while True:
+            try:
+                async with asyncio.timeout(keepalive):
+                    events = await subscription.get()
+            except TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if not events:
+                break
+            yield ''.join(f'event: job\ndata: {event.model_dump_json()}\n\n' for event in events)
+        if subscription.overflowed:
+            yield 'event: overflow\ndata: {}\n\n'
+    finally:
+        subscription.close()
+
+
 def register_urls(app: FastAPI, scheduler: Scheduler):
-    @app.get('/jobs')
-    async def get_jobs() -> List[Job]:
-        return await scheduler.get_jobs()
+    @app.exception_handler(Overloaded)
+    async def overloaded(request: Request, error: Overloaded):
+        return JSONResponse(ResponseModel(status='error').model_dump(), status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            headers={'Retry-After': str(math.ceil(error.retry_after))})
+
+    @app.exception_handler(DependencyError)
+    async def dependency_error(request: Request, error: DependencyError):
+        return JSONResponse({'status': 'error', 'detail': str(error)}, status_code=status.HTTP_400_BAD_REQUEST)
+
+    @app.get('/jobs', response_model=List[Job])
+    async def get_jobs(response: Response,
+                       job_status: Annotated[JobStatus | None, Query(alias='status')] = None,
+                       created_after: float | None = None,
+                       created_before: float | None = None,
+                       cursor: str | None = None,
+                       limit: PageSize = None,
+                       output_format: OutputFormat = 'json'):
+        if output_format == 'ndjson':
+            pages = scheduler.iter_job_pages(job_status, created_after, created_before)
+            return StreamingResponse(ndjson_lines(pages), media_type=NDJSON_MEDIA_TYPE)
+        jobs, next_cursor = await scheduler.query_jobs(job_status, created_after, created_before, cursor, limit)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return jobs
 
-    @app.post('/jobs', status_code=status.HTTP_201_CREATED)
+    @app.post('/jobs', status_code=status.HTTP_201_CREATED,
+              responses={status.HTTP_400_BAD_REQUEST: {}, status.HTTP_429_TOO_MANY_REQUESTS: {"model": ResponseModel}})
     async def new_job(job: NewJob) -> CreateResponseModel:
         id = await scheduler.new_job(job)
         return CreateResponseModel(status='ok', id=id)
 
+    @app.post('/jobs:batch', status_code=status.HTTP_201_CREATED,
+              responses={status.HTTP_400_BAD_REQUEST: {}, status.HTTP_429_TOO_MANY_REQUESTS: {"model": ResponseModel}})
+    async def new_jobs(jobs: List[NewJob]) -> CreateBatchResponseModel:
+        ids = await scheduler.new_jobs(jobs)
+        return CreateBatchResponseModel(status='ok', ids=ids)
+
     @app.delete('/jobs/{job_id}', responses={status.HTTP_404_NOT_FOUND: {}})
     async def delete_job(job_id: Id, response: Response) -> ResponseModel:
         result = await scheduler.delete_job(job_id)
@@ -68,9 +143,15 @@ def register_urls(app: FastAPI, scheduler: Scheduler):
             response.status_code = status.HTTP_404_NOT_FOUND
             return ResponseModel(status='error')
 
-    @app.get('/nodes')
-    async def get_nodes() -> List[Node]:
-        return await scheduler.get_nodes()
+    @app.get('/nodes', response_model=List[Node])
+    async def get_nodes(response: Response, cursor: str | None = None, limit: PageSize = None,
+                        output_format: OutputFormat = 'json'):
+        if output_format == 'ndjson':
+            return StreamingResponse(ndjson_lines(scheduler.iter_node_pages()), media_type=NDJSON_MEDIA_TYPE)
+        nodes, next_cursor = await scheduler.query_nodes(cursor, limit)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return nodes
 
     @app.get('/nodes/{node_id}', responses={
         status.HTTP_200_OK: {"model": Node},
@@ -101,6 +182,11 @@ def register_urls(app: FastAPI, scheduler: Scheduler):
         id = await scheduler.add_node(new_node)
         return CreateResponseModel(status='ok', id=id)
 
+    @app.post('/nodes:batch', status_code=status.HTTP_201_CREATED)
+    async def add_nodes(new_nodes: List[NewNode]) -> CreateBatchResponseModel:
+        ids = await scheduler.add_nodes(new_nodes)
+        return CreateBatchResponseModel(status='ok', ids=ids)
+
     @app.delete('/nodes/{node_id}')
     async def delete_node(node_id: Id, response: Response) -> ResponseModel:
         result = await scheduler.delete_node(node_id)
@@ -111,6 +197,18 @@ def register_urls(app: FastAPI, scheduler: Scheduler):
                 response.status_code = status.HTTP_404_NOT_FOUND
                 return ResponseModel(status='error')
 
+    @app.get('/events')
+    async def get_events(job_id: Annotated[List[Id] | None, Query()] = None,
+                         node_id: Annotated[List[Id] | None, Query()] = None,
+                         job_status: Annotated[List[JobStatus] | None, Query(alias='status')] = None):
+        subscription = await scheduler.subscribe(job_id or (), node_id or (), job_status or ())
+        return StreamingResponse(event_lines(subscription), media_type=EVENT_STREAM_MEDIA_TYPE,
+                                 headers={'Cache-Control': 'no-cache'})
+
+    @app.get('/metrics', response_class=PlainTextResponse)
+    async def get_metrics():
+        return PlainTextResponse(await scheduler.render_metrics(), media_type=CONTENT_TYPE)
+
 
 def setup_logger():
     logger = logging.getLogger("scheduler")
@@ -124,12 +222,52 @@ def setup_logger():
 @click.option('--host', default='127.0.0.1', help='host to start webserver on')
 @click.option('--port', default=8080, help='webserver port to start on')
 @click.option('--storage', default='memory', type=click.Choice(StorageType))
-def run(host, port, storage):
+@click.option('--storage-url', default=None,
+              help='connection url for external storage, or the directory memory storage persists to')
+@click.option('--engine', default='index', type=click.Choice(PlacementEngine), help='node placement engine')
+@click.option('--strategy', default='first-fit', type=click.Choice(PlacementStrategy),
+              help='how a node is chosen among those a job fits on')
+@click.option('--backfill', is_flag=True, help='let small jobs run ahead of a blocked job if they end in time')
+@click.option('--check-interval', default=0.0,
+              help='seconds between node allocation consistency checks, 0 to disable')
+@click.option('--queue', default='fifo', type=click.Choice(QueueType), help='pending job queue discipline')
+@click.option('--workers', default=1, help='scheduler processes, nodes are partitioned between them')
+@click.option('--metrics/--no-metrics', default=True, help='time the scheduling loop and storage calls for /metrics')
+@click.option('--retention-age', default=0.0, help='seconds finished jobs are kept in storage, 0 to keep them')
+@click.option('--retention-count', default=0, help='finished jobs kept in storage, 0 for no limit')
+@click.option('--archive', default=None, help='file finished jobs are compressed into when they leave storage')
+@click.option('--cache-size', default=0, help='jobs and nodes kept in a write-behind cache over storage, 0 to disable')
+@click.option('--cache-flush-interval', default=0.1, help='seconds cached writes are held before going to storage')
+@click.option('--tenant-weight', multiple=True, help='fair-share weight as tenant=weight, may be repeated')
+@click.option('--dependency-policy', default='fail', type=click.Choice(DependencyPolicy),
+              help='what happens to jobs waiting on a job that was terminated, deleted or failed')
+@click.option('--max-pending', default=0, help='pending and waiting jobs that make submissions get 429, 0 for no limit')
+@click.option('--max-tenant-pending', default=0, help='the same limit for each tenant, 0 for no limit')
+@click.option('--submit-rate', default=0.0, help='jobs per second accepted over all tenants, 0 for no limit')
+@click.option('--tenant-submit-rate', default=0.0, help='jobs per second accepted from each tenant, 0 for no limit')
+@click.option('--submit-burst', default=0, help='jobs accepted at once above the submit rates, 0 for one second worth')
+def run(host, port, storage, storage_url, engine, strategy, backfill, check_interval, queue, workers, metrics,
+        retention_age, retention_count, archive, cache_size, cache_flush_interval, tenant_weight, dependency_policy,
+        max_pending, max_tenant_pending, submit_rate, tenant_submit_rate, submit_burst):
     setup_logger()
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    scheduler = Scheduler(storage_type=storage)
+    tenant_weights = {}
+    for item in tenant_weight:
+        tenant, _, weight = item.rpartition('=')
+        tenant_weights[tenant] = float(weight)
+    options = dict(engine=engine, queue=queue, tenant_weights=tenant_weights, strategy=strategy,
+                   backfill=backfill, check_interval=check_interval, metrics=metrics, retention_age=retention_age,
+                   retention_count=retention_count, archive_path=archive, cache_size=cache_size,
+                   cache_flush_interval=cache_flush_interval, dependency_policy=dependency_policy,
+                   max_pending=max_pending, max_tenant_pending=max_tenant_pending, submit_rate=submit_rate,
+                   tenant_submit_rate=tenant_submit_rate, submit_burst=submit_burst)
+    if workers > 1:
+        scheduler = ShardedScheduler(workers, storage_type=storage, storage_url=storage_url, **options)
+    else:
+        scheduler = Scheduler(storage_type=storage, storage_url=storage_url, **options)
+    loop.run_until_complete(scheduler.start())
     loop.create_task(scheduler.run())
 
     app = FastAPI(root_path='/api/v1')
@@ -138,6 +276,8 @@ def run(host, port, storage):
     config = uvicorn.Config(app, host=host, port=port, loop='asyncio')
     server = uvicorn.Server(config)
     loop.run_until_complete(server.serve())
+    loop.run_until_complete(scheduler.flush())
+    scheduler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+import pytest
+from fastapi import FastAPI, status
+from fastapi.testclient import TestClient
+
+from admission import Admission, Overloaded, TokenBucket
+from entity import JobRecord, JobStatus, NewJob, NewNode
+from scheduler import Scheduler
+from storage import StorageType
+from webserver import register_urls
+
+NEW_JOB = {'expected_run_time': 10, 'requests_cpu': 1.0, 'requests_memory': 10}
+
+
+def started_job(tenant: str) -> JobRecord:
+    return JobRecord('1', JobStatus.RUNNING, 10, 1.0, 10, 0.0, 0.0, tenant=tenant)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=20, now=0.0)
+    assert bucket.wait(20, 0.0) == 0.0
+    bucket.take(20)
+    assert bucket.wait(5, 0.0) == 0.5
+    assert bucket.wait(5, 0.5) == 0.0
+    bucket.take(5)
+    assert bucket.wait(100, 0.5) == 2.0
+    assert bucket.wait(100, 2.5) == 0.0
+    bucket.take(100)
+    assert bucket.wait(1, 2.5) == 8.1
+
+
+def test_tenant_limits():
+    admission = Admission(max_tenant_pending=2, tenant_rate=1, burst=3)
+    admission.admit([NewJob(**NEW_JOB, tenant='a')] * 2, 0.0)
+    admission.admit([NewJob(**NEW_JOB, tenant='b')], 0.0)
+    with pytest.raises(Overloaded) as error:
+        admission.admit([NewJob(**NEW_JOB, tenant='a')], 0.0)
+    assert error.value.reason == 'tenant pending'
+
+    # Started jobs stop counting and set the drain rate the retry time comes from.
+    admission.admit([NewJob(**NEW_JOB, tenant=str(tenant)) for tenant in range(27)], 0.0)
+    admission.update([started_job(tenant) for tenant in ['a', 'a', 'b'] + [str(tenant) for tenant in range(27)]], 0.0)
+    assert admission._tenant_pending == {}
+    with pytest.raises(Overloaded) as error:
+        admission.admit([NewJob(**NEW_JOB, tenant='a')] * 2, 0.0)
+    assert (error.value.reason, error.value.retry_after) == ('tenant rate', 1.0)
+    admission.admit([NewJob(**NEW_JOB, tenant='a')] * 2, 10.0)
+    with pytest.raises(Overloaded) as error:
+        admission.admit([NewJob(**NEW_JOB, tenant='a')] * 9, 10.0)
+    assert (error.value.reason, error.value.retry_after) == ('tenant pending', 3.0)
+    assert admission.rejected.series == {'tenant_pending': 10, 'tenant_rate': 2}
+
+
+def test_idle_tenant_buckets_are_dropped():
+    admission = Admission(tenant_rate=1, burst=3)
+    admission.admit([NewJob(**NEW_JOB, tenant='a')], 0.0)
+    admission.admit([NewJob(**NEW_JOB, tenant='b')], 0.0)
+    admission.update([started_job('a')], 0.0)
+    assert set(admission._tenant_buckets) == {'a', 'b'}
+
+    # Only a's bucket has refilled with nothing of a's pending, b still has a job waiting to start.
+    admission.update([], 60.0)
+    assert set(admission._tenant_buckets) == {'b'}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_refuses_over_max_pending():
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, clock=lambda: now[0], max_pending=3)
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    await scheduler.new_jobs([NewJob(**NEW_JOB)] * 3)
+    with pytest.raises(Overloaded) as error:
+        await scheduler.new_job(NewJob(**NEW_JOB))
+    assert error.value.retry_after == 60
+    assert scheduler.next_job_id == 4
+
+    await scheduler._tick()
+    now[0] = 30.0
+    await scheduler.new_job(NewJob(**NEW_JOB))
+    with pytest.raises(Overloaded) as error:
+        await scheduler.new_jobs([NewJob(**NEW_JOB)] * 2)
+    # One job started in 30 seconds, two too many take a minute to drain.
+    assert error.value.retry_after == 60
+    assert 'scheduler_rejected_jobs_total{reason="pending"} 3' in await scheduler.render_metrics()
+
+
+def test_submission_gets_429_with_retry_after():
+    scheduler = Scheduler(StorageType.MEMORY, submit_rate=2)
+    app = FastAPI()
+    register_urls(app, scheduler)
+    client = TestClient(app)
+    assert client.post('/jobs:batch', json=[NEW_JOB] * 2).status_code == status.HTTP_201_CREATED
+    response = client.post('/jobs', json=NEW_JOB)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.json() == {'status': 'error'}
+    assert 1 <= int(response.headers['Retry-After']) <= 2
+
+
+@pytest.mark.asyncio
+async def test_arrays_count_by_tasks():
+    scheduler = Scheduler(StorageType.MEMORY, max_pending=5, submit_rate=5)
+    await scheduler.new_job(NewJob(**NEW_JOB, tasks=1000))
+    with pytest.raises(Overloaded) as error:
+        await scheduler.new_job(NewJob(**NEW_JOB, tasks=1000))
+    assert error.value.retry_after == 60
+    with pytest.raises(Overloaded):
+        await scheduler.new_job(NewJob(**NEW_JOB))
+
+    # Started tasks stop counting, the rest of the array still does.
+    await scheduler.add_node(NewNode(jobs_capacity=998, cpu_capacity=998.0, memory_capacity=1 << 20))
+    await scheduler._tick()
+    assert scheduler._admission._pending == 2
+
+
+@pytest.mark.asyncio
+async def test_deleted_jobs_stop_counting():
+    scheduler = Scheduler(StorageType.MEMORY, max_pending=3)
+    job_ids = await scheduler.new_jobs([NewJob(**NEW_JOB)] * 2)
+    await scheduler.new_job(NewJob(**NEW_JOB, depends_on=[job_ids[0]]))
+    with pytest.raises(Overloaded):
+        await scheduler.new_job(NewJob(**NEW_JOB))
+
+    # Deleting a job fails its waiting dependent with it, both leave room.
+    await scheduler.delete_job(job_ids[0])
+    assert scheduler._admission._pending == 1
+    await scheduler.new_jobs([NewJob(**NEW_JOB)] * 2)
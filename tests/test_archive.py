@@ -0,0 +1,54 @@
+from entity import JobRecord, JobStatus
+from archive import JobArchive
+
+
+def make_job(job_id: int) -> JobRecord:
+    return JobRecord(str(job_id), JobStatus.COMPLETED, 60, 1.0, 256, 100.0 + job_id, 110.0 + job_id,
+                     node_id='1', priority=job_id % 3, tenant='team-a' if job_id % 2 else None)
+
+
+def test_archive_lookup(tmp_path):
+    path = str(tmp_path / 'jobs.archive')
+    archive = JobArchive(path, block_size=10)
+    archive.append([make_job(job_id) for job_id in range(1, 26)])
+    assert archive.get_job('25') == make_job(25).to_model()
+    archive.close()
+
+    archive = JobArchive(path, block_size=10)
+    for job_id in (1, 10, 11, 25):
+        assert archive.get_job(str(job_id)) == make_job(job_id).to_model()
+    assert archive.get_job('26') is None
+    assert archive.get_job('unknown') is None
+    archive.append([make_job(26)])
+    archive.close()
+    assert JobArchive(path).get_job('26') == make_job(26).to_model()
+
+
+def test_archive_drops_torn_block(tmp_path):
+    path = str(tmp_path / 'jobs.archive')
+    archive = JobArchive(path, block_size=5)
+    archive.append([make_job(job_id) for job_id in range(1, 11)])
+    archive.close()
+    with open(path, 'r+b') as file:
+        file.truncate(file.seek(0, 2) - 3)
+
+    archive = JobArchive(path, block_size=5)
+    assert archive.get_job('5') == make_job(5).to_model()
+    assert archive.get_job('6') is None
+    archive.append([make_job(job_id) for job_id in range(6, 11)])
+    archive.close()
+    assert JobArchive(path).get_job('10') == make_job(10).to_model()
+
+
+def test_archive_reads_only_the_block_holding_the_id(tmp_path):
+    path = str(tmp_path / 'jobs.archive')
+    archive = JobArchive(path, block_size=2)
+    archive.append([make_job(job_id) for job_id in (1, 10, 2, 9)])
+    archive.close()
+
+    archive = JobArchive(path, block_size=2)
+    assert archive.get_job('5') is None
+    assert archive._cached_block is None
+    assert archive.get_job('10') == make_job(10).to_model()
+    assert archive._cached_block[0] == 0
+    archive.close()
@@ -0,0 +1,195 @@
+import random
+
+import pytest
+
+from capacity import PlacementEngine, PlacementStrategy, get_capacity_index, get_node_score
+from entity import Job, JobStatus, Node
+from scheduler import fit_available
+
+
+def make_node(node_id, rng):
+    return Node(
+        id=node_id,
+        jobs_capacity=rng.randint(1, 4),
+        jobs_allocated=0,
+        cpu_capacity=rng.choice([1.0, 2.0, 4.0]),
+        cpu_allocated=0,
+        memory_capacity=rng.choice([512, 1024, 2048]),
+        memory_allocated=0
+    )
+
+
+def make_job(job_id, rng):
+    return Job(
+        id=job_id,
+        status=JobStatus.NEW,
+        expected_run_time=1,
+        requests_cpu=rng.choice([0.5, 1.0, 2.0]),
+        requests_memory=rng.choice([256, 512, 1024]),
+        created_at=0,
+        started_at=None
+    )
+
+
+@pytest.fixture(params=list(PlacementEngine))
+def engine(request):
+    if request.param == PlacementEngine.NUMPY:
+        pytest.importorskip('numpy')
+    return request.param
+
+
+def test_empty_index(engine):
+    index = get_capacity_index(engine)
+    assert index.fit(make_job('1', random.Random(0))) is None
+    assert index.place([make_job('1', random.Random(0))]) == []
+
+
+def test_matches_fit_available(engine):
+    rng = random.Random(42)
+    index = get_capacity_index(engine)
+    nodes = {}
+    running = []
+    for step in range(3000):
+        action = rng.random()
+        if action < 0.05 or not nodes:
+            node = make_node(str(step), rng)
+            nodes[node.id] = node
+            index.add(node)
+        elif action < 0.08:
+            node_id = rng.choice(list(nodes))
+            del nodes[node_id]
+            index.remove(node_id)
+            running = [(job, n) for job, n in running if n != node_id]
+        elif action < 0.3 and running:
+            job, node_id = running.pop(rng.randrange(len(running)))
+            node = nodes[node_id]
+            node.jobs_allocated -= 1
+            node.cpu_allocated -= job.requests_cpu
+            node.memory_allocated -= job.requests_memory
+            index.update(node)
+        else:
+            job = make_job(str(step), rng)
+            available = fit_available(job, list(nodes.values()))
+            node_id = index.fit(job)
+            assert node_id == (available[0].id if available else None)
+            assert index.fit_all(job) == [node.id for node in available]
+            if node_id is not None:
+                node = nodes[node_id]
+                node.jobs_allocated += 1
+                node.cpu_allocated += job.requests_cpu
+                node.memory_allocated += job.requests_memory
+                index.update(node)
+                running.append((job, node_id))
+
+
+def test_batch_place_matches_first_fit(engine):
+    rng = random.Random(7)
+    nodes = [make_node(str(i), rng) for i in range(50)]
+    index = get_capacity_index(engine)
+    for node in nodes:
+        index.add(node.model_copy())
+    jobs = [make_job(str(i), rng) for i in range(300)]
+
+    expected = []
+    for job in jobs:
+        available = fit_available(job, nodes)
+        if available:
+            node = available[0]
+            node.jobs_allocated += 1
+            node.cpu_allocated += job.requests_cpu
+            node.memory_allocated += job.requests_memory
+            expected.append((job.id, node.id))
+    assert [(job.id, node_id) for job, node_id in index.place(jobs)] == expected
+
+
+@pytest.mark.parametrize('strategy', [strategy for strategy in PlacementStrategy
+                                      if strategy != PlacementStrategy.FIRST_FIT])
+def test_batch_place_matches_scored_strategy(engine, strategy):
+    rng = random.Random(11)
+    nodes = [make_node(str(i), rng) for i in range(50)]
+    index = get_capacity_index(engine, strategy)
+    for node in nodes:
+        index.add(node.model_copy())
+    jobs = [make_job(str(i), rng) for i in range(300)]
+
+    score = get_node_score(strategy)
+    expected = []
+    for job in jobs:
+        available = fit_available(job, nodes)
+        if available:
+            node = min(available, key=lambda node: score(
+                node.jobs_capacity - node.jobs_allocated, node.cpu_capacity - node.cpu_allocated,
+                node.memory_capacity - node.memory_allocated, node.jobs_capacity, node.cpu_capacity,
+                node.memory_capacity, job))
+            node.jobs_allocated += 1
+            node.cpu_allocated += job.requests_cpu
+            node.memory_allocated += job.requests_memory
+            expected.append((job.id, node.id))
+    assert [(job.id, node_id) for job, node_id in index.place(jobs)] == expected
+
+
+def test_best_fit_and_spread_choose_opposite_nodes(engine):
+    rng = random.Random(0)
+    job = make_job('1', rng)
+    job.requests_cpu, job.requests_memory = 1.0, 256
+    nodes = [Node(id=str(i), jobs_capacity=4, jobs_allocated=0, cpu_capacity=cpu, cpu_allocated=0,
+                  memory_capacity=memory, memory_allocated=0)
+             for i, (cpu, memory) in enumerate([(4.0, 2048), (1.0, 256), (8.0, 4096)])]
+    placed = {}
+    for strategy in PlacementStrategy:
+        index = get_capacity_index(engine, strategy)
+        for node in nodes:
+            index.add(node)
+        placed[strategy] = index.place([job])[0][1]
+    assert placed == {PlacementStrategy.FIRST_FIT: '0', PlacementStrategy.BEST_FIT: '1',
+                      PlacementStrategy.SPREAD: '2', PlacementStrategy.WEIGHTED: '1'}
+
+
+def test_place_stop_at_miss_and_exclude(engine):
+    rng = random.Random(0)
+    index = get_capacity_index(engine)
+    for i in range(2):
+        index.add(Node(id=str(i), jobs_capacity=2, jobs_allocated=0, cpu_capacity=2.0, cpu_allocated=0,
+                       memory_capacity=1024, memory_allocated=0))
+    small, big, other = (make_job(str(i), rng) for i in range(3))
+    small.requests_cpu, big.requests_cpu, other.requests_cpu = 1.0, 4.0, 1.0
+    small.requests_memory = big.requests_memory = other.requests_memory = 256
+
+    assert [node_id for _, node_id in index.place([small, big, other], stop_at_miss=True)] == ['0']
+    assert [node_id for _, node_id in index.place([other], exclude='0')] == ['1']
+    assert index.free('0') == (1, 1.0, 768)
+    assert [node_id for _, node_id in index.place([other])] == ['0']
+
+
+def test_place_stops_taking_jobs_when_full(engine):
+    rng = random.Random(0)
+    index = get_capacity_index(engine)
+    index.add(Node(id='0', jobs_capacity=2, jobs_allocated=0, cpu_capacity=4.0, cpu_allocated=0,
+                   memory_capacity=4096, memory_allocated=0))
+    taken = []
+
+    def jobs():
+        for i in range(10):
+            taken.append(i)
+            yield make_job(str(i), rng)
+
+    assert len(index.place(jobs())) == 2
+    assert len(taken) <= 3
+
+def test_release_and_node_snapshot(engine):
+    rng = random.Random(0)
+    index = get_capacity_index(engine)
+    node = Node(id='1', jobs_capacity=2, jobs_allocated=0, cpu_capacity=2.0, cpu_allocated=0,
+                memory_capacity=1024, memory_allocated=0)
+    index.add(node)
+    first, second = make_job('1', rng), make_job('2', rng)
+    first.requests_cpu, first.requests_memory = 0.1, 100
+    second.requests_cpu, second.requests_memory = 0.2, 200
+    index.place([first, second])
+    assert index.node('1').to_model().model_dump() == {**node.model_dump(), 'jobs_allocated': 2,
+                                                       'cpu_allocated': 0.1 + 0.2, 'memory_allocated': 300}
+    index.release('1', first)
+    assert (index.node('1').jobs_allocated, index.node('1').memory_allocated) == (1, 200)
+    index.release('1', second)
+    assert index.node('1').to_model() == node
+    assert index.node('2') is None
@@ -0,0 +1,63 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from entity import JobEvent, JobStatus
+from events import EventBus
+from scheduler import Scheduler
+from storage import StorageType
+from webserver import event_lines, register_urls
+
+
+def event(job_id, status=JobStatus.RUNNING, node_id='1'):
+    return JobEvent(job_id=job_id, status=status, node_id=node_id, time=0.0)
+
+
+@pytest.mark.asyncio
+async def test_event_bus_filters():
+    bus = EventBus()
+    by_job = bus.subscribe(job_ids=['1', '2'], statuses=[JobStatus.COMPLETED])
+    by_node = bus.subscribe(node_ids=['2'])
+    by_status = bus.subscribe(statuses=[JobStatus.NEW])
+    everything = bus.subscribe()
+    bus.publish([event('1'), event('2', JobStatus.COMPLETED), event('3', JobStatus.NEW, node_id='2')])
+
+    assert [e.job_id for e in await by_job.get()] == ['2']
+    assert [e.job_id for e in await by_node.get()] == ['3']
+    assert [e.job_id for e in await by_status.get()] == ['3']
+    assert [e.job_id for e in await everything.get()] == ['1', '2', '3']
+
+    for subscription in (by_job, by_node, by_status, everything):
+        subscription.close()
+    assert not bus.active
+    assert bus._by_job == bus._by_node == bus._by_status == {}
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_is_dropped():
+    bus = EventBus()
+    subscription = bus.subscribe(size=2)
+    bus.publish([event('1'), event('2'), event('3')])
+    assert subscription.overflowed and subscription.closed
+    assert not bus.active
+    assert [e.job_id for e in await subscription.get()] == ['1', '2']
+    assert await subscription.get() == []
+
+    lines = [line async for line in event_lines(subscription)]
+    assert lines == ['event: overflow\ndata: {}\n\n']
+
+
+@pytest.mark.asyncio
+async def test_event_stream():
+    scheduler = Scheduler(StorageType.MEMORY)
+    subscription = await scheduler.subscribe(job_ids=['1'])
+    scheduler.events.publish([event('1'), event('2')])
+    subscription.close()
+    lines = [line async for line in event_lines(subscription)]
+    assert lines == [f'event: job\ndata: {event("1").model_dump_json()}\n\n']
+
+
+def test_event_endpoint_rejects_unknown_status():
+    app = FastAPI()
+    register_urls(app, Scheduler(StorageType.MEMORY))
+    assert TestClient(app).get('/events', params={'status': 'sleeping'}).status_code == 422
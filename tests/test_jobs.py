@@ -1,3 +1,5 @@
+import json
+
 from fastapi import status
 
 
@@ -37,3 +39,47 @@ def test_job_deletion(client):
     assert client.delete(f'/jobs/{job_id}').status_code == status.HTTP_200_OK
     assert client.get(f'/jobs/{job_id}').status_code == status.HTTP_404_NOT_FOUND
     assert client.get('/jobs').json() == []
+
+
+def test_job_batch_add(client):
+    response = client.post('/jobs:batch', json=[{
+        "expected_run_time": i + 1,
+        "requests_cpu": 1.0,
+        "requests_memory": 100
+    } for i in range(3)])
+    assert response.status_code == status.HTTP_201_CREATED
+    job_ids = response.json()['ids']
+    assert len(set(job_ids)) == 3
+    assert [job['id'] for job in client.get('/jobs').json()] == job_ids
+    assert client.get(f'/jobs/{job_ids[2]}').json()['expected_run_time'] == 3
+
+
+def test_job_listing_pages(client):
+    job_ids = client.post('/jobs:batch', json=[{
+        "expected_run_time": 1,
+        "requests_cpu": 1.0,
+        "requests_memory": 100
+    }] * 5).json()['ids']
+    response = client.get('/jobs', params={'limit': 2})
+    assert [job['id'] for job in response.json()] == job_ids[:2]
+    response = client.get('/jobs', params={'limit': 2, 'cursor': response.headers['X-Next-Cursor']})
+    assert [job['id'] for job in response.json()] == job_ids[2:4]
+    response = client.get('/jobs', params={'limit': 2, 'cursor': response.headers['X-Next-Cursor']})
+    assert [job['id'] for job in response.json()] == job_ids[4:]
+    assert 'X-Next-Cursor' not in response.headers
+
+    assert client.get('/jobs', params={'status': 'running'}).json() == []
+    assert len(client.get('/jobs', params={'status': 'new'}).json()) == 5
+    assert client.get('/jobs', params={'limit': 0}).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_job_listing_ndjson(client):
+    job_ids = client.post('/jobs:batch', json=[{
+        "expected_run_time": 1,
+        "requests_cpu": 1.0,
+        "requests_memory": 100
+    }] * 3).json()['ids']
+    response = client.get('/jobs', params={'format': 'ndjson'})
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    lines = response.text.splitlines()
+    assert [json.loads(line)['id'] for line in lines] == job_ids
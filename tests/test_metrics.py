@@ -0,0 +1,66 @@
+import pytest
+
+from entity import NewJob, NewNode
+from metrics import Counter, Histogram
+from scheduler import Scheduler
+from storage import StorageType
+
+
+def test_histogram_samples():
+    histogram = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0), label='method')
+    histogram.observe(0.05, 'get')
+    histogram.observe(0.5, 'get')
+    histogram.observe(5.0, 'get')
+    assert histogram.samples({'shard': '0'}) == [
+        'latency_seconds_bucket{shard="0",method="get",le="0.1"} 1',
+        'latency_seconds_bucket{shard="0",method="get",le="1.0"} 2',
+        'latency_seconds_bucket{shard="0",method="get",le="+Inf"} 3',
+        'latency_seconds_sum{shard="0",method="get"} 5.55',
+        'latency_seconds_count{shard="0",method="get"} 3',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(scheduler, client):
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    await scheduler.new_jobs([NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=100)] * 2)
+    await scheduler._tick()
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    lines = response.text.splitlines()
+    assert 'scheduler_pending_jobs 1.0' in lines
+    assert 'scheduler_running_jobs 1.0' in lines
+    assert 'scheduler_tick_seconds_count 1' in lines
+    assert 'scheduler_job_wait_seconds_count 1' in lines
+    assert 'scheduler_storage_seconds_count{method="add_jobs"} 1' in lines
+    assert 'scheduler_lock_wait_seconds_count 2' in lines
+    assert '# TYPE scheduler_tick_seconds histogram' in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_disabled():
+    scheduler = Scheduler(StorageType.MEMORY, metrics=False)
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=100))
+    await scheduler._tick()
+    text = await scheduler.render_metrics()
+    assert 'scheduler_running_jobs 1.0' in text
+    assert 'scheduler_tick_seconds' not in text
+    assert 'add_job' not in vars(scheduler._storage)
+
+
+@pytest.mark.asyncio
+async def test_cache_metrics():
+    scheduler = Scheduler(StorageType.MEMORY, cache_size=10)
+    job_id = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=100))
+    await scheduler.get_job(job_id)
+    await scheduler.get_job('404')
+    await scheduler.flush()
+    lines = (await scheduler.render_metrics()).splitlines()
+    assert '# TYPE scheduler_cache_hits_total counter' in lines
+    assert 'scheduler_cache_hits_total{entity="job"} 1.0' in lines
+    assert 'scheduler_cache_misses_total{entity="job"} 1.0' in lines
+    assert 'scheduler_cache_flushed_writes_total{entity="job"} 1.0' in lines
+    assert Counter('requests_total', 'Requests.').samples({'shard': '1'}) == []
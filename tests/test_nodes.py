@@ -40,3 +40,16 @@ def test_node_deletion(client):
     assert client.delete(f'/nodes/{node_id}').status_code == status.HTTP_200_OK
     assert client.get(f'/nodes/{node_id}').status_code == status.HTTP_404_NOT_FOUND
     assert client.get('/nodes').json() == []
+
+
+def test_node_batch_add(client):
+    response = client.post('/nodes:batch', json=[{
+        "jobs_capacity": 10,
+        "cpu_capacity": float(i + 1),
+        "memory_capacity": 1000
+    } for i in range(3)])
+    assert response.status_code == status.HTTP_201_CREATED
+    node_ids = response.json()['ids']
+    assert len(set(node_ids)) == 3
+    assert [node['id'] for node in client.get('/nodes').json()] == node_ids
+    assert client.get(f'/nodes/{node_ids[1]}').json()['cpu_capacity'] == 2.0
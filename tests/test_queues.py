@@ -0,0 +1,79 @@
+import pytest
+
+from entity import Job, JobStatus
+from queues import FifoQueue, QueueType, get_queue
+
+
+def make_job(job_id, priority=0, tenant=None, requests_cpu=1.0, expected_run_time=10):
+    return Job(
+        id=job_id,
+        status=JobStatus.NEW,
+        expected_run_time=expected_run_time,
+        requests_cpu=requests_cpu,
+        requests_memory=100,
+        created_at=0,
+        started_at=None,
+        priority=priority,
+        tenant=tenant
+    )
+
+
+@pytest.fixture(params=list(QueueType))
+def queue(request):
+    return get_queue(request.param)
+
+
+def test_queue_basics(queue):
+    jobs = [make_job(str(i)) for i in range(5)]
+    queue.extend(jobs[1:4])
+    queue.push(jobs[4])
+    queue.push_front([jobs[0]])
+    assert list(queue) == ['0', '1', '2', '3', '4']
+    assert queue.remove('2') and not queue.remove('2')
+    assert '2' not in queue and '3' in queue
+    assert len(queue) == 4
+    assert list(queue) == ['0', '1', '3', '4']
+
+    # The heap based queues can have jobs taken out while they are walked, fifo walks its dict.
+    if not isinstance(queue, FifoQueue):
+        for job_id in queue:
+            if job_id in ('1', '3'):
+                queue.remove(job_id)
+        assert list(queue) == ['0', '4']
+
+
+def test_priority_order():
+    queue = get_queue(QueueType.PRIORITY)
+    queue.extend([make_job('1', priority=0), make_job('2', priority=5), make_job('3', priority=5),
+                  make_job('4', priority=-1)])
+    queue.push_front([make_job('5', priority=0)])
+    assert list(queue) == ['2', '3', '5', '1', '4']
+    assert queue.pop() == '2'
+    queue.remove('3')
+    assert queue.pop() == '5'
+    assert list(queue) == ['1', '4']
+
+
+def test_fair_share_interleaves_tenants_by_weight():
+    queue = get_queue(QueueType.FAIR_SHARE, {'big': 2.0})
+    queue.extend([make_job(f'a{i}', tenant='big') for i in range(6)])
+    queue.extend([make_job(f'b{i}', tenant='small') for i in range(3)])
+    order = list(queue)
+    assert order[:6] == ['a0', 'b0', 'a1', 'a2', 'b1', 'a3']
+
+    for job_id in ['a0', 'a1', 'a2', 'a3']:
+        queue.remove(job_id)
+        queue.charge(make_job(job_id, tenant='big'))
+    assert list(queue)[:2] == ['b0', 'b1']
+
+
+def test_fair_share_idle_tenant_does_not_bank_credit():
+    queue = get_queue(QueueType.FAIR_SHARE)
+    for i in range(3):
+        queue.push(make_job(f'a{i}', tenant='a'))
+    for i in range(2):
+        queue.remove(f'a{i}')
+        queue.charge(make_job(f'a{i}', tenant='a'))
+    queue.push(make_job('b0', tenant='b'))
+    queue.push(make_job('b1', tenant='b'))
+    assert list(queue) == ['a2', 'b0', 'b1']
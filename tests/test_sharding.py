@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from admission import Overloaded
+from entity import ActionStatus, JobStatus, NewJob, NewNode
+from sharding import DependencyError, ShardedScheduler
+from storage import StorageType
+
+
+@pytest_asyncio.fixture
+async def sharded():
+    scheduler = ShardedScheduler(2, StorageType.MEMORY)
+    await scheduler.start()
+    yield scheduler
+    scheduler.close()
+
+
+async def wait_for_status(scheduler, job_ids, status):
+    async with asyncio.timeout(10):
+        while True:
+            jobs = [await scheduler.get_job(job_id) for job_id in job_ids]
+            if all(job.status == status for job in jobs):
+                return jobs
+            await asyncio.sleep(0.05)
+
+
+@pytest.mark.asyncio
+async def test_sharded_routing_and_listing(sharded):
+    node_ids = await sharded.add_nodes([NewNode(jobs_capacity=10, cpu_capacity=10.0, memory_capacity=1000)] * 2)
+    assert sorted(node_ids) == ['1', '2']
+    job_ids = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10)] * 5)
+    assert len(set(job_ids)) == 5
+    jobs = await wait_for_status(sharded, job_ids, JobStatus.RUNNING)
+    assert {job.node_id for job in jobs} == set(node_ids)
+
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = await sharded.query_jobs(cursor=cursor, limit=2)
+        pages.append([job.id for job in page])
+        if cursor is None:
+            break
+    assert sorted(job_id for page in pages for job_id in page) == sorted(job_ids)
+    assert all(len(page) == 2 for page in pages[:-1])
+
+    assert await sharded.terminate_job(job_ids[0]) == ActionStatus.OK
+    assert (await sharded.get_job(job_ids[0])).status == JobStatus.TERMINATED
+    assert await sharded.delete_job(job_ids[1]) == ActionStatus.OK
+    assert await sharded.get_job(job_ids[1]) is None
+    assert await sharded.delete_job('unknown') == ActionStatus.NOT_FOUND
+
+    text = await sharded.render_metrics()
+    assert text.count('# TYPE scheduler_running_jobs gauge') == 1
+    assert 'scheduler_running_jobs{shard="0"}' in text and 'scheduler_running_jobs{shard="1"}' in text
+
+
+@pytest.mark.asyncio
+async def test_sharded_spill_over(sharded):
+    node_id = await sharded.add_node(NewNode(jobs_capacity=10, cpu_capacity=10.0, memory_capacity=1000))
+    job_ids = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10)] * 4)
+    await asyncio.sleep(0.2)
+    assert await sharded.spill() == 2
+    jobs = await wait_for_status(sharded, job_ids, JobStatus.RUNNING)
+    assert {job.node_id for job in jobs} == {node_id}
+    assert await sharded.spill() == 0
+    assert await sharded.terminate_job(job_ids[1]) == ActionStatus.OK
+
+    # Finished moved jobs are forgotten by both sides and still found.
+    finished, running = sorted(sharded._moved_jobs)
+    assert await sharded.terminate_job(finished) == ActionStatus.OK
+    await sharded.status()
+    assert list(sharded._moved_jobs) == [running]
+    assert (await sharded.get_job(finished)).status == JobStatus.TERMINATED
+    assert await sharded.delete_job(finished) == ActionStatus.OK
+    assert await sharded.get_job(finished) is None
+
+
+@pytest.mark.asyncio
+async def test_sharded_events(sharded):
+    subscription = await sharded.subscribe(statuses=[JobStatus.RUNNING])
+    await sharded.add_nodes([NewNode(jobs_capacity=10, cpu_capacity=10.0, memory_capacity=1000)] * 2)
+    job_ids = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10)] * 4)
+    seen = set()
+    async with asyncio.timeout(10):
+        while len(seen) < len(job_ids):
+            seen.update(event.job_id for event in await subscription.get())
+    assert seen == set(job_ids)
+    subscription.close()
+
+
+@pytest.mark.asyncio
+async def test_sharded_job_array(sharded):
+    await sharded.add_nodes([NewNode(jobs_capacity=2, cpu_capacity=10.0, memory_capacity=1000)] * 2)
+    array_ids = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10,
+                                               tasks=5)] * 2)
+    arrays = await wait_for_status(sharded, array_ids, JobStatus.RUNNING)
+    assert [array.tasks_running for array in arrays] == [2, 2]
+    assert (await sharded.get_job(f'{array_ids[1]}.1')).status == JobStatus.RUNNING
+    assert (await sharded.get_job(f'{array_ids[1]}.4')).status == JobStatus.NEW
+    assert await sharded.terminate_job(array_ids[1]) == ActionStatus.OK
+    assert (await sharded.get_job(f'{array_ids[1]}.4')).status == JobStatus.TERMINATED
+
+
+@pytest.mark.asyncio
+async def test_sharded_job_dependencies(sharded):
+    await sharded.add_nodes([NewNode(jobs_capacity=2, cpu_capacity=10.0, memory_capacity=1000)] * 2)
+    first = await sharded.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10))
+    dependents = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10,
+                                                depends_on=[first])] * 3)
+    assert {sharded._id_shard(job_id) for job_id in dependents} == {sharded._id_shard(first)}
+    await wait_for_status(sharded, [first], JobStatus.RUNNING)
+    assert {(await sharded.get_job(job_id)).status for job_id in dependents} == {JobStatus.WAITING}
+    assert await sharded.terminate_job(first) == ActionStatus.OK
+    await wait_for_status(sharded, dependents, JobStatus.FAILED)
+
+
+@pytest.mark.asyncio
+async def test_sharded_released_dependent_spills(sharded):
+    await sharded.add_nodes([NewNode(jobs_capacity=3, cpu_capacity=10.0, memory_capacity=1000),
+                             NewNode(jobs_capacity=1, cpu_capacity=10.0, memory_capacity=1000)])
+    _, parent = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10),
+                                        NewJob(expected_run_time=1, requests_cpu=1.0, requests_memory=10)])
+    _, blocker = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10)] * 2)
+    child = await sharded.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10,
+                                         depends_on=[parent]))
+    assert {sharded._id_shard(job_id) for job_id in (parent, blocker, child)} == {1}
+
+    # The blocker takes the slot the parent leaves, the released child moves to the other shard.
+    await wait_for_status(sharded, [blocker], JobStatus.RUNNING)
+    await wait_for_status(sharded, [child], JobStatus.NEW)
+    await asyncio.sleep(0.2)
+    assert await sharded.spill() == 1
+    assert sharded._moved_jobs == {child: 0}
+    await wait_for_status(sharded, [child], JobStatus.RUNNING)
+
+@pytest.mark.asyncio
+async def test_sharded_dependencies_on_two_shards_are_refused(sharded):
+    first, second = await sharded.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10)] * 2)
+    assert sharded._id_shard(first) != sharded._id_shard(second)
+    with pytest.raises(DependencyError):
+        await sharded.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10,
+                                     depends_on=[first, second]))
+    assert len(await sharded.get_jobs()) == 2
+
+
+@pytest.mark.asyncio
+async def test_sharded_admission_refuses_whole_batch():
+    sharded = ShardedScheduler(2, StorageType.MEMORY, max_pending=4)
+    await sharded.start()
+    try:
+        new_job = NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10)
+        await sharded.new_jobs([new_job] * 3)
+        # Each shard admits two, the first is full and the job the second took of the batch goes again.
+        with pytest.raises(Overloaded):
+            await sharded.new_jobs([new_job] * 2)
+        assert sum(status['pending'] for status in await sharded.status()) == 3
+        assert len(await sharded.get_jobs()) == 3
+    finally:
+        sharded.close()
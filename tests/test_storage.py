@@ -0,0 +1,347 @@
+import os
+
+import pytest
+import pytest_asyncio
+
+from entity import ActionStatus, Job, JobRecord, JobStatus, Node
+from cached_storage import CachedStorage, Write
+from persistence import log_generations, log_path
+from storage import MemoryStorage, SeqIndex, StorageType, get_storage
+
+STORAGE_URLS = {
+    StorageType.MEMORY: None,
+    StorageType.POSTGRESQL: os.environ.get('SCHEDULER_TEST_POSTGRES_URL'),
+    StorageType.REDIS: os.environ.get('SCHEDULER_TEST_REDIS_URL', 'fakeredis://'),
+}
+
+
+@pytest_asyncio.fixture(params=list(STORAGE_URLS) + ['cached'])
+async def storage(request):
+    storage_type = request.param
+    if storage_type == 'cached':
+        # Small enough that reads and updates go past the cache to the backend.
+        storage = CachedStorage(MemoryStorage(), size=3)
+        yield storage
+        storage.close()
+        return
+    url = STORAGE_URLS[storage_type]
+    if storage_type != StorageType.MEMORY and not url:
+        pytest.skip(f"no test url configured for {storage_type}")
+    if storage_type == StorageType.POSTGRESQL:
+        asyncpg = pytest.importorskip('asyncpg')
+        connection = await asyncpg.connect(url)
+        await connection.execute("DROP TABLE IF EXISTS jobs, nodes")
+        await connection.close()
+    if url == 'fakeredis://':
+        fakeredis = pytest.importorskip('fakeredis')
+        from redis_storage import RedisStorage
+        storage = RedisStorage(client=fakeredis.FakeAsyncRedis(decode_responses=True))
+    else:
+        storage = get_storage(storage_type, url)
+    if storage_type == StorageType.REDIS:
+        await storage._client.flushdb()
+    yield storage
+    storage.close()
+
+
+def make_job(job_id, status=JobStatus.NEW):
+    return Job(id=job_id, status=status, expected_run_time=10, requests_cpu=0.5,
+               requests_memory=128, created_at=1.5, started_at=None)
+
+
+def make_node(node_id):
+    return Node(id=node_id, jobs_capacity=4, jobs_allocated=0, cpu_capacity=2.0,
+                cpu_allocated=0, memory_capacity=1024, memory_allocated=0)
+
+
+@pytest.mark.asyncio
+async def test_job_lifecycle(storage):
+    await storage.add_job(make_job('1'))
+    await storage.add_jobs([make_job(str(i)) for i in range(2, 12)])
+    assert [job.id for job in await storage.get_jobs()] == [str(i) for i in range(1, 12)]
+
+    job = await storage.get_job('3')
+    job.status = JobStatus.RUNNING
+    job.started_at = 2.25
+    job.priority = 3
+    job.tenant = 'team-a'
+    job.tasks = 100
+    job.tasks_started = 40
+    job.tasks_running = 8
+    job.tasks_completed = 30
+    job.tasks_terminated = 2
+    job.depends_on = ['1', '2']
+    assert await storage.update_job(job) == ActionStatus.OK
+    assert await storage.get_job('3') == job
+    assert await storage.update_job(make_job('404')) == ActionStatus.NOT_FOUND
+
+    jobs = [await storage.get_job(str(i)) for i in range(4, 8)]
+    for job in jobs:
+        job.status = JobStatus.COMPLETED
+    await storage.update_jobs(jobs)
+    assert [(await storage.get_job(str(i))).status for i in range(4, 8)] == [JobStatus.COMPLETED] * 4
+
+    assert await storage.delete_job('1') == ActionStatus.OK
+    assert await storage.delete_job('1') == ActionStatus.NOT_FOUND
+    assert await storage.get_job('1') is None
+    assert await storage.get_job('404') is None
+    assert [job.id for job in await storage.get_jobs_by_status(JobStatus.COMPLETED)] == ['4', '5', '6', '7']
+    assert [job.id for job in await storage.get_jobs_by_status(JobStatus.RUNNING)] == ['3']
+    assert sorted(await storage.get_job_ids(), key=int) == [str(i) for i in range(2, 12)]
+
+    await storage.delete_jobs(['4', '5', '404'])
+    assert [job.id for job in await storage.get_jobs_by_status(JobStatus.COMPLETED)] == ['6', '7']
+
+
+@pytest.mark.asyncio
+async def test_node_lifecycle(storage):
+    await storage.add_node(make_node('1'))
+    await storage.add_nodes([make_node('2'), make_node('3')])
+    assert [node.id for node in await storage.get_nodes()] == ['1', '2', '3']
+
+    node = await storage.get_node('2')
+    node.jobs_allocated = 1
+    node.cpu_allocated = 0.1
+    node.memory_allocated = 64
+    assert await storage.update_node(node) == ActionStatus.OK
+    assert await storage.get_node('2') == node
+    assert await storage.update_node(make_node('404')) == ActionStatus.NOT_FOUND
+
+    node = await storage.get_node('3')
+    node.cpu_allocated = 1.5
+    await storage.update_nodes([node])
+    assert (await storage.get_node('3')).cpu_allocated == 1.5
+
+    assert await storage.delete_node('1') == ActionStatus.OK
+    assert await storage.delete_node('1') == ActionStatus.NOT_FOUND
+    assert [node.id for node in await storage.get_nodes()] == ['2', '3']
+
+
+@pytest.mark.asyncio
+async def test_query_jobs(storage):
+    jobs = [make_job(str(i), JobStatus.RUNNING if i % 2 else JobStatus.NEW) for i in range(1, 11)]
+    for job in jobs:
+        job.created_at = float(job.id)
+    await storage.add_jobs(jobs)
+
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = await storage.query_jobs(cursor=cursor, limit=3)
+        pages.append([job.id for job in page])
+        if cursor is None:
+            break
+        if len(pages) == 2:
+            await storage.delete_job(page[-1].id)
+    assert pages[:3] == [['1', '2', '3'], ['4', '5', '6'], ['7', '8', '9']]
+    assert [job_id for page in pages for job_id in page] == [str(i) for i in range(1, 11)]
+
+    page, cursor = await storage.query_jobs(status=JobStatus.RUNNING, created_after=3, created_before=9)
+    assert [job.id for job in page] == ['3', '5', '7']
+    assert cursor is None
+
+    page, cursor = await storage.query_jobs(status=JobStatus.NEW, limit=2)
+    assert [job.id for job in page] == ['2', '4']
+    page, cursor = await storage.query_jobs(status=JobStatus.NEW, cursor=cursor, limit=2)
+    assert [job.id for job in page] == ['8', '10']
+
+    streamed = [[job.id for job in page] async for page in storage.iter_job_pages(JobStatus.NEW, page_size=2)]
+    assert streamed == [['2', '4'], ['8', '10']]
+
+    job = await storage.get_job('8')
+    job.status = JobStatus.TERMINATED
+    await storage.update_job(job)
+    page, cursor = await storage.query_jobs(status=JobStatus.TERMINATED, limit=1)
+    assert [job.id for job in page] == ['8']
+    page, cursor = await storage.query_jobs(status=JobStatus.TERMINATED, cursor=cursor, limit=1)
+    assert page == [] and cursor is None
+
+    # A job that returns to a status keeps its place in it.
+    job.status = JobStatus.NEW
+    await storage.update_job(job)
+    page, cursor = await storage.query_jobs(status=JobStatus.NEW)
+    assert [job.id for job in page] == ['2', '4', '8', '10']
+
+
+@pytest.mark.asyncio
+async def test_query_nodes(storage):
+    await storage.add_nodes([make_node(str(i)) for i in range(1, 6)])
+    page, cursor = await storage.query_nodes(limit=2)
+    assert [node.id for node in page] == ['1', '2']
+    await storage.delete_node('3')
+    page, cursor = await storage.query_nodes(cursor=cursor, limit=2)
+    assert [node.id for node in page] == ['4', '5']
+    page, cursor = await storage.query_nodes(cursor=cursor, limit=2)
+    assert page == [] and cursor is None
+
+
+@pytest.mark.asyncio
+async def test_status_and_node_indexes(storage):
+    await storage.add_jobs([make_job(str(i)) for i in range(1, 6)])
+    assert await storage.count_jobs_by_status(JobStatus.NEW) == 5
+
+    for job_id, node_id in (('2', 'a'), ('3', 'b'), ('4', 'a')):
+        job = await storage.get_job(job_id)
+        job.status = JobStatus.RUNNING
+        job.node_id = node_id
+        await storage.update_jobs([job])
+    assert [job.id for job in await storage.get_node_jobs('a')] == ['2', '4']
+    assert [job.id for job in await storage.get_node_jobs('b')] == ['3']
+    assert [job.id for job in await storage.get_jobs_by_status(JobStatus.NEW)] == ['1', '5']
+    assert await storage.count_jobs_by_status(JobStatus.RUNNING) == 3
+
+    job = await storage.get_job('2')
+    job.status = JobStatus.COMPLETED
+    await storage.update_job(job)
+    await storage.delete_job('4')
+    assert await storage.get_node_jobs('a') == []
+    assert [job.id for job in await storage.get_jobs_by_status(JobStatus.COMPLETED)] == ['2']
+    assert await storage.count_jobs_by_status(JobStatus.RUNNING) == 1
+    assert await storage.get_node_jobs('unknown') == []
+
+
+@pytest.mark.asyncio
+async def test_stored_records_are_copies(storage):
+    jobs = [JobRecord.from_model(make_job(str(i))) for i in range(1, 4)]
+    await storage.add_jobs(jobs)
+    jobs[1].status = JobStatus.RUNNING
+    jobs[1].node_id = 'a'
+    assert (await storage.get_job('2')).status == JobStatus.NEW
+    assert [job.id for job in await storage.get_jobs_by_status(JobStatus.NEW)] == ['1', '2', '3']
+    assert await storage.get_jobs_by_status(JobStatus.RUNNING) == []
+
+    await storage.update_jobs([jobs[1]])
+    assert (await storage.get_job('2')).status == JobStatus.RUNNING
+    assert [job.id for job in await storage.get_node_jobs('a')] == ['2']
+    assert [job.id for job in await storage.get_jobs_by_status(JobStatus.NEW)] == ['1', '3']
+
+
+def test_seq_index_keeps_order_across_chunks():
+    index = SeqIndex(chunk_size=2)
+    seqs = [5, 1, 9, 3, 7, 2, 8, 4, 6]
+    for seq in seqs:
+        index.add(str(seq), seq)
+    assert [seq for seq, _ in index.after(0)] == list(range(1, 10))
+    for seq in (1, 4, 9):
+        index.remove(str(seq))
+    index.add('4', 4)
+    assert [item_id for _, item_id in index.after(2)] == ['3', '4', '5', '6', '7', '8']
+    assert len(index) == 7 and '9' not in index
+
+async def fill_storage(storage: MemoryStorage):
+    await storage.add_nodes([make_node('1'), make_node('2')])
+    await storage.add_jobs([make_job(str(i)) for i in range(1, 6)])
+    job = make_job('2', JobStatus.RUNNING)
+    job.node_id = '1'
+    job.started_at = 3.0
+    await storage.update_job(job)
+    node = make_node('1')
+    node.jobs_allocated = 1
+    await storage.update_nodes([node])
+    await storage.delete_job('4')
+    await storage.delete_node('2')
+
+
+async def storage_state(storage: MemoryStorage):
+    return await storage.get_jobs(), await storage.get_nodes(), await storage.get_node_jobs('1')
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_replays_log(tmp_path):
+    storage = MemoryStorage(str(tmp_path))
+    await fill_storage(storage)
+    state = await storage_state(storage)
+    # Reopened without close, as after a crash, everything comes back from the log alone.
+    assert await storage_state(MemoryStorage(str(tmp_path))) == state
+    assert [job.id for job in state[0]] == ['1', '2', '3', '5']
+
+    # A frame torn by the crash is dropped and appends continue after the last whole one.
+    path = log_path(str(tmp_path), log_generations(str(tmp_path))[-1])
+    with open(path, 'ab') as file:
+        file.write(b'\x40\x00\x00\x00partial')
+    reopened = MemoryStorage(str(tmp_path))
+    assert await storage_state(reopened) == state
+    await reopened.add_job(make_job('6'))
+    assert (await MemoryStorage(str(tmp_path)).get_job('6')) == make_job('6')
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_snapshot(tmp_path):
+    storage = MemoryStorage(str(tmp_path), snapshot_bytes=1)
+    await fill_storage(storage)
+    await storage._snapshot_task
+    await storage.add_job(make_job('7'))
+    await storage._snapshot_task
+    assert len(log_generations(str(tmp_path))) == 1
+    state = await storage_state(storage)
+    assert await storage_state(MemoryStorage(str(tmp_path))) == state
+
+    storage.close()
+    assert log_generations(str(tmp_path)) == []
+    assert await storage_state(MemoryStorage(str(tmp_path))) == state
+
+
+@pytest.mark.asyncio
+async def test_cached_storage_batches_writes():
+    backend = MemoryStorage()
+    calls = []
+    for method in ('add_jobs', 'update_jobs', 'delete_jobs', 'get_job', 'add_nodes', 'update_nodes'):
+        def record(*args, method=method, call=getattr(backend, method)):
+            calls.append(method)
+            return call(*args)
+        setattr(backend, method, record)
+    storage = CachedStorage(backend, size=2, flush_interval=60)
+
+    await storage.add_jobs([make_job(str(i)) for i in range(1, 5)])
+    await storage.add_nodes([make_node('1')])
+    job = make_job('1', JobStatus.RUNNING)
+    await storage.update_jobs([job])
+    await storage.delete_jobs(['2'])
+    assert await storage.update_job(make_job('404')) == ActionStatus.NOT_FOUND
+    assert (await storage.get_job('1')).status == JobStatus.RUNNING
+    assert await storage.get_job('2') is None
+    # Added and deleted between flushes, the backend never sees the job.
+    assert calls == ['get_job', 'get_job']
+
+    await storage.flush()
+    assert calls[2:] == ['add_nodes', 'add_jobs']
+    assert [job.id for job in await backend.get_jobs()] == ['1', '3', '4']
+    assert (await backend.get_job('1')).status == JobStatus.RUNNING
+
+    calls.clear()
+    await storage.update_jobs([make_job('3', JobStatus.COMPLETED)])
+    await storage.delete_jobs(['4'])
+    await storage.flush()
+    assert calls == ['update_jobs', 'delete_jobs']
+    assert [(job.id, job.status) for job in await backend.get_jobs()] == [('1', JobStatus.RUNNING),
+                                                                        ('3', JobStatus.COMPLETED)]
+    assert await storage.get_job('1') is not None
+    assert storage.hits.value('job') == 2 and storage.misses.value('job') == 2
+    assert storage.flushed.value('job') == 5
+
+
+@pytest.mark.asyncio
+async def test_cached_storage_keeps_writes_the_backend_missed():
+    backend = MemoryStorage()
+    await backend.add_jobs([make_job('1')])
+    calls = []
+    update_jobs = backend.update_jobs
+
+    async def fail_once(jobs):
+        calls.append([job.id for job in jobs])
+        if len(calls) == 1:
+            raise ConnectionError('backend went away')
+        await update_jobs(jobs)
+    backend.update_jobs = fail_once
+    storage = CachedStorage(backend, size=2, flush_interval=60)
+
+    await storage.add_jobs([make_job('2')])
+    await storage.update_jobs([make_job('1', JobStatus.RUNNING)])
+    with pytest.raises(ConnectionError):
+        await storage.flush()
+    # The add went through before the update failed, only the update is sent again.
+    assert storage._job_writes == {'1': (Write.UPDATE, JobRecord.from_model(make_job('1', JobStatus.RUNNING)))}
+    await storage.flush()
+    assert calls == [['1'], ['1']]
+    assert [(job.id, job.status) for job in await backend.get_jobs()] == [('1', JobStatus.RUNNING),
+                                                                        ('2', JobStatus.NEW)]
@@ -1,6 +1,11 @@
 import asyncio
 import pytest
 
+from entity import ActionStatus, NewJob, NewNode, JobStatus
+from queues import QueueType
+from scheduler import DependencyPolicy, Scheduler
+from storage import StorageType
+
 
 @pytest.mark.asyncio
 async def test_one_job(scheduler, client):
@@ -44,3 +49,411 @@ async def test_one_job(scheduler, client):
     job = client.get(f'/jobs/{job_id}').json()
     assert job['id'] == job_id
     assert job['status'] == "completed"
+
+
+@pytest.mark.asyncio
+async def test_event_driven_completion(scheduler):
+    runner = asyncio.create_task(scheduler.run())
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    first_id = await scheduler.new_job(NewJob(expected_run_time=1, requests_cpu=1.0, requests_memory=100))
+    second_id = await scheduler.new_job(NewJob(expected_run_time=1, requests_cpu=1.0, requests_memory=100))
+    await asyncio.sleep(0.2)
+    assert (await scheduler.get_job(first_id)).status == JobStatus.RUNNING
+    assert (await scheduler.get_job(second_id)).status == JobStatus.NEW
+
+    await asyncio.sleep(1.0)
+    assert (await scheduler.get_job(first_id)).status == JobStatus.COMPLETED
+    assert (await scheduler.get_job(second_id)).status == JobStatus.RUNNING
+    runner.cancel()
+
+
+@pytest.mark.asyncio
+async def test_node_deletion_requeues_jobs_first(scheduler):
+    node_id = await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    job_ids = await scheduler.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=100)] * 3)
+    await scheduler._tick()
+    assert (await scheduler.get_job(job_ids[0])).node_id == node_id
+
+    await scheduler.delete_node(node_id)
+    interrupted = await scheduler.get_job(job_ids[0])
+    assert interrupted.status == JobStatus.NEW and interrupted.node_id is None
+    assert list(scheduler.pending_jobs) == job_ids
+
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    await scheduler._tick()
+    assert (await scheduler.get_job(job_ids[0])).status == JobStatus.RUNNING
+    assert list(scheduler.pending_jobs) == job_ids[1:]
+
+
+@pytest.mark.asyncio
+async def test_priority_queue_places_high_priority_first():
+    scheduler = Scheduler(StorageType.MEMORY, queue=QueueType.PRIORITY)
+    low_id, high_id = await scheduler.new_jobs([
+        NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=100, priority=0, tenant='a'),
+        NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=100, priority=10, tenant='b')
+    ])
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    await scheduler._tick()
+    high = await scheduler.get_job(high_id)
+    assert high.status == JobStatus.RUNNING and high.tenant == 'b'
+    assert list(scheduler.pending_jobs) == [low_id]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('backfill', [False, True])
+async def test_backfill_keeps_reservation_for_blocked_job(backfill):
+    scheduler = Scheduler(StorageType.MEMORY, backfill=backfill)
+    await scheduler.add_node(NewNode(jobs_capacity=4, cpu_capacity=4.0, memory_capacity=400))
+    running_id = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=2.0, requests_memory=100))
+    await scheduler._tick()
+    big_id, long_id, short_id = await scheduler.new_jobs([
+        NewJob(expected_run_time=10, requests_cpu=4.0, requests_memory=100),
+        NewJob(expected_run_time=100, requests_cpu=1.0, requests_memory=100),
+        NewJob(expected_run_time=5, requests_cpu=1.0, requests_memory=100)
+    ])
+    await scheduler._tick()
+    assert (await scheduler.get_job(running_id)).status == JobStatus.RUNNING
+    assert (await scheduler.get_job(big_id)).status == JobStatus.NEW
+    assert (await scheduler.get_job(short_id)).status == JobStatus.RUNNING
+    expected = JobStatus.NEW if backfill else JobStatus.RUNNING
+    assert (await scheduler.get_job(long_id)).status == expected
+
+
+@pytest.mark.asyncio
+async def test_tick_writes_only_dirty_nodes(scheduler):
+    node_ids = await scheduler.add_nodes([NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100)] * 10)
+    await scheduler.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=100)] * 2)
+    written = []
+    update_nodes = scheduler._storage.update_nodes
+
+    async def record_update_nodes(nodes):
+        written.append([node.id for node in nodes])
+        await update_nodes(nodes)
+
+    scheduler._storage.update_nodes = record_update_nodes
+    await scheduler._tick()
+    assert written == [node_ids[:2]]
+    assert [(await scheduler.get_node(node_id)).jobs_allocated for node_id in node_ids[:3]] == [1, 1, 0]
+
+    written.clear()
+    scheduler.next_schedule_time = 0
+    await scheduler._tick()
+    assert written == []
+
+
+@pytest.mark.asyncio
+async def test_consistency_check_repairs_drift(scheduler):
+    node_id = await scheduler.add_node(NewNode(jobs_capacity=4, cpu_capacity=4.0, memory_capacity=400))
+    await scheduler.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=100)] * 2)
+    await scheduler._tick()
+    assert await scheduler.check_consistency() == []
+
+    drifted = scheduler._capacity.node(node_id)
+    drifted.cpu_allocated = 3.5
+    scheduler._capacity.update(drifted)
+    assert await scheduler.check_consistency() == [node_id]
+    node = await scheduler.get_node(node_id)
+    assert (node.jobs_allocated, node.cpu_allocated, node.memory_allocated) == (2, 2.0, 200)
+    assert scheduler._capacity.node(node_id).to_model() == node
+
+
+@pytest.mark.asyncio
+async def test_submission_does_not_wait_for_storage_writes(scheduler):
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    async with scheduler.lock:
+        job_id = await asyncio.wait_for(
+            scheduler.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=100)), 1)
+    assert (await scheduler.get_job(job_id)).status == JobStatus.NEW
+    await scheduler._tick()
+    assert (await scheduler.get_job(job_id)).status == JobStatus.RUNNING
+    assert await scheduler.delete_job(job_id) == ActionStatus.OK
+    assert scheduler._capacity.node('1').jobs_allocated == 0
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock():
+    now = [100.0]
+    scheduler = Scheduler(StorageType.MEMORY, clock=lambda: now[0])
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    job_id = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=100))
+    await scheduler._tick()
+    job = await scheduler.get_job(job_id)
+    assert (job.status, job.created_at, job.started_at) == (JobStatus.RUNNING, 100.0, 100.0)
+    assert scheduler.next_schedule_time == 110.0
+
+    now[0] = 110.0
+    await scheduler._tick()
+    assert (await scheduler.get_job(job_id)).status == JobStatus.COMPLETED
+
+
+@pytest.mark.asyncio
+async def test_retention_archives_finished_jobs(tmp_path):
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, clock=lambda: now[0], retention_age=3600, retention_count=2,
+                          archive_path=str(tmp_path / 'jobs.archive'))
+    await scheduler.add_node(NewNode(jobs_capacity=10, cpu_capacity=10.0, memory_capacity=1000))
+    job_ids = await scheduler.new_jobs([NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10)] * 4)
+    await scheduler._tick()
+    assert await scheduler.terminate_job(job_ids[0]) == ActionStatus.OK
+    now[0] = 10.0
+    await scheduler._tick()
+    assert len(await scheduler.get_jobs()) == 2
+    assert [job.id for job in await scheduler.get_jobs()] == job_ids[2:]
+    archived = await scheduler.get_job(job_ids[0])
+    assert (archived.status, archived.started_at) == (JobStatus.TERMINATED, 0.0)
+    assert (await scheduler.get_job(job_ids[1])).status == JobStatus.COMPLETED
+
+    now[0] = 10.0 + 3600 + 1
+    await scheduler._tick()
+    assert await scheduler.get_jobs() == []
+    assert (await scheduler.get_job(job_ids[3])).status == JobStatus.COMPLETED
+    scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_restart_recovers_from_storage(tmp_path):
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    node_ids = await scheduler.add_nodes([NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100)] * 2)
+    job_ids = await scheduler.new_jobs([NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=100)] * 3)
+    await scheduler._tick()
+    assert await scheduler.delete_node(node_ids[1]) == ActionStatus.OK
+
+    # Nothing is closed, the second scheduler starts from the write-ahead log as after a crash.
+    restarted = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await restarted.start()
+    assert restarted.jobs_nodes == {job_ids[0]: node_ids[0]}
+    assert restarted.status()['pending'] == 2
+    assert await restarted.check_consistency() == []
+    assert restarted.next_schedule_time == 0.0
+    assert await restarted.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=100)) == '4'
+    assert await restarted.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100)) != node_ids[0]
+
+    now[0] = 10.0
+    await restarted._tick()
+    assert (await restarted.get_job(job_ids[0])).status == JobStatus.COMPLETED
+    assert {job.id for job in await restarted.get_jobs() if job.status == JobStatus.RUNNING} == set(job_ids[1:])
+    restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_ticks_do_not_grow_the_log(tmp_path):
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=100))
+    await scheduler._tick()
+    now[0] = 10.0
+    await scheduler._tick()
+    size = scheduler._storage._log.size
+    for now[0] in range(70, 6000, 60):
+        await scheduler._tick()
+    assert scheduler._storage._log.size == size
+    scheduler.close()
+
+
+@pytest.mark.asyncio
+async def test_job_events(scheduler):
+    node_id = await scheduler.add_node(NewNode(jobs_capacity=2, cpu_capacity=2.0, memory_capacity=200))
+    job_ids = await scheduler.new_jobs([NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=100)] * 2)
+    first = await scheduler.subscribe(job_ids=[job_ids[0]])
+    on_node = await scheduler.subscribe(node_ids=[node_id], statuses=[JobStatus.NEW])
+    everything = await scheduler.subscribe()
+    await scheduler._tick()
+    assert [(event.job_id, event.status, event.node_id) for event in await first.get()] == \
+        [(job_ids[0], JobStatus.RUNNING, node_id)]
+
+    assert await scheduler.terminate_job(job_ids[0]) == ActionStatus.OK
+    await scheduler.delete_node(node_id)
+    assert [(event.job_id, event.status) for event in await first.get()] == [(job_ids[0], JobStatus.TERMINATED)]
+    assert [(event.job_id, event.node_id) for event in await on_node.get()] == [(job_ids[1], node_id)]
+    assert [event.status for event in await everything.get()] == \
+        [JobStatus.RUNNING, JobStatus.RUNNING, JobStatus.TERMINATED, JobStatus.NEW]
+
+
+@pytest.mark.asyncio
+async def test_job_array():
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, clock=lambda: now[0])
+    node_ids = await scheduler.add_nodes([NewNode(jobs_capacity=2, cpu_capacity=2.0, memory_capacity=200)] * 2)
+    array_id = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10, tasks=10))
+    await scheduler._tick()
+    array = await scheduler.get_job(array_id)
+    assert (array.status, array.tasks_started, array.tasks_running) == (JobStatus.RUNNING, 4, 4)
+    assert len(scheduler._storage.jobs) == 5
+    assert list(scheduler.pending_jobs) == [array_id]
+    assert (await scheduler.get_job(f'{array_id}.3')).status == JobStatus.RUNNING
+    assert (await scheduler.get_job(f'{array_id}.9')).status == JobStatus.NEW
+    assert await scheduler.get_job(f'{array_id}.10') is None
+
+    now[0] = 10.0
+    await scheduler._tick()
+    array = await scheduler.get_job(array_id)
+    assert (array.tasks_started, array.tasks_running, array.tasks_completed) == (8, 4, 4)
+    assert (await scheduler.get_job(f'{array_id}.0')).status == JobStatus.COMPLETED
+    assert len(scheduler._storage.jobs) == 5
+
+    # Interrupted tasks run again under their own index.
+    await scheduler.delete_node(node_ids[0])
+    assert (await scheduler.get_job(array_id)).tasks_running == 2
+    interrupted = [job.id for job in scheduler._pending.values() if job.id != array_id]
+    assert len(interrupted) == 2
+    await scheduler.add_node(NewNode(jobs_capacity=2, cpu_capacity=2.0, memory_capacity=200))
+    await scheduler._tick()
+    assert {(await scheduler.get_job(job_id)).status for job_id in interrupted} == {JobStatus.RUNNING}
+
+    assert await scheduler.terminate_job(array_id) == ActionStatus.OK
+    array = await scheduler.get_job(array_id)
+    assert (array.status, array.tasks_running, array.tasks_completed, array.tasks_terminated) == \
+        (JobStatus.TERMINATED, 0, 4, 6)
+    assert (await scheduler.get_job(f'{array_id}.9')).status == JobStatus.TERMINATED
+    assert (await scheduler.get_job(interrupted[0])).status == JobStatus.TERMINATED
+    assert scheduler.status() == {'pending': 0, 'unplaced': 0, 'running': 0, 'max_free': (2, 2.0, 200)}
+    assert await scheduler.check_consistency() == []
+
+    assert await scheduler.delete_job(array_id) == ActionStatus.OK
+    assert scheduler._storage.jobs == {}
+
+
+@pytest.mark.asyncio
+async def test_job_array_recovers_from_storage(tmp_path):
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await scheduler.add_node(NewNode(jobs_capacity=3, cpu_capacity=3.0, memory_capacity=300))
+    array_id = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10, tasks=5))
+    await scheduler._tick()
+
+    restarted = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await restarted.start()
+    assert restarted.status()['running'] == 3
+    now[0] = 10.0
+    await restarted._tick()
+    now[0] = 20.0
+    await restarted._tick()
+    array = await restarted.get_job(array_id)
+    assert (array.status, array.tasks_completed) == (JobStatus.COMPLETED, 5)
+    assert list(restarted._storage.jobs) == [array_id]
+    restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_restart_keeps_arrays_in_submission_order(tmp_path):
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    array_id = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10, tasks=3))
+    await scheduler._tick()
+    job_ids = await scheduler.new_jobs([NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10)] * 2)
+
+    # The array has started a task, the rest of it still comes before the jobs submitted after it.
+    restarted = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await restarted.start()
+    assert list(restarted._intake) == [array_id] + job_ids
+    now[0] = 10.0
+    await restarted._tick()
+    assert restarted.jobs_nodes == {f'{array_id}.1': '1'}
+    restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_job_dependencies():
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, clock=lambda: now[0])
+    await scheduler.add_node(NewNode(jobs_capacity=4, cpu_capacity=4.0, memory_capacity=400))
+    first = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10))
+    array = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10, tasks=2,
+                                           depends_on=[first]))
+    last = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10,
+                                          depends_on=[first, array]))
+    assert (await scheduler.get_job(array)).status == JobStatus.WAITING
+    await scheduler._tick()
+    assert [job.id for job in await scheduler.get_jobs() if job.status == JobStatus.RUNNING] == [first]
+
+    # A completion releases its dependents in the same tick.
+    now[0] = 10.0
+    await scheduler._tick()
+    assert (await scheduler.get_job(array)).status == JobStatus.RUNNING
+    assert (await scheduler.get_job(last)).status == JobStatus.WAITING
+    now[0] = 20.0
+    await scheduler._tick()
+    assert (await scheduler.get_job(last)).status == JobStatus.RUNNING
+
+    late = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10,
+                                          depends_on=[first]))
+    unknown = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10,
+                                             depends_on=['999']))
+    assert (await scheduler.get_job(late)).status == JobStatus.NEW
+    assert (await scheduler.get_job(unknown)).status == JobStatus.FAILED
+    assert (await scheduler.get_job(late)).depends_on == [first]
+
+
+@pytest.mark.asyncio
+async def test_dependency_on_unstarted_task():
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, clock=lambda: now[0])
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    array = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10, tasks=10))
+    await scheduler._tick()
+    after_task = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10,
+                                                depends_on=[f'{array}.1']))
+    never_runs = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10,
+                                                depends_on=[f'{array}.5']))
+    assert (await scheduler.get_job(after_task)).status == JobStatus.WAITING
+
+    now[0] = 10.0
+    await scheduler._tick()
+    now[0] = 20.0
+    await scheduler._tick()
+    assert (await scheduler.get_job(after_task)).status == JobStatus.NEW
+    assert (await scheduler.get_job(never_runs)).status == JobStatus.WAITING
+    assert await scheduler.terminate_job(array) == ActionStatus.OK
+    assert (await scheduler.get_job(never_runs)).status == JobStatus.FAILED
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('policy', list(DependencyPolicy))
+async def test_dependency_policy(policy):
+    scheduler = Scheduler(StorageType.MEMORY, dependency_policy=policy)
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    root = await scheduler.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10))
+    child = await scheduler.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10,
+                                           depends_on=[root]))
+    grandchild = await scheduler.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10,
+                                                depends_on=[child]))
+    await scheduler._tick()
+    assert await scheduler.terminate_job(root) == ActionStatus.OK
+    expected = JobStatus.FAILED if policy == DependencyPolicy.FAIL else JobStatus.TERMINATED
+    assert [(await scheduler.get_job(job_id)).status for job_id in (child, grandchild)] == [expected] * 2
+
+    root = await scheduler.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10))
+    child = await scheduler.new_job(NewJob(expected_run_time=60, requests_cpu=1.0, requests_memory=10,
+                                           depends_on=[root]))
+    assert await scheduler.delete_job(root) == ActionStatus.OK
+    child_job = await scheduler.get_job(child)
+    if policy == DependencyPolicy.FAIL:
+        assert child_job.status == JobStatus.FAILED
+    else:
+        assert child_job is None
+    assert scheduler._waiting == {} and scheduler._unmet == {}
+
+
+@pytest.mark.asyncio
+async def test_waiting_jobs_recover_from_storage(tmp_path):
+    now = [0.0]
+    scheduler = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await scheduler.add_node(NewNode(jobs_capacity=1, cpu_capacity=1.0, memory_capacity=100))
+    first = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10))
+    second = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10,
+                                            depends_on=[first]))
+    third = await scheduler.new_job(NewJob(expected_run_time=10, requests_cpu=1.0, requests_memory=10,
+                                           depends_on=[second]))
+    await scheduler._tick()
+
+    restarted = Scheduler(StorageType.MEMORY, storage_url=str(tmp_path), clock=lambda: now[0])
+    await restarted.start()
+    assert list(restarted._waiting) == [second, third]
+    for now[0] in (10.0, 20.0, 30.0):
+        await restarted._tick()
+    assert [(await restarted.get_job(job_id)).status for job_id in (first, second, third)] == \
+        [JobStatus.COMPLETED] * 3
+    restarted.close()